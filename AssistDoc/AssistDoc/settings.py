@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "app.db_router.epinglage_primaire",
 ]
 
 ROOT_URLCONF = "AssistDoc.urls"
@@ -80,17 +82,74 @@ WSGI_APPLICATION = "AssistDoc.wsgi.application"
 
 
 # settings.py
-DATABASES = {
-    "default": {
+# Base principale et réplica sont jointes par le pooler de transactions Supabase (port 6543),
+# qui regroupe déjà les connexions côté serveur:
+# - DB_CONN_MAX_AGE=0 par défaut: sous ASGI, Django déconseille les connexions persistantes
+#   (une par thread de sync_to_async, fermées trop tard)
+# - DB_POOL_ENABLED: pool côté client de Django (psycopg 3 + psycopg-pool, voir requirements.txt),
+#   utile pour une base jointe directement, sans pooler
+# - ni curseurs côté serveur ni instructions préparées: d'une transaction à l'autre, le pooler
+#   peut changer de connexion serveur
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 0))  # secondes
+DB_POOL_ENABLED = os.getenv('DB_POOL_ENABLED', 'False') == 'True'
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+
+
+def _base_postgres(**parametres):
+    base = {
         "ENGINE": "django.db.backends.postgresql",
-        "NAME": os.getenv('DB_NAME', 'postgres'),
-        "USER": os.getenv('DB_USER', 'postgres.hmgkxpaswqbzddptyugh'),
-        "PASSWORD": os.getenv('DB_PASSWORD', 'JTe$C5a@DaXu5ZUE'),
-        "HOST": os.getenv('DB_HOST', 'aws-0-eu-central-1.pooler.supabase.com'),
-        "PORT": os.getenv('DB_PORT', '6543'),
+        **parametres,
+        "CONN_HEALTH_CHECKS": True,
+        "DISABLE_SERVER_SIDE_CURSORS": True,
+        "OPTIONS": {"prepare_threshold": None},
     }
+    if DB_POOL_ENABLED:
+        from psycopg_pool import ConnectionPool
+
+        # Le pool remplace les connexions persistantes (CONN_MAX_AGE doit valoir 0)
+        base["CONN_MAX_AGE"] = 0
+        base["OPTIONS"]["pool"] = {
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": 10,
+            "check": ConnectionPool.check_connection,  # connexion testée à chaque emprunt
+        }
+    else:
+        base["CONN_MAX_AGE"] = DB_CONN_MAX_AGE
+    return base
+
+
+DATABASES = {
+    "default": _base_postgres(
+        NAME=os.getenv('DB_NAME', 'postgres'),
+        USER=os.getenv('DB_USER', 'postgres.hmgkxpaswqbzddptyugh'),
+        PASSWORD=os.getenv('DB_PASSWORD', 'JTe$C5a@DaXu5ZUE'),
+        HOST=os.getenv('DB_HOST', 'aws-0-eu-central-1.pooler.supabase.com'),
+        PORT=os.getenv('DB_PORT', '6543'),
+    )
 }
 
+# Réplica en lecture (analytics de l'admin, métriques, analyse des patterns, export): app.db_router.
+# Sans DB_REPLICA_HOST, tout est lu sur la base principale
+DATABASE_REPLICA_ALIAS = 'replica'
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASES[DATABASE_REPLICA_ALIAS] = _base_postgres(
+        NAME=os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        USER=os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        PASSWORD=os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        HOST=os.getenv('DB_REPLICA_HOST'),
+        PORT=os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        # Tests: même base de test que default
+        TEST={"MIRROR": "default"},
+    )
+elif sys.argv[1:2] == ['test']:
+    # Tests sans réplica configuré: alias local miroir de la base de test, pour que
+    # le routage des lectures soit toujours vérifié (ReadReplicaRouterTests)
+    DATABASES[DATABASE_REPLICA_ALIAS] = {**DATABASES['default'], "TEST": {"MIRROR": "default"}}
+
+DATABASE_ROUTERS = ['app.db_router.ReadReplicaRouter']
+
 
 # DATABASES = {
 #     "default": {
@@ -144,5 +203,79 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Configuration de l'API Gemini
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# Nombre maximal de modèles Gemini configurés gardés en mémoire par processus
+GEMINI_MODEL_REGISTRY_SIZE = int(os.getenv('GEMINI_MODEL_REGISTRY_SIZE', 32))
+
+# Cache des recommandations Gemini (consultations resoumises): taille et durée de vie en secondes
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', 256))
+RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', 900))
+
+# Budgets de tokens des prompts (estimation locale): données patient et instruction système enrichie
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 1500))
+PROMPT_SYSTEM_TOKEN_BUDGET = int(os.getenv('PROMPT_SYSTEM_TOKEN_BUDGET', 1200))
+# Âge maximal (secondes) de l'instantané mémoire des patterns de feedback utilisé pour enrichir les prompts
+PROMPT_PATTERNS_SNAPSHOT_MAX_AGE = int(os.getenv('PROMPT_PATTERNS_SNAPSHOT_MAX_AGE', 300))
+# Intervalle (secondes) de relecture de la version des patterns partagée en base: délai maximal avant
+# qu'une modification faite dans un autre processus invalide l'instantané et les caches de celui-ci
+PROMPT_PATTERNS_VERSION_CHECK_INTERVAL = int(os.getenv('PROMPT_PATTERNS_VERSION_CHECK_INTERVAL', 5))
+# Nombre maximal de patterns liés aux symptômes ajoutés au prompt (les plus pertinents d'abord)
+PROMPT_SYMPTOM_PATTERNS_LIMIT = int(os.getenv('PROMPT_SYMPTOM_PATTERNS_LIMIT', 5))
+
+# Backend LLM: 'gemini' (production) ou 'fake' (réponses locales pour les tests de charge)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+LLM_FAKE_LATENCY = os.getenv('LLM_FAKE_LATENCY', 'lognormal')  # constant, uniform ou lognormal
+LLM_FAKE_LATENCY_MS = float(os.getenv('LLM_FAKE_LATENCY_MS', 800))  # médiane pour lognormal
+LLM_FAKE_LATENCY_SIGMA = float(os.getenv('LLM_FAKE_LATENCY_SIGMA', 0.5))
+LLM_FAKE_ERROR_RATE = float(os.getenv('LLM_FAKE_ERROR_RATE', 0.0))
+LLM_FAKE_THROTTLE_RATE = float(os.getenv('LLM_FAKE_THROTTLE_RATE', 0.0))  # réponses 429 simulées
+LLM_FAKE_SEED = int(os.getenv('LLM_FAKE_SEED')) if os.getenv('LLM_FAKE_SEED') else None
+
+# Limitation des appels LLM: concurrence par processus (AIMD) et débit global partagé en base
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+LLM_MIN_CONCURRENCY = int(os.getenv('LLM_MIN_CONCURRENCY', 1))
+LLM_RATE_LIMIT_PER_MINUTE = int(os.getenv('LLM_RATE_LIMIT_PER_MINUTE', 0))  # 0 = pas de limite globale
+LLM_RATE_LIMIT_BURST = int(os.getenv('LLM_RATE_LIMIT_BURST', 10))
+LLM_SLOT_TIMEOUT = float(os.getenv('LLM_SLOT_TIMEOUT', 30))  # secondes d'attente max d'un créneau
+
+# Résilience des appels LLM: délais, retries avec jitter, hedging au p95 et disjoncteur
+LLM_RESILIENCE_ENABLED = os.getenv('LLM_RESILIENCE_ENABLED', 'True') == 'True'
+LLM_CALL_TIMEOUT = float(os.getenv('LLM_CALL_TIMEOUT', 20))  # secondes par tentative
+LLM_TOTAL_DEADLINE = float(os.getenv('LLM_TOTAL_DEADLINE', 45))  # secondes pour l'appel complet
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'True') == 'True'
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_RECOVERY = float(os.getenv('LLM_BREAKER_RECOVERY', 30))
+
+# Cache de contexte Gemini: instruction système enrichie stockée côté API et référencée par handle.
+# L'API impose une taille minimale selon le modèle (4 096 tokens pour gemini-1.5-flash).
+# Avec PROMPT_SYSTEM_TOKEN_BUDGET=1200, l'instruction n'atteint jamais ce minimum: le cache reste
+# inactif tant que ce budget n'est pas relevé au-dessus (le schéma de réponse, lui, ne peut pas y entrer)
+GEMINI_CONTEXT_CACHE_ENABLED = os.getenv('GEMINI_CONTEXT_CACHE_ENABLED', 'False') == 'True'
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv('GEMINI_CONTEXT_CACHE_TTL', 3600))  # secondes
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv('GEMINI_CONTEXT_CACHE_MIN_TOKENS', 4096))
+GEMINI_CONTEXT_CACHE_RETRY_BACKOFF = int(os.getenv('GEMINI_CONTEXT_CACHE_RETRY_BACKOFF', 30))  # secondes, doublé à chaque échec
+
+# Pré-analyse spéculative pendant la saisie du formulaire symptome (plafonnée par médecin)
+SPECULATIVE_ANALYSIS_ENABLED = os.getenv('SPECULATIVE_ANALYSIS_ENABLED', 'True') == 'True'
+SPECULATIVE_ANALYSIS_DEBOUNCE_MS = int(os.getenv('SPECULATIVE_ANALYSIS_DEBOUNCE_MS', 2500))  # pause de frappe
+SPECULATIVE_ANALYSIS_MIN_CHARS = int(os.getenv('SPECULATIVE_ANALYSIS_MIN_CHARS', 20))  # symptômes décrits
+SPECULATIVE_ANALYSIS_PER_MINUTE = float(os.getenv('SPECULATIVE_ANALYSIS_PER_MINUTE', 2))
+SPECULATIVE_ANALYSIS_BURST = int(os.getenv('SPECULATIVE_ANALYSIS_BURST', 3))
+SPECULATIVE_ANALYSIS_WORKERS = int(os.getenv('SPECULATIVE_ANALYSIS_WORKERS', 2))
+
+# Télémétrie des appels IA (LLMCallLog): écritures groupées hors du chemin de la requête
+LLM_TELEMETRY_ENABLED = os.getenv('LLM_TELEMETRY_ENABLED', 'True') == 'True'
+LLM_TELEMETRY_BATCH_SIZE = int(os.getenv('LLM_TELEMETRY_BATCH_SIZE', 50))
+LLM_TELEMETRY_FLUSH_INTERVAL = float(os.getenv('LLM_TELEMETRY_FLUSH_INTERVAL', 5))  # secondes
+# Tarifs (USD par million de tokens) pour le coût estimé
+LLM_PRICE_INPUT_PER_MILLION = float(os.getenv('LLM_PRICE_INPUT_PER_MILLION', 0.10))
+LLM_PRICE_OUTPUT_PER_MILLION = float(os.getenv('LLM_PRICE_OUTPUT_PER_MILLION', 0.40))
+
+# File d'analyse: symptome sauvegarde la consultation puis un worker (run_analysis_worker) appelle Gemini
+ANALYSIS_QUEUE_ENABLED = os.getenv('ANALYSIS_QUEUE_ENABLED', 'False') == 'True'
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv('ANALYSIS_JOB_MAX_ATTEMPTS', 3))
+ANALYSIS_JOB_STALE_AFTER = int(os.getenv('ANALYSIS_JOB_STALE_AFTER', 300))  # secondes avant reprise d'un job orphelin
+
 # Configuration du modèle utilisateur personnalisé
 AUTH_USER_MODEL = 'app.User'
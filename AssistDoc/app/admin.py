@@ -1,15 +1,20 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.http import HttpResponse
 from django.urls import path
 from django.shortcuts import render
-from django.db.models import Count, Avg, Q
+from django.db.models import Count, Avg, F, Q
+from django.utils import timezone
 from django.utils.html import format_html
 import json
 from datetime import datetime, timedelta
 from .models import (
     User, Hospital, Patient, Consultation, 
-    PrescriptionFeedback, AILearningData, IAPerformanceMetrics, FeedbackPattern
+    PrescriptionFeedback, AILearningData, IAPerformanceMetrics, FeedbackPattern,
+    ConsultationAnalysisJob, ReanalysisRun, ConsultationReanalysis, LLMCallLog, PatternUsage
 )
+from .db_router import lectures_replica
+from .pattern_search import pattern_search_filter
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):      
@@ -39,6 +44,33 @@ class ConsultationAdmin(admin.ModelAdmin):
     has_feedback.boolean = True
     has_feedback.short_description = 'Feedback donné'
 
+@admin.register(ConsultationAnalysisJob)
+class ConsultationAnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('consultation', 'status', 'attempts', 'max_attempts', 'run_after', 'locked_by', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('payload', 'last_error', 'locked_by', 'locked_at', 'created_at', 'updated_at')
+
+@admin.register(ReanalysisRun)
+class ReanalysisRunAdmin(admin.ModelAdmin):
+    list_display = ('name', 'processed', 'failed', 'started_at', 'checkpoint_at', 'completed_at')
+    readonly_fields = ('filters', 'system_instruction_fingerprint', 'processed', 'failed',
+                       'started_at', 'checkpoint_at', 'completed_at')
+
+@admin.register(ConsultationReanalysis)
+class ConsultationReanalysisAdmin(admin.ModelAdmin):
+    list_display = ('consultation', 'run', 'status', 'diagnostic_original', 'diagnostic_reanalyse', 'created_at')
+    list_filter = ('run', 'status')
+    readonly_fields = ('run', 'consultation', 'status', 'recommendations', 'error', 'created_at')
+    list_select_related = ('consultation', 'consultation__patient', 'run')
+    
+    def diagnostic_original(self, obj):
+        return obj.consultation.initial_diagnosis
+    diagnostic_original.short_description = 'Diagnostic d\'origine'
+    
+    def diagnostic_reanalyse(self, obj):
+        return (obj.recommendations or {}).get('diagnostic_principal', '-')
+    diagnostic_reanalyse.short_description = 'Diagnostic ré-analysé'
+
 @admin.register(PrescriptionFeedback)
 class PrescriptionFeedbackAdmin(admin.ModelAdmin):
     list_display = ('consultation_patient', 'doctor', 'feedback_type', 'efficacite_traitement', 
@@ -102,9 +134,12 @@ class IAPerformanceMetricsAdmin(admin.ModelAdmin):
         urls = super().get_urls()
         custom_urls = [
             path('analytics/', self.admin_site.admin_view(self.analytics_view), name='app_iaperformancemetrics_analytics'),
+            path('service-ia/', self.admin_site.admin_view(self.service_ia_view), name='app_iaperformancemetrics_service_ia'),
+            path('telemetrie/', self.admin_site.admin_view(self.telemetry_view), name='app_iaperformancemetrics_telemetry'),
         ]
         return custom_urls + urls
     
+    @lectures_replica()
     def analytics_view(self, request):
         """Vue personnalisée pour afficher les graphiques et analyses"""
         
@@ -140,7 +175,7 @@ class IAPerformanceMetricsAdmin(admin.ModelAdmin):
         # Statistiques globales
         total_feedbacks = PrescriptionFeedback.objects.count()
         feedbacks_aujourd_hui = PrescriptionFeedback.objects.filter(
-            date_creation__date=datetime.now().date()
+            date_creation__gte=timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
         ).count()
         
         # Répartition des types de feedback
@@ -194,20 +229,124 @@ class IAPerformanceMetricsAdmin(admin.ModelAdmin):
             'learning_data_pending': learning_data_count - learning_data_used,
         })
         
+        # Réutilisation des modèles Gemini configurés (compteurs du processus courant)
+        from .gemini_models import get_model_registry_stats
+        from .recommendation_cache import get_recommendation_cache_stats
+        context['model_registry_stats'] = get_model_registry_stats()
+        context['recommendation_cache_stats'] = get_recommendation_cache_stats()
+        from .llm_limiter import llm_limiter
+        from .llm_resilience import get_resilience_stats
+        context['llm_limiter_stats'] = llm_limiter.stats()
+        context['resilience_stats'] = get_resilience_stats()
+        
         return render(request, 'admin/app/iaperformancemetrics/analytics.html', context)
+    
+    def service_ia_view(self, request):
+        """Compteurs du service IA en JSON (processus courant), pour la supervision"""
+        from django.http import JsonResponse
+        from .gemini_models import get_model_registry_stats
+        from .recommendation_cache import get_recommendation_cache_stats
+        from .llm_limiter import llm_limiter
+        from .llm_resilience import get_resilience_stats
+        from .context_cache import get_context_cache_stats
+        from .speculative_analysis import get_speculative_stats
+        
+        return JsonResponse({
+            'model_registry': get_model_registry_stats(),
+            'recommendation_cache': get_recommendation_cache_stats(),
+            'limiter': llm_limiter.stats(),
+            'resilience': get_resilience_stats(),
+            'context_cache': get_context_cache_stats(),
+            'speculative_analysis': get_speculative_stats(),
+        })
+    
+    @lectures_replica()
+    def telemetry_view(self, request):
+        """Latences (p50/p95/p99), tokens et coût des appels IA par jour, médecin et hôpital"""
+        from django.db.models.functions import TruncDate
+        from .llm_telemetry import get_telemetry_stats, telemetry_summary
+        
+        try:
+            jours = min(max(int(request.GET.get('jours', 7)), 1), 90)
+        except ValueError:
+            jours = 7
+        depuis = timezone.now() - timedelta(days=jours)
+        
+        # Agrégats calculés en base, sans charger les appels de la période
+        appels = LLMCallLog.objects.filter(created_at__gte=depuis)
+        par_jour = sorted(telemetry_summary(appels, TruncDate('created_at')), key=lambda l: l['key'], reverse=True)
+        par_medecin = sorted(telemetry_summary(appels, F('doctor__username')), key=lambda l: -l['calls'])
+        par_hopital = sorted(telemetry_summary(appels, F('hospital__name')), key=lambda l: -l['calls'])
+        for ligne in par_medecin + par_hopital:
+            ligne['key'] = ligne['key'] or '-'
+        
+        context = {
+            'title': 'Télémétrie IA - AssistDoc',
+            'subtitle': f'Appels IA des {jours} derniers jours (tokens estimés localement)',
+            'jours': jours,
+            'total': telemetry_summary(appels),
+            'par_jour': par_jour,
+            'par_medecin': par_medecin,
+            'par_hopital': par_hopital,
+            'telemetry_stats': get_telemetry_stats(),
+        }
+        return render(request, 'admin/app/iaperformancemetrics/telemetry.html', context)
 
 # Enregistrer le modèle avec la classe admin personnalisée
 admin.site.register(IAPerformanceMetrics, IAPerformanceMetricsAdmin)
 
+@admin.register(LLMCallLog)
+class LLMCallLogAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'endpoint', 'model_name', 'doctor', 'hospital', 'latency_ms',
+                   'prompt_tokens', 'response_tokens', 'cost', 'outcome')
+    list_filter = ('outcome', 'endpoint', 'model_name', 'hospital')
+    date_hierarchy = 'created_at'
+    readonly_fields = [field.name for field in LLMCallLog._meta.fields]
+
+@admin.register(PatternUsage)
+class PatternUsageAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'pattern', 'section', 'consultation', 'endpoint', 'tokens')
+    list_select_related = ('pattern', 'consultation__patient')
+    list_filter = ('section', 'endpoint')
+    date_hierarchy = 'created_at'
+    readonly_fields = [field.name for field in PatternUsage._meta.fields]
+
+class FeedbackPatternChangeList(ChangeList):
+    """
+    Liste des patterns avec leurs compteurs d'utilisation, calculés pour l'affichage
+    de la liste seulement: ni les pages de modification et de suppression, ni les
+    actions (POST sur la liste) ne font les jointures usages -> consultation -> feedback
+    """
+    
+    def get_queryset(self, request, exclude_parameters=None):
+        if request.method == 'GET' and 'usage_total' not in self.root_queryset.query.annotations:
+            # Utilisations dans les prompts, et parmi celles dont la consultation a reçu un feedback, les validations directes
+            self.root_queryset = self.root_queryset.annotate(
+                usage_total=Count('usages', distinct=True),
+                usage_with_feedback=Count(
+                    'usages', filter=Q(usages__consultation__feedback__isnull=False), distinct=True
+                ),
+                usage_validated=Count(
+                    'usages', filter=Q(usages__consultation__feedback__feedback_type='validee_directement'), distinct=True
+                ),
+            )
+        return super().get_queryset(request, exclude_parameters)
+
 @admin.register(FeedbackPattern)
 class FeedbackPatternAdmin(admin.ModelAdmin):
     list_display = ('pattern_type', 'description_short', 'frequency', 'confidence_score', 
-                   'reliability_level', 'is_active', 'last_occurrence')
+                   'reliability_level', 'is_active', 'last_occurrence', 'usage_count', 'usage_validation_rate')
     list_filter = ('pattern_type', 'is_active', 'last_occurrence')
     search_fields = ('description',)
     date_hierarchy = 'last_occurrence'
     readonly_fields = ('first_occurrence', 'last_occurrence', 'reliability_level')
     
+    def get_search_results(self, request, queryset, search_term):
+        # Recherche servie par l'index trigramme (PostgreSQL) ou FTS5 (SQLite)
+        if not search_term:
+            return queryset, False
+        return queryset.filter(pattern_search_filter(search_term)), False
+    
     fieldsets = (
         ('Information Générale', {
             'fields': ('pattern_type', 'description', 'is_active')
@@ -226,19 +365,37 @@ class FeedbackPatternAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_changelist(self, request, **kwargs):
+        return FeedbackPatternChangeList
+    
     def description_short(self, obj):
         return obj.description[:50] + "..." if len(obj.description) > 50 else obj.description
     description_short.short_description = 'Description'
     
+    def usage_count(self, obj):
+        return obj.usage_total
+    usage_count.short_description = 'Utilisations'
+    usage_count.admin_order_field = 'usage_total'
+    
+    def usage_validation_rate(self, obj):
+        if not obj.usage_with_feedback:
+            return '-'
+        return f"{obj.usage_validated / obj.usage_with_feedback * 100:.0f}% ({obj.usage_with_feedback} feedbacks)"
+    usage_validation_rate.short_description = 'Validation après usage'
+    
     actions = ['activate_patterns', 'deactivate_patterns', 'refresh_confidence_scores']
     
     def activate_patterns(self, request, queryset):
+        from .prompt_enhancement import bump_patterns_version
         count = queryset.update(is_active=True)
+        bump_patterns_version()
         self.message_user(request, f'{count} patterns activés avec succès.')
     activate_patterns.short_description = "Activer les patterns sélectionnés"
     
     def deactivate_patterns(self, request, queryset):
+        from .prompt_enhancement import bump_patterns_version
         count = queryset.update(is_active=False)
+        bump_patterns_version()
         self.message_user(request, f'{count} patterns désactivés avec succès.')
     deactivate_patterns.short_description = "Désactiver les patterns sélectionnés"
     
@@ -247,7 +404,8 @@ class FeedbackPatternAdmin(admin.ModelAdmin):
         result = refresh_prompt_patterns()
         self.message_user(request, 
             f'Scores actualisés: {result["active_patterns"]} patterns actifs, '
-            f'{result["deactivated_patterns"]} patterns désactivés.')
+            f'{result["deactivated_patterns"]} patterns désactivés, '
+            f'{result["updated_patterns"]} scores modifiés.')
     refresh_confidence_scores.short_description = "Actualiser les scores de confiance"
 
 # Personnalisation du site admin
@@ -0,0 +1,188 @@
+"""
+File d'attente durable des analyses IA de consultation.
+
+La vue symptome sauvegarde la consultation « en attente d'analyse » et crée un job;
+les workers (commande run_analysis_worker) réclament les jobs avec
+SELECT ... FOR UPDATE SKIP LOCKED, appellent Gemini et enregistrent le résultat.
+Un job dont le worker a disparu (redémarrage, crash) redevient réclamable après
+ANALYSIS_JOB_STALE_AFTER secondes (ou passe en échec si max_attempts est atteint);
+le worker initial, s'il répond finalement, n'écrit alors plus rien.
+"""
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .clinical_snapshot import rafraichir_historique
+from .consultation_analysis import analyser_consultation
+from .gemini_models import ORDONNANCE_SCHEMA, ORDONNANCE_SYSTEM_INSTRUCTION
+from .models import Consultation, ConsultationAnalysisJob
+
+
+def enqueue_consultation_analysis(consultation_fields, payload):
+    """
+    Crée la consultation en attente d'analyse et son job dans la même transaction
+
+    Args:
+        consultation_fields (dict): Champs de la consultation (patient, médecin, signes vitaux...)
+        payload (dict): Données à envoyer à Gemini (data_pour_gemini)
+
+    Returns:
+        Consultation: La consultation créée, sans recommandations pour l'instant
+    """
+    with transaction.atomic():
+        consultation = Consultation.objects.create(
+            **consultation_fields,
+            analysis_status='en_attente',
+        )
+        ConsultationAnalysisJob.objects.create(
+            consultation=consultation,
+            payload=payload,
+            max_attempts=getattr(settings, 'ANALYSIS_JOB_MAX_ATTEMPTS', 3),
+        )
+    return consultation
+
+
+def claim_next_job(worker_id, stale_after=None):
+    """
+    Réclame le prochain job disponible pour ce worker (None si la file est vide).
+
+    Les lignes verrouillées par un autre worker sont sautées (SKIP LOCKED): plusieurs
+    workers peuvent interroger la table en parallèle sans se bloquer ni se doubler.
+    """
+    if stale_after is None:
+        stale_after = getattr(settings, 'ANALYSIS_JOB_STALE_AFTER', 300)
+    now = timezone.now()
+
+    while True:
+        with transaction.atomic():
+            job = (
+                ConsultationAnalysisJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(
+                    Q(status='en_attente', run_after__lte=now)
+                    | Q(status='en_cours', locked_at__lt=now - timedelta(seconds=stale_after))
+                )
+                .order_by('run_after', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+
+            if job.status == 'en_cours' and job.attempts >= job.max_attempts:
+                # Worker disparu pendant la dernière tentative: échec définitif, pas de nouvelle tentative
+                job.status = 'echec'
+                job.locked_by = None
+                job.locked_at = None
+                job.last_error = f"Worker disparu pendant la tentative {job.attempts}/{job.max_attempts}"
+                job.save(update_fields=['status', 'locked_by', 'locked_at', 'last_error', 'updated_at'])
+                Consultation.objects.filter(id=job.consultation_id).update(analysis_status='echec')
+                continue
+
+            job.status = 'en_cours'
+            job.locked_by = worker_id
+            job.locked_at = now
+            job.attempts += 1
+            job.save(update_fields=['status', 'locked_by', 'locked_at', 'attempts', 'updated_at'])
+            Consultation.objects.filter(id=job.consultation_id).update(analysis_status='en_cours')
+
+        return job
+
+
+def retry_delay(attempts):
+    """Backoff exponentiel avec jitter: ~10s, 20s, 40s... plafonné à 5 minutes"""
+    return min(10 * 2 ** (attempts - 1), 300) * random.uniform(0.8, 1.2)
+
+
+def process_job(job):
+    """
+    Exécute l'analyse Gemini d'un job réclamé et enregistre le résultat.
+    En cas d'erreur, le job est replanifié jusqu'à max_attempts puis marqué en échec.
+    Rien n'est écrit si le job a été réclamé entre-temps par un autre worker.
+    """
+    consultation = (
+        Consultation.objects.filter(id=job.consultation_id).values('doctor_id', 'hospital_id', 'patient_id').first() or {}
+    )
+    patient_id = consultation.pop('patient_id', None)
+    telemetry = {'endpoint': 'file_analyse', **consultation}
+    try:
+        recommendations = analyser_consultation(
+            job.payload, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA, telemetry=telemetry
+        )
+    except Exception as e:
+        print(f"Erreur lors de l'analyse de la consultation {job.consultation_id}: {e}")
+        if job.attempts >= job.max_attempts:
+            statut, run_after = 'echec', job.run_after
+        else:
+            statut, run_after = 'en_attente', timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+        with transaction.atomic():
+            if _job_possede(job).update(
+                status=statut, run_after=run_after, locked_by=None, locked_at=None,
+                last_error=traceback.format_exc(), updated_at=timezone.now(),
+            ):
+                Consultation.objects.filter(id=job.consultation_id).update(analysis_status=statut)
+        return False
+
+    with transaction.atomic():
+        if not _job_possede(job).update(status='terminee', last_error=None, updated_at=timezone.now()):
+            # Job réclamé entre-temps par un autre worker (tentative jugée perdue): son résultat prévaut
+            print(f"Job {job.pk} repris par un autre worker, résultat de {job.locked_by} ignoré")
+            return False
+        Consultation.objects.filter(id=job.consultation_id).update(
+            gemini_recommendations=recommendations,
+            initial_diagnosis=recommendations.get('diagnostic_principal', ''),
+            analysis_status='terminee',
+        )
+        # update() ne déclenche pas les signaux: le diagnostic change l'historique de l'instantané clinique
+        rafraichir_historique(patient_id)
+    return True
+
+
+def _job_possede(job):
+    """
+    Le job tant que ce worker le détient encore: une réclamation après expiration
+    (ANALYSIS_JOB_STALE_AFTER) change locked_by et incrémente attempts
+    """
+    return ConsultationAnalysisJob.objects.filter(
+        pk=job.pk, status='en_cours', locked_by=job.locked_by, attempts=job.attempts
+    )
+
+
+def default_worker_id():
+    """Identifiant du processus worker (hôte:pid), visible dans locked_by"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_worker(stop_event, worker_id=None, poll_interval=2.0, once=False):
+    """
+    Boucle d'un worker: réclame et traite les jobs jusqu'à stop_event
+    (ou jusqu'à ce que la file soit vide si once=True)
+
+    Returns:
+        int: Nombre de jobs traités
+    """
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            job = claim_next_job(worker_id)
+            if job is None:
+                if once:
+                    break
+                stop_event.wait(poll_interval)
+                continue
+            process_job(job)
+            processed += 1
+    finally:
+        # Chaque thread a sa propre connexion: la fermer en sortie de boucle
+        connections.close_all()
+
+    return processed
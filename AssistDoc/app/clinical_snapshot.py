@@ -0,0 +1,134 @@
+"""
+Instantané clinique par patient (PatientClinicalSnapshot): sections "patient" et
+"historique_consultations" des données LLM, compactées et sérialisées à l'écriture.
+
+Mise à jour incrémentale par les signaux de l'écriture qui la déclenche (dans sa
+transaction quand elle en a une):
+- patient modifié: seule la section patient est re-sérialisée
+- nouvelle consultation: ajoutée en tête de l'historique, sans relire les autres
+- consultation modifiée ou supprimée: historique relu (index patient/date, 5 lignes)
+
+L'instantané d'un patient antérieur à sa mise en place est construit à la première lecture.
+"""
+import copy
+import json
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .consultation_analysis import donnees_historique, donnees_patient
+from .models import Consultation, PatientClinicalSnapshot
+from .prompt_builder import compacter
+
+HISTORIQUE_MAX = 5
+
+# Champs du patient et des consultations repris dans les sections de l'instantané
+CHAMPS_PATIENT = frozenset({
+    'first_name', 'last_name', 'birth_date', 'gender', 'social_security_number', 'allergies',
+    'diseases', 'surgeries', 'vaccines', 'actual_medecines',
+})
+CHAMPS_HISTORIQUE = frozenset({
+    'patient', 'consultation_date', 'consultation_reason', 'initial_diagnosis', 'tension', 'temperature',
+    'heart_rate',
+})
+
+
+def _json(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def _section_patient(patient):
+    return _json(compacter(donnees_patient(patient)))
+
+
+def _historique(patient_id):
+    consultations = (
+        Consultation.objects
+        .filter(patient_id=patient_id)
+        .order_by('-consultation_date', '-pk')[:HISTORIQUE_MAX]
+    )
+    return _json(compacter([donnees_historique(consultation) for consultation in consultations]))
+
+
+def construire_snapshot(patient):
+    """Instantané complet du patient (création, ou reconstruction)"""
+    snapshot, _ = PatientClinicalSnapshot.objects.update_or_create(
+        patient=patient,
+        defaults={
+            'patient_compact': _section_patient(patient),
+            'historique_compact': _historique(patient.pk),
+        },
+    )
+    return snapshot
+
+
+def obtenir_snapshot(patient):
+    """
+    Instantané du patient: sans requête s'il a été chargé avec le patient
+    (select_related('clinical_snapshot')), construit s'il n'existe pas encore
+    """
+    try:
+        return patient.clinical_snapshot
+    except PatientClinicalSnapshot.DoesNotExist:
+        return construire_snapshot(patient)
+
+
+def patient_modifie(patient, created=False, update_fields=None):
+    """Section patient re-sérialisée (l'historique n'est pas relu)"""
+    if created:
+        PatientClinicalSnapshot.objects.create(patient=patient, patient_compact=_section_patient(patient))
+        return
+    if update_fields is not None and not CHAMPS_PATIENT & set(update_fields):
+        return
+    mis_a_jour = PatientClinicalSnapshot.objects.filter(patient=patient).update(
+        patient_compact=_section_patient(patient), updated_at=timezone.now()
+    )
+    if not mis_a_jour:
+        construire_snapshot(patient)
+
+
+def consultation_ajoutee(consultation):
+    """
+    Nouvelle consultation en tête de l'historique: date de création (auto_now_add),
+    donc toujours la plus récente du patient
+    """
+    # Décimaux tels que relus de la base (38.5 saisi -> 38.50), comme dans un historique relu
+    enregistree = copy.copy(consultation)
+    for champ in ('tension', 'temperature'):
+        valeur = getattr(enregistree, champ)
+        if valeur is not None:
+            decimales = Consultation._meta.get_field(champ).decimal_places
+            setattr(enregistree, champ, Decimal(str(valeur)).quantize(Decimal(1).scaleb(-decimales)))
+    entree = compacter(donnees_historique(enregistree))
+    if not entree:
+        return
+    with transaction.atomic():
+        snapshot = (
+            PatientClinicalSnapshot.objects
+            .select_for_update()
+            .filter(patient_id=consultation.patient_id)
+            .first()
+        )
+        if snapshot is None:
+            # Instantané construit à la première lecture, historique compris
+            return
+        historique = [entree] + json.loads(snapshot.historique_compact)
+        snapshot.historique_compact = _json(historique[:HISTORIQUE_MAX])
+        snapshot.save(update_fields=['historique_compact', 'updated_at'])
+
+
+def rafraichir_historique(patient_id):
+    """Historique relu depuis les consultations (modification, suppression, update() en masse)"""
+    PatientClinicalSnapshot.objects.filter(patient_id=patient_id).update(
+        historique_compact=_historique(patient_id), updated_at=timezone.now()
+    )
+
+
+def donnees_llm(snapshot, consultation_actuelle):
+    """Données envoyées au LLM: sections de l'instantané et consultation en cours"""
+    return {
+        "patient": json.loads(snapshot.patient_compact),
+        "consultation_actuelle": consultation_actuelle,
+        "historique_consultations": json.loads(snapshot.historique_compact),
+    }
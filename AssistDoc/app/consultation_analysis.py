@@ -0,0 +1,166 @@
+"""
+Analyse IA d'une consultation: construction du prompt et appel au backend LLM
+derrière le cache de recommandations. Partagé par les vues (async) et le worker de la file
+d'analyse (sync).
+"""
+import json
+import time
+
+from .llm_backends import get_llm_backend
+from .llm_limiter import llm_limiter
+from .llm_telemetry import record_llm_call
+from .prompt_builder import construire_prompt_consultation
+from .recommendation_cache import recommendation_cache
+
+
+def donnees_patient(patient):
+    """Section patient des données envoyées au LLM"""
+    return {
+        "nom_complet": f"{patient.first_name} {patient.last_name}",
+        "age": patient.birth_date.year if patient.birth_date else "Non spécifié",
+        "sexe": patient.gender,
+        "numero_securite_sociale": patient.social_security_number,
+        "allergies": patient.allergies or "Aucune allergie connue",
+        "antecedents_medicaux": {
+            "maladies": patient.diseases or "Aucune maladie connue",
+            "chirurgies": patient.surgeries or "Aucune chirurgie",
+            "vaccinations": patient.vaccines or "Historique vaccinal non disponible",
+            "medicaments_actuels": patient.actual_medecines or "Aucun médicament actuel"
+        }
+    }
+
+
+def donnees_historique(consultation):
+    """Entrée d'historique (consultation précédente) envoyée au LLM"""
+    return {
+        "date": consultation.consultation_date.strftime("%Y-%m-%d"),
+        "motif": consultation.consultation_reason,
+        "diagnostic": consultation.initial_diagnosis or "Non spécifié",
+        "signes_vitaux": {
+            "tension": str(consultation.tension) if consultation.tension else None,
+            "temperature": str(consultation.temperature) if consultation.temperature else None,
+            "frequence_cardiaque": consultation.heart_rate if consultation.heart_rate else None
+        }
+    }
+
+
+def donnees_consultation_enregistree(consultation, historique_max=5):
+    """
+    Données LLM d'une consultation déjà enregistrée (ré-analyse): les champs stockés
+    et l'historique du patient antérieur à cette consultation
+    """
+    from .models import Consultation
+
+    precedentes = (
+        Consultation.objects
+        .filter(patient_id=consultation.patient_id, consultation_date__lt=consultation.consultation_date)
+        .order_by('-consultation_date')[:historique_max]
+    )
+    return {
+        "patient": donnees_patient(consultation.patient),
+        "consultation_actuelle": {
+            "motif_consultation": consultation.consultation_reason,
+            "examen_clinique": consultation.clinical_exam or '',
+            "signes_vitaux": {
+                "tension_arterielle": str(consultation.tension) if consultation.tension else '',
+                "temperature": str(consultation.temperature) if consultation.temperature else '',
+                "frequence_cardiaque": str(consultation.heart_rate) if consultation.heart_rate else '',
+                "poids": str(consultation.weight) if consultation.weight else '',
+                "taille": str(consultation.height) if consultation.height else '',
+                "saturation_oxygene": str(consultation.oxygen_saturation) if consultation.oxygen_saturation else '',
+            },
+        },
+        "historique_consultations": [donnees_historique(precedente) for precedente in precedentes],
+    }
+
+
+def prompt_consultation(data_pour_gemini, consignes_contextuelles=''):
+    """Prompt compact envoyé au LLM pour une consultation (budget PROMPT_TOKEN_BUDGET)"""
+    prompt = construire_prompt_consultation(data_pour_gemini)
+    if consignes_contextuelles:
+        prompt += f"\nRetours des médecins à prendre en compte pour ce patient:{consignes_contextuelles}"
+    return prompt
+
+
+async def analyser_consultation_async(data_pour_gemini, system_instruction, response_schema, telemetry=None,
+                                      consignes_contextuelles=''):
+    """
+    Envoie les données de consultation au backend LLM sans bloquer la boucle d'événements.
+    Une soumission identique (mêmes données, même instruction) est servie depuis le cache.
+    telemetry: contexte de l'appel pour LLMCallLog ({'endpoint', 'doctor_id', 'hospital_id'})
+    consignes_contextuelles: enrichissements propres au patient, ajoutés au prompt pour
+    que l'instruction système reste stable (cache de contexte Gemini)
+    """
+    backend = get_llm_backend()
+    debut = time.monotonic()
+    cle_cache = recommendation_cache.make_key(
+        data_pour_gemini, system_instruction + consignes_contextuelles, response_schema,
+        model_name=backend.model_name
+    )
+    recommendations = recommendation_cache.get(cle_cache)
+    if recommendations is not None:
+        record_llm_call(telemetry, backend, system_instruction, None, debut, served_without_call=True)
+        return recommendations
+
+    prompt = prompt_consultation(data_pour_gemini, consignes_contextuelles)
+    appel_effectue = False
+
+    async def appel():
+        nonlocal appel_effectue
+        appel_effectue = True
+        text = await backend.agenerate(prompt, system_instruction, response_schema)
+        recommendations = json.loads(text)
+        recommendation_cache.set(cle_cache, recommendations)
+        return recommendations
+
+    # Soumissions identiques simultanées: un seul appel, sous limite de concurrence
+    try:
+        recommendations = await llm_limiter.acall(cle_cache, appel)
+    except Exception as e:
+        record_llm_call(telemetry, backend, system_instruction, prompt, debut, error=e)
+        raise
+    record_llm_call(
+        telemetry, backend, system_instruction, prompt, debut, response=recommendations,
+        served_without_call=not appel_effectue
+    )
+    return recommendations
+
+
+def analyser_consultation(data_pour_gemini, system_instruction, response_schema, use_cache=True, telemetry=None):
+    """
+    Variante synchrone de analyser_consultation_async (workers, commandes).
+    use_cache=False: appel toujours effectué, résultat non mis en cache (ré-analyses en masse)
+    """
+    backend = get_llm_backend()
+    debut = time.monotonic()
+    cle_cache = recommendation_cache.make_key(
+        data_pour_gemini, system_instruction, response_schema, model_name=backend.model_name
+    )
+    if use_cache:
+        recommendations = recommendation_cache.get(cle_cache)
+        if recommendations is not None:
+            record_llm_call(telemetry, backend, system_instruction, None, debut, served_without_call=True)
+            return recommendations
+
+    prompt = prompt_consultation(data_pour_gemini)
+    appel_effectue = False
+
+    def appel():
+        nonlocal appel_effectue
+        appel_effectue = True
+        text = backend.generate(prompt, system_instruction, response_schema)
+        recommendations = json.loads(text)
+        if use_cache:
+            recommendation_cache.set(cle_cache, recommendations)
+        return recommendations
+
+    try:
+        recommendations = llm_limiter.call(cle_cache, appel)
+    except Exception as e:
+        record_llm_call(telemetry, backend, system_instruction, prompt, debut, error=e)
+        raise
+    record_llm_call(
+        telemetry, backend, system_instruction, prompt, debut, response=recommendations,
+        served_without_call=not appel_effectue
+    )
+    return recommendations
@@ -0,0 +1,248 @@
+"""
+Cache de contexte Gemini (cached content) pour l'instruction système.
+
+L'instruction de base enrichie par les patterns de feedback ne change qu'au
+rafraîchissement des patterns: elle est créée une fois côté Gemini, puis chaque
+appel la référence par son handle au lieu de la renvoyer en entier (moins de
+tokens d'entrée facturés plein tarif, premier token plus rapide).
+
+- une entrée par (modèle, empreinte de l'instruction), recréée à expiration
+- toutes les entrées sont supprimées quand la version des patterns change
+- une instruction sous le minimum de l'API n'est pas envoyée; après un échec de
+  création, l'instruction est retentée après un backoff, les appels continuent
+  sans cache de contexte entre-temps
+- création single-flight par instruction, hors du verrou du gestionnaire: les
+  appels réseau ne bloquent pas les lectures des autres instructions
+
+Avec les prompts actuels, l'instruction système (PROMPT_SYSTEM_TOKEN_BUDGET)
+reste sous le minimum de l'API (GEMINI_CONTEXT_CACHE_MIN_TOKENS): le cache ne
+sert qu'avec un budget d'instruction relevé au-dessus de ce minimum.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+from .gemini_models import fingerprint
+from .llm_limiter import SingleFlight
+from .prompt_builder import estimate_tokens
+from .prompt_enhancement import get_patterns_version
+
+
+class GeminiContextCacheClient:
+    """Création / suppression des cached contents via google.generativeai"""
+
+    def create(self, model_name, system_instruction, ttl):
+        import google.generativeai as genai
+
+        return genai.caching.CachedContent.create(
+            model=model_name if model_name.startswith('models/') else f'models/{model_name}',
+            display_name=f'assistdoc-{fingerprint(system_instruction)[:12]}',
+            system_instruction=system_instruction,
+            ttl=timedelta(seconds=ttl),
+        )
+
+    def delete(self, handle):
+        handle.delete()
+
+
+class LocalCachedContent:
+    """Handle d'un cached content local (même interface minimale que genai: name)"""
+
+    def __init__(self, name, model_name, system_instruction):
+        self.name = name
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+
+class LocalContextCacheClient:
+    """
+    Substitut local de l'API de cache de contexte (tests):
+    garde les contenus en mémoire et compte créations et suppressions
+    """
+
+    def __init__(self, min_tokens=0):
+        self.min_tokens = min_tokens
+        self.contents = {}
+        self.created = 0
+        self.deleted = 0
+
+    def create(self, model_name, system_instruction, ttl):
+        if estimate_tokens(system_instruction) < self.min_tokens:
+            raise ValueError("Contenu trop court pour le cache de contexte")
+        self.created += 1
+        handle = LocalCachedContent(f'cachedContents/local-{self.created}', model_name, system_instruction)
+        self.contents[handle.name] = handle
+        return handle
+
+    def delete(self, handle):
+        self.deleted += 1
+        self.contents.pop(handle.name, None)
+
+
+class ContextCacheManager:
+    """
+    Handles des instructions système mises en cache, par processus.
+
+    ttl: durée de vie demandée à l'API (secondes); l'entrée locale est recréée
+    `refresh_margin` secondes avant expiration pour ne jamais référencer un
+    contenu expiré. min_tokens: en dessous, l'instruction est envoyée normalement
+    (minimum imposé par l'API selon le modèle). retry_backoff: délai (secondes)
+    avant de retenter une création échouée, doublé à chaque échec et plafonné au ttl.
+    """
+
+    def __init__(self, client, ttl=3600, min_tokens=4096, refresh_margin=60, retry_backoff=30,
+                 clock=time.monotonic):
+        self.client = client
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.refresh_margin = refresh_margin
+        self.retry_backoff = retry_backoff
+        self.clock = clock
+        self._entries = {}
+        self._too_short = set()
+        self._retry_at = {}  # clé -> (date de la prochaine tentative, échecs consécutifs)
+        self._creations = SingleFlight()
+        self._lock = threading.Lock()
+        self._patterns_version = get_patterns_version()
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.invalidations = 0
+        self.failures = 0
+
+    def _check_patterns_version(self):
+        version = get_patterns_version()
+        with self._lock:
+            if version == self._patterns_version:
+                return
+            self._patterns_version = version
+        self.invalidate()
+
+    def get(self, model_name, system_instruction):
+        """Handle du cached content de cette instruction (créé si besoin), ou None"""
+        if not system_instruction:
+            return None
+        self._check_patterns_version()
+        key = (model_name, fingerprint(system_instruction))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            expired_handle = None
+            if entry is not None:
+                handle, refresh_at = entry
+                if self.clock() < refresh_at:
+                    self.reused += 1
+                    return handle
+                # Expiré (ou sur le point de l'être): recréé ci-dessous
+                self.expired += 1
+                del self._entries[key]
+                expired_handle = handle
+            if key in self._too_short:
+                return None
+            retry_at, _ = self._retry_at.get(key, (0, 0))
+            if self.clock() < retry_at:
+                return None
+        if expired_handle is not None:
+            self._delete(expired_handle)
+        if estimate_tokens(system_instruction) < self.min_tokens:
+            with self._lock:
+                self._too_short.add(key)
+            return None
+
+        # Une seule création par instruction: les appels simultanés attendent celle en cours
+        self._creations.do(key, lambda: self._create(key, model_name, system_instruction))
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def _create(self, key, model_name, system_instruction):
+        with self._lock:
+            if key in self._entries:  # créé juste avant par un autre appel
+                return
+            invalidations = self.invalidations
+        try:
+            handle = self.client.create(model_name, system_instruction, self.ttl)
+        except Exception as e:
+            print(f"Cache de contexte Gemini indisponible pour cette instruction: {e}")
+            with self._lock:
+                self.failures += 1
+                _, failures = self._retry_at.get(key, (0, 0))
+                delay = min(self.retry_backoff * 2 ** failures, self.ttl)
+                self._retry_at[key] = (self.clock() + delay, failures + 1)
+            return
+        with self._lock:
+            if self.invalidations == invalidations:
+                self.created += 1
+                self._retry_at.pop(key, None)
+                self._entries[key] = (handle, self.clock() + self.ttl - self.refresh_margin)
+                return
+        # Patterns rafraîchis pendant la création: contenu déjà périmé
+        self._delete(handle)
+
+    def discard(self, model_name, system_instruction):
+        """Oublie l'entrée d'une instruction (contenu introuvable côté API)"""
+        with self._lock:
+            self._entries.pop((model_name, fingerprint(system_instruction)), None)
+
+    def invalidate(self):
+        """Supprime tous les cached contents (patterns rafraîchis)"""
+        with self._lock:
+            entries, self._entries = self._entries, {}
+            self._too_short.clear()
+            self._retry_at.clear()
+            self.invalidations += 1
+        for handle, _ in entries.values():
+            self._delete(handle)
+
+    def _delete(self, handle):
+        # Suppression au mieux (hors verrou): le contenu expire de toute façon à la fin de son TTL
+        try:
+            self.client.delete(handle)
+        except Exception as e:
+            print(f"Erreur lors de la suppression du cache de contexte {handle.name}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': True,
+                'entries': len(self._entries),
+                'created': self.created,
+                'reused': self.reused,
+                'expired': self.expired,
+                'invalidations': self.invalidations,
+                'failures': self.failures,
+            }
+
+
+_context_cache = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache():
+    """Gestionnaire du processus si GEMINI_CONTEXT_CACHE_ENABLED, sinon None"""
+    global _context_cache
+    if not getattr(settings, 'GEMINI_CONTEXT_CACHE_ENABLED', False):
+        return None
+    if _context_cache is None:
+        with _context_cache_lock:
+            if _context_cache is None:
+                min_tokens = getattr(settings, 'GEMINI_CONTEXT_CACHE_MIN_TOKENS', 4096)
+                if getattr(settings, 'PROMPT_SYSTEM_TOKEN_BUDGET', 1200) < min_tokens:
+                    print(
+                        "Cache de contexte Gemini: l'instruction système (PROMPT_SYSTEM_TOKEN_BUDGET) "
+                        f"reste sous le minimum de l'API ({min_tokens} tokens), elle ne sera pas mise en cache"
+                    )
+                _context_cache = ContextCacheManager(
+                    GeminiContextCacheClient(),
+                    ttl=getattr(settings, 'GEMINI_CONTEXT_CACHE_TTL', 3600),
+                    min_tokens=min_tokens,
+                    retry_backoff=getattr(settings, 'GEMINI_CONTEXT_CACHE_RETRY_BACKOFF', 30),
+                )
+    return _context_cache
+
+
+def get_context_cache_stats():
+    context_cache = get_context_cache()
+    return context_cache.stats() if context_cache is not None else {'enabled': False}
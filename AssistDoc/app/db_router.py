@@ -0,0 +1,102 @@
+"""
+Routage des lectures lourdes (analytics de l'admin, métriques, analyse des
+patterns, export) vers un réplica en lecture de PostgreSQL.
+
+- seules les lectures faites dans lectures_replica() vont au réplica: le reste
+  de l'application (consultations) lit et écrit sur la base principale
+- après une écriture, les lectures restent sur la base principale jusqu'à la fin
+  de la requête (middleware epinglage_primaire): un écran ne lit jamais une
+  donnée plus ancienne que ce qu'il vient d'écrire (retard de réplication)
+- sans réplica configuré (DATABASE_REPLICA_ALIAS absent de DATABASES), tout va
+  à la base principale
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+_lectures_replica = ContextVar('lectures_replica', default=False)
+_portee = ContextVar('portee_epinglage', default=None)
+
+
+class _Portee:
+    """Écriture vue dans la portée (requête, ou bloc lectures_replica hors requête)"""
+    __slots__ = ('ecriture',)
+
+    def __init__(self):
+        self.ecriture = False
+
+
+def alias_replica():
+    """Alias du réplica s'il est configuré, sinon None"""
+    alias = getattr(settings, 'DATABASE_REPLICA_ALIAS', None)
+    return alias if alias and alias in settings.DATABASES else None
+
+
+@contextmanager
+def contexte_requete():
+    """Portée de l'épinglage sur la base principale (une requête HTTP)"""
+    token = _portee.set(_Portee())
+    try:
+        yield
+    finally:
+        _portee.reset(token)
+
+
+@contextmanager
+def lectures_replica():
+    """
+    Les lectures du bloc (ou de la fonction décorée) vont au réplica. Hors
+    requête (commandes), le bloc est sa propre portée d'épinglage
+    """
+    token_lectures = _lectures_replica.set(True)
+    token_portee = _portee.set(_Portee()) if _portee.get() is None else None
+    try:
+        yield
+    finally:
+        if token_portee is not None:
+            _portee.reset(token_portee)
+        _lectures_replica.reset(token_lectures)
+
+
+class ReadReplicaRouter:
+    """Routeur de DATABASE_ROUTERS; None = décision laissée au routage par défaut (base principale)"""
+
+    def db_for_read(self, model, **hints):
+        portee = _portee.get()
+        if _lectures_replica.get() and not (portee and portee.ecriture):
+            return alias_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Les lectures suivantes de la portée restent sur la base principale
+        portee = _portee.get()
+        if portee is not None:
+            portee.ecriture = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplica et base principale portent les mêmes données
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Le réplica reçoit le schéma par réplication, jamais par migrate
+        if db == alias_replica():
+            return False
+        return None
+
+
+@sync_and_async_middleware
+def epinglage_primaire(get_response):
+    """Middleware: l'épinglage après écriture ne dure que le temps de la requête"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with contexte_requete():
+                return await get_response(request)
+    else:
+        def middleware(request):
+            with contexte_requete():
+                return get_response(request)
+    return middleware
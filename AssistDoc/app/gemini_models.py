@@ -0,0 +1,303 @@
+"""
+Configuration partagée des modèles Gemini: instructions système, schémas de réponse
+et registre des instances GenerativeModel réutilisées entre les requêtes
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import google.generativeai as genai
+from django.conf import settings
+
+
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+
+
+# Instruction système de generer_prescription (API JSON)
+PRESCRIPTION_SYSTEM_INSTRUCTION = """Tu es un système expert d'aide à la décision médicale spécialisé dans la prescription de médicaments.
+Ton rôle est d'analyser les données cliniques d'un patient et de fournir des recommandations de prescription basées sur les meilleures pratiques médicales.
+
+IMPORTANT: Tu ne remplaces pas le jugement clinique d'un médecin. Tes recommandations sont des suggestions pour aider à la prise de décision.
+
+Analyse les données fournies et recommande des médicaments appropriés en tenant compte de:
+- L'âge, le poids et les conditions médicales du patient
+- Les allergies et contre-indications
+- Les interactions médicamenteuses potentielles
+- Les dosages appropriés selon les guidelines
+- Les effets secondaires possibles
+
+Fournis des justifications claires pour chaque recommandation."""
+
+# Instruction système de traiter_consultation (enrichie ensuite par prompt_enhancement)
+CONSULTATION_SYSTEM_INSTRUCTION = """Tu es un médecin expert spécialisé dans le diagnostic médical et la prescription de médicaments.
+Ton rôle est d'analyser les données complètes d'un patient incluant ses antécédents, la consultation actuelle et l'historique médical pour fournir:
+
+1. UN DIAGNOSTIC DÉTAILLÉ avec diagnostic différentiel
+2. DES RECOMMANDATIONS DE PRESCRIPTION spécifiques et justifiées
+3. DES RECOMMANDATIONS DE SUIVI
+
+IMPORTANT:
+- Tes recommandations sont des suggestions pour aider le médecin dans sa prise de décision
+- Considère toujours les allergies, antécédents et interactions médicamenteuses
+- Fournis des justifications médicales claires
+- Propose des alternatives si nécessaire
+
+Analyse TOUTES les données fournies: patient, consultation actuelle, et historique médical."""
+
+# Instruction système de symptome (diagnostic + ordonnance formelle)
+ORDONNANCE_SYSTEM_INSTRUCTION = """Tu es un médecin expert spécialisé dans le diagnostic médical et la prescription de médicaments.
+Ton rôle est d'analyser les données complètes d'un patient incluant ses antécédents, la consultation actuelle et l'historique médical pour fournir:
+
+1. UN DIAGNOSTIC DÉTAILLÉ avec diagnostic différentiel
+2. DES RECOMMANDATIONS DE PRESCRIPTION spécifiques et justifiées
+3. UNE ORDONNANCE MÉDICALE FORMELLE avec médicaments détaillés
+4. DES RECOMMANDATIONS DE SUIVI
+
+IMPORTANT:
+- Tes recommandations sont des suggestions pour aider le médecin dans sa prise de décision
+- Considère toujours les allergies, antécédents et interactions médicamenteuses
+- Fournis des justifications médicales claires
+- Pour l'ordonnance, propose des médicaments avec posologie précise, fréquence et durée
+- Inclus des instructions claires pour le patient
+- Propose des alternatives si nécessaire
+
+Analyse TOUTES les données fournies: patient, consultation actuelle, et historique médical.
+
+L'ordonnance doit être complète et prête à être utilisée par le médecin."""
+
+
+# Schéma de réponse de generer_prescription
+PRESCRIPTION_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'recommandations_prescription': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'nom_medicament': {'type': 'STRING'},
+                    'posologie': {'type': 'STRING'},
+                    'voie_administration': {'type': 'STRING'},
+                    'justification': {'type': 'STRING'},
+                    'effets_secondaires_cles': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+                    'contre_indications_notables': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+                    'interactions_medic_potentielles': {'type': 'STRING'},
+                    'notes_supplementaires_ia': {'type': 'STRING'},
+                },
+                'required': ["nom_medicament", "posologie", "voie_administration", "justification"]
+            }
+        }
+    },
+    'required': ["recommandations_prescription"]
+}
+
+# Schéma de réponse de traiter_consultation (diagnostic + prescriptions)
+CONSULTATION_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'diagnostic_principal': {'type': 'STRING'},
+        'diagnostic_differentiel': {
+            'type': 'ARRAY',
+            'items': {'type': 'STRING'}
+        },
+        'justification_diagnostic': {'type': 'STRING'},
+        'prescriptions_recommandees': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'nom_medicament': {'type': 'STRING'},
+                    'dosage': {'type': 'STRING'},
+                    'frequence': {'type': 'STRING'},
+                    'duree_traitement': {'type': 'STRING'},
+                    'voie_administration': {'type': 'STRING'},
+                    'justification': {'type': 'STRING'},
+                    'precautions': {'type': 'STRING'},
+                    'effets_secondaires_surveiller': {
+                        'type': 'ARRAY',
+                        'items': {'type': 'STRING'}
+                    }
+                },
+                'required': ['nom_medicament', 'dosage', 'frequence', 'justification']
+            }
+        },
+        'examens_complementaires': {
+            'type': 'ARRAY',
+            'items': {'type': 'STRING'}
+        },
+        'recommandations_suivi': {'type': 'STRING'},
+        'conseils_patient': {'type': 'STRING'},
+        'urgence_niveau': {
+            'type': 'STRING',
+            'enum': ['Faible', 'Modéré', 'Élevé', 'Urgent']
+        }
+    },
+    'required': ['diagnostic_principal', 'justification_diagnostic', 'prescriptions_recommandees']
+}
+
+# Schéma de réponse de symptome: celui de la consultation + ordonnance médicale formelle
+ORDONNANCE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        **CONSULTATION_SCHEMA['properties'],
+        'ordonnance_medicale': {
+            'type': 'OBJECT',
+            'properties': {
+                'medicaments': {
+                    'type': 'ARRAY',
+                    'items': {
+                        'type': 'OBJECT',
+                        'properties': {
+                            'nom_commercial': {'type': 'STRING'},
+                            'nom_generique': {'type': 'STRING'},
+                            'forme': {'type': 'STRING'},  # comprimé, gélule, sirop, etc.
+                            'dosage_unitaire': {'type': 'STRING'},  # ex: 500mg
+                            'posologie': {'type': 'STRING'},  # ex: 1 comprimé
+                            'frequence': {'type': 'STRING'},  # ex: 3 fois par jour
+                            'duree': {'type': 'STRING'},  # ex: 7 jours
+                            'moment_prise': {'type': 'STRING'},  # ex: avant les repas
+                            'instructions_speciales': {'type': 'STRING'}
+                        },
+                        'required': ['nom_commercial', 'posologie', 'frequence', 'duree']
+                    }
+                },
+                'instructions_generales': {'type': 'STRING'},
+                'contre_indications': {'type': 'STRING'},
+                'renouvellement': {'type': 'STRING'},  # ex: "Non renouvelable" ou "Renouvelable 2 fois"
+                'duree_validite': {'type': 'STRING'}  # ex: "3 mois"
+            },
+            'required': ['medicaments', 'instructions_generales']
+        }
+    },
+    'required': CONSULTATION_SCHEMA['required'] + ['ordonnance_medicale']
+}
+
+
+def fingerprint(value):
+    """
+    Empreinte stable (sha256) d'une instruction système ou d'un schéma JSON
+    """
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+# Empreintes des schémas constants, calculées une seule fois
+_SCHEMA_FINGERPRINTS = {
+    id(schema): fingerprint(schema)
+    for schema in (PRESCRIPTION_SCHEMA, CONSULTATION_SCHEMA, ORDONNANCE_SCHEMA)
+}
+
+
+def schema_fingerprint(schema):
+    """Empreinte d'un schéma, sans re-sérialisation pour les schémas du module"""
+    return _SCHEMA_FINGERPRINTS.get(id(schema)) or fingerprint(schema)
+
+
+def _generation_config(response_schema):
+    """Réponse JSON conforme au schéma (None: configuration par défaut)"""
+    if response_schema is None:
+        return None
+    return genai.types.GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=response_schema
+    )
+
+
+class GenerativeModelRegistry:
+    """
+    Registre process-wide des instances genai.GenerativeModel configurées.
+
+    Les instances sont indexées par (nom du modèle, empreinte de l'instruction système,
+    empreinte du schéma) et évincées en LRU au-delà de max_size: l'instruction enrichie
+    varie selon le patient, le registre ne doit donc pas croître sans limite.
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_name, system_instruction=None, response_schema=None):
+        key = (model_name, fingerprint(system_instruction), schema_fingerprint(response_schema))
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return model
+
+            self.misses += 1
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                system_instruction=system_instruction,
+                generation_config=_generation_config(response_schema)
+            )
+            return self._store(key, model)
+
+    def get_from_cached_content(self, cached_content, response_schema=None):
+        """
+        Modèle adossé à un cached content Gemini (instruction système déjà stockée
+        côté API), indexé par le nom du contenu et l'empreinte du schéma
+        """
+        key = ('cached_content', cached_content.name, schema_fingerprint(response_schema))
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return model
+
+            self.misses += 1
+            model = genai.GenerativeModel.from_cached_content(
+                cached_content=cached_content,
+                generation_config=_generation_config(response_schema)
+            )
+            return self._store(key, model)
+
+    def _store(self, key, model):
+        self._models[key] = model
+        while len(self._models) > self.max_size:
+            self._models.popitem(last=False)
+        return model
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._models),
+                'max_size': self.max_size,
+                'hit_rate': round(self.hits / total * 100, 1) if total else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+model_registry = GenerativeModelRegistry(
+    max_size=getattr(settings, 'GEMINI_MODEL_REGISTRY_SIZE', 32)
+)
+
+
+def get_generative_model(system_instruction=None, response_schema=None, model_name=GEMINI_MODEL_NAME):
+    """
+    Retourne un GenerativeModel configuré, réutilisé entre les requêtes si possible
+    """
+    return model_registry.get(model_name, system_instruction, response_schema)
+
+
+def get_model_registry_stats():
+    """Compteurs hits/misses du registre, pour le suivi du taux de réutilisation"""
+    return model_registry.stats()
@@ -0,0 +1,338 @@
+"""
+Backends LLM interchangeables: toutes les inférences (vues, worker, commandes)
+passent par get_llm_backend().
+
+- GeminiBackend: appels réels à google.generativeai via le registre de modèles,
+  avec cache de contexte optionnel de l'instruction système (context_cache)
+- FakeLLMBackend: réponses locales conformes au schéma, avec latence et taux
+  d'erreur configurables, pour mesurer débit et latence de queue de notre propre
+  pile sans consommer de quota ni dépendre du réseau
+- RecordedLLMBackend: rejoue des réponses déjà enregistrées (benchmarks de prompts)
+
+Le backend est choisi par le paramètre LLM_BACKEND ('gemini' par défaut, 'fake').
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .gemini_models import GEMINI_MODEL_NAME, fingerprint, get_generative_model, model_registry
+
+try:
+    from google.api_core.exceptions import NotFound
+    NOT_FOUND_EXCEPTIONS = (NotFound,)
+except ImportError:  # pragma: no cover
+    NOT_FOUND_EXCEPTIONS = ()
+
+
+class LLMBackendError(Exception):
+    """Erreur renvoyée par un backend LLM (quota, réseau, erreur simulée...)"""
+
+
+class LLMThrottledError(LLMBackendError):
+    """Le backend LLM demande de ralentir (quota, HTTP 429)"""
+
+
+class LLMServerError(LLMBackendError):
+    """Erreur côté serveur du backend LLM (HTTP 5xx): transitoire, peut être retentée"""
+
+
+class LLMBackend:
+    """
+    Interface commune des backends. Les réponses sont le texte JSON brut
+    (conforme à response_schema), le parsing reste à la charge de l'appelant.
+    """
+
+    name = 'base'
+    model_name = None
+
+    def generate(self, prompt, system_instruction=None, response_schema=None):
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, system_instruction=None, response_schema=None):
+        raise NotImplementedError
+
+    async def astream(self, prompt, system_instruction=None, response_schema=None):
+        """Itérateur asynchrone des morceaux de texte (par défaut: la réponse entière)"""
+        yield await self.agenerate(prompt, system_instruction, response_schema)
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Backend Gemini: modèles configurés et réutilisés via gemini_models.
+    Avec un gestionnaire de cache de contexte (context_cache), l'instruction système
+    est référencée par son cached content au lieu d'être renvoyée à chaque appel.
+    """
+
+    name = 'gemini'
+
+    def __init__(self, model_name=GEMINI_MODEL_NAME, context_cache=None, request_timeout=None):
+        self.model_name = model_name
+        self.context_cache = context_cache
+        # Délai de la requête HTTP elle-même: une tentative abandonnée (timeout,
+        # hedging) libère son thread au lieu d'attendre la réponse indéfiniment
+        self.request_options = {'timeout': request_timeout} if request_timeout else None
+
+    def _model(self, system_instruction, response_schema):
+        if self.context_cache is not None:
+            cached_content = self.context_cache.get(self.model_name, system_instruction)
+            if cached_content is not None:
+                return model_registry.get_from_cached_content(cached_content, response_schema)
+        return get_generative_model(system_instruction, response_schema, model_name=self.model_name)
+
+    async def _amodel(self, system_instruction, response_schema):
+        if self.context_cache is None:
+            return self._model(system_instruction, response_schema)
+        # La création éventuelle du cached content est un appel réseau bloquant
+        return await asyncio.to_thread(self._model, system_instruction, response_schema)
+
+    def _cached_content_lost(self, error, system_instruction):
+        """Contenu en cache expiré ou supprimé côté API: oublié, l'appel est refait sans"""
+        if self.context_cache is None or not isinstance(error, NOT_FOUND_EXCEPTIONS):
+            return False
+        self.context_cache.discard(self.model_name, system_instruction)
+        return True
+
+    def generate(self, prompt, system_instruction=None, response_schema=None):
+        try:
+            response = self._model(system_instruction, response_schema).generate_content(
+                prompt, request_options=self.request_options
+            )
+        except Exception as e:
+            if not self._cached_content_lost(e, system_instruction):
+                raise
+            response = get_generative_model(
+                system_instruction, response_schema, model_name=self.model_name
+            ).generate_content(prompt, request_options=self.request_options)
+        return response.text
+
+    async def agenerate(self, prompt, system_instruction=None, response_schema=None):
+        model = await self._amodel(system_instruction, response_schema)
+        try:
+            response = await model.generate_content_async(prompt, request_options=self.request_options)
+        except Exception as e:
+            if not self._cached_content_lost(e, system_instruction):
+                raise
+            response = await get_generative_model(
+                system_instruction, response_schema, model_name=self.model_name
+            ).generate_content_async(prompt, request_options=self.request_options)
+        return response.text
+
+    async def astream(self, prompt, system_instruction=None, response_schema=None):
+        model = await self._amodel(system_instruction, response_schema)
+        try:
+            response = await model.generate_content_async(
+                prompt, stream=True, request_options=self.request_options
+            )
+        except Exception as e:
+            if not self._cached_content_lost(e, system_instruction):
+                raise
+            response = await get_generative_model(
+                system_instruction, response_schema, model_name=self.model_name
+            ).generate_content_async(
+                prompt, stream=True, request_options=self.request_options
+            )
+        async for chunk in response:
+            yield chunk.text
+
+
+def exemple_conforme(schema, label='valeur'):
+    """
+    Construit une valeur conforme à un schéma de réponse Gemini (OBJECT, ARRAY,
+    STRING, enum...), avec des chaînes lisibles dérivées des noms de champs
+    """
+    if not schema:
+        return {}
+    schema_type = schema.get('type', 'STRING').upper()
+
+    if schema_type == 'OBJECT':
+        return {
+            key: exemple_conforme(sub_schema, key)
+            for key, sub_schema in schema.get('properties', {}).items()
+        }
+    if schema_type == 'ARRAY':
+        return [exemple_conforme(schema.get('items', {}), label)]
+    if 'enum' in schema:
+        return schema['enum'][0]
+    if schema_type == 'INTEGER':
+        return 1
+    if schema_type == 'NUMBER':
+        return 1.0
+    if schema_type == 'BOOLEAN':
+        return False
+    return f"{label.replace('_', ' ')} (simulé)"
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    Backend local déterministe pour les tests de charge.
+
+    latency: 'constant' (latency_ms), 'uniform' (entre 0 et 2 x latency_ms) ou
+    'lognormal' (médiane latency_ms, dispersion latency_sigma: queue longue réaliste).
+    error_rate: proportion d'appels qui échouent avec LLMBackendError.
+    throttle_rate: proportion d'appels refusés avec LLMThrottledError (quota simulé).
+    Avec un seed, la séquence de latences et d'erreurs est reproductible.
+    """
+
+    name = 'fake'
+    model_name = 'fake'
+
+    def __init__(self, latency='lognormal', latency_ms=800, latency_sigma=0.5,
+                 error_rate=0.0, throttle_rate=0.0, seed=None, chunk_size=64):
+        if latency not in ('constant', 'uniform', 'lognormal'):
+            raise ValueError(f"Distribution de latence inconnue: {latency}")
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.chunk_size = chunk_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def _tirage(self):
+        """Latence (secondes) et erreur éventuelle (exception à lever) du prochain appel"""
+        with self._lock:
+            self.calls += 1
+            if self.latency == 'constant':
+                delay_ms = self.latency_ms
+            elif self.latency == 'uniform':
+                delay_ms = self._random.uniform(0, 2 * self.latency_ms)
+            else:
+                delay_ms = self.latency_ms * self._random.lognormvariate(0, self.latency_sigma)
+            tirage = self._random.random()
+            failed = None
+            if tirage < self.throttle_rate:
+                failed = LLMThrottledError("429 Quota simulé par le backend fake")
+            elif tirage < self.throttle_rate + self.error_rate:
+                failed = LLMServerError("503 Erreur simulée par le backend fake")
+            if failed:
+                self.errors += 1
+        return delay_ms / 1000, failed
+
+    def _reponse(self, response_schema):
+        return json.dumps(exemple_conforme(response_schema), ensure_ascii=False)
+
+    def generate(self, prompt, system_instruction=None, response_schema=None):
+        delay, failed = self._tirage()
+        time.sleep(delay)
+        if failed:
+            raise failed
+        return self._reponse(response_schema)
+
+    async def agenerate(self, prompt, system_instruction=None, response_schema=None):
+        delay, failed = self._tirage()
+        await asyncio.sleep(delay)
+        if failed:
+            raise failed
+        return self._reponse(response_schema)
+
+    async def astream(self, prompt, system_instruction=None, response_schema=None):
+        delay, failed = self._tirage()
+        text = self._reponse(response_schema)
+        chunks = [text[start:start + self.chunk_size] for start in range(0, len(text), self.chunk_size)]
+        # Latence répartie entre les morceaux, erreur éventuelle à mi-parcours
+        for index, chunk in enumerate(chunks):
+            await asyncio.sleep(delay / len(chunks))
+            if failed and index >= len(chunks) // 2:
+                raise failed
+            yield chunk
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors}
+
+
+class RecordedLLMBackend(LLMBackend):
+    """
+    Backend local qui rejoue des réponses enregistrées, par prompt exact (ex: les
+    recommandations stockées des consultations). Pas de latence: seuls les tokens
+    et les réponses sont comparables d'une variante de prompt à l'autre.
+    """
+
+    name = 'recorded'
+    model_name = 'recorded'
+
+    def __init__(self, responses=None):
+        self._responses = {}
+        self._lock = threading.Lock()
+        for prompt, response in (responses or {}).items():
+            self.record(prompt, response)
+
+    def record(self, prompt, response):
+        """Enregistre la réponse (texte JSON ou objet) à rejouer pour ce prompt"""
+        if not isinstance(response, str):
+            response = json.dumps(response, ensure_ascii=False)
+        with self._lock:
+            self._responses[fingerprint(prompt)] = response
+
+    def generate(self, prompt, system_instruction=None, response_schema=None):
+        with self._lock:
+            response = self._responses.get(fingerprint(prompt))
+        if response is None:
+            raise LLMBackendError("Aucune réponse enregistrée pour ce prompt")
+        return response
+
+    async def agenerate(self, prompt, system_instruction=None, response_schema=None):
+        return self.generate(prompt, system_instruction, response_schema)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def build_llm_backend(name=None):
+    """
+    Construit le backend demandé (ou celui de LLM_BACKEND) à partir des paramètres,
+    enveloppé par la politique de résilience (délais, retries, disjoncteur) et
+    limité par llm_limiter (concurrence et débit)
+    """
+    from .llm_limiter import LimitedBackend, llm_limiter
+
+    backend = _build_backend(name or getattr(settings, 'LLM_BACKEND', 'gemini'))
+    if getattr(settings, 'LLM_RESILIENCE_ENABLED', True):
+        from .llm_resilience import ResilientBackend
+        # Un créneau du limiteur par tentative et par requête de couverture
+        return ResilientBackend(backend, limiter=llm_limiter)
+    return LimitedBackend(backend, llm_limiter)
+
+
+def _build_backend(name):
+    if name == 'gemini':
+        from .context_cache import get_context_cache
+        return GeminiBackend(
+            context_cache=get_context_cache(),
+            request_timeout=getattr(settings, 'LLM_CALL_TIMEOUT', 20),
+        )
+    if name == 'fake':
+        return FakeLLMBackend(
+            latency=getattr(settings, 'LLM_FAKE_LATENCY', 'lognormal'),
+            latency_ms=getattr(settings, 'LLM_FAKE_LATENCY_MS', 800),
+            latency_sigma=getattr(settings, 'LLM_FAKE_LATENCY_SIGMA', 0.5),
+            error_rate=getattr(settings, 'LLM_FAKE_ERROR_RATE', 0.0),
+            throttle_rate=getattr(settings, 'LLM_FAKE_THROTTLE_RATE', 0.0),
+            seed=getattr(settings, 'LLM_FAKE_SEED', None),
+        )
+    raise ValueError(f"Backend LLM inconnu: {name}")
+
+
+def get_llm_backend():
+    """Backend LLM du processus, construit au premier appel"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = build_llm_backend()
+    return _backend
+
+
+def set_llm_backend(backend):
+    """Remplace le backend du processus (None: reconstruit depuis les paramètres)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
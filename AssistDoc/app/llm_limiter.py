@@ -0,0 +1,335 @@
+"""
+Limitation des appels au LLM.
+
+- single-flight: des requêtes identiques simultanées (double soumission, retry du
+  navigateur) partagent un seul appel au backend
+- concurrence par processus adaptative (AIMD): +1 appel simultané après une
+  fenêtre de succès, divisée par deux quand le backend signale un throttling (429)
+- créneaux pris par requête réellement envoyée: chaque tentative et chaque requête
+  de couverture (ResilientBackend, ou LimitedBackend sans résilience)
+- débit global entre processus: seau à jetons stocké en base (LLMRateLimitBucket),
+  vidé lors d'un throttling pour que tous les processus ralentissent ensemble
+"""
+import asyncio
+import copy
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .llm_backends import LLMBackend, LLMBackendError, LLMThrottledError
+
+try:
+    from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+    THROTTLING_EXCEPTIONS = (ResourceExhausted, TooManyRequests)
+except ImportError:  # pragma: no cover
+    THROTTLING_EXCEPTIONS = ()
+
+
+class LLMSaturatedError(LLMBackendError):
+    """Aucun créneau d'appel obtenu dans le délai imparti"""
+
+
+def is_throttling_error(exc):
+    """Vrai si l'exception signale un throttling du backend (429 / quota épuisé)"""
+    return isinstance(exc, (LLMThrottledError,) + THROTTLING_EXCEPTIONS)
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _AsyncInFlightCall:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Regroupe les appels simultanés de même clé: un seul exécute, les autres attendent"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _InFlightCall()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, coro_fn):
+        """
+        L'appel partagé tourne dans une tâche détachée que tous les demandeurs
+        attendent: l'annulation de l'un d'eux (y compris celui qui l'a lancé) ne
+        touche pas les autres. La tâche n'est annulée que si plus personne ne l'attend.
+        """
+        # Les tâches asyncio sont liées à leur boucle d'événements
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        with self._lock:
+            call = self._async_calls.get(loop_key)
+            leader = call is None
+            if leader:
+                call = self._async_calls[loop_key] = _AsyncInFlightCall(loop.create_task(coro_fn()))
+                call.task.add_done_callback(lambda _: self._forget(loop_key, call))
+            else:
+                self.coalesced += 1
+            call.waiters += 1
+
+        try:
+            result = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                call.task.cancel()
+        return result if leader else copy.deepcopy(result)
+
+    def _forget(self, loop_key, call):
+        with self._lock:
+            if self._async_calls.get(loop_key) is call:
+                del self._async_calls[loop_key]
+
+
+class AIMDConcurrencyLimiter:
+    """
+    Nombre d'appels simultanés par processus, ajusté en AIMD:
+    +1 après `limit` succès consécutifs, /2 à chaque throttling
+    """
+
+    def __init__(self, max_limit=8, min_limit=1, initial_limit=None):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial_limit or max_limit)
+        self.in_flight = 0
+        self.throttled = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    async def aacquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        return True
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class DatabaseTokenBucket:
+    """
+    Seau à jetons global (capacité `burst`, `rate_per_minute` jetons par minute)
+    partagé par tous les processus via une ligne LLMRateLimitBucket verrouillée
+    """
+
+    def __init__(self, name='llm', rate_per_minute=60, burst=10):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.capacity = burst
+
+    def take(self):
+        """Prend un jeton; retourne 0 si accordé, sinon le délai (s) avant le prochain jeton"""
+        from .models import LLMRateLimitBucket
+
+        now = timezone.now()
+        with transaction.atomic():
+            bucket, _ = LLMRateLimitBucket.objects.select_for_update().get_or_create(
+                name=self.name, defaults={'tokens': self.capacity, 'updated_at': now}
+            )
+            elapsed = max((now - bucket.updated_at).total_seconds(), 0)
+            tokens = min(self.capacity, bucket.tokens + elapsed * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            bucket.tokens = tokens
+            bucket.updated_at = now
+            bucket.save(update_fields=['tokens', 'updated_at'])
+        return wait
+
+    def drain(self, penalty_seconds=0.0):
+        """Throttling signalé: vide le seau (jetons négatifs = pause supplémentaire)"""
+        from .models import LLMRateLimitBucket
+
+        LLMRateLimitBucket.objects.filter(name=self.name).update(
+            tokens=-penalty_seconds * self.rate, updated_at=timezone.now()
+        )
+
+
+class LLMCallLimiter:
+    """Single-flight + concurrence AIMD + seau à jetons global autour des appels LLM"""
+
+    def __init__(self, max_concurrency=8, min_concurrency=1, rate_per_minute=0, burst=10,
+                 slot_timeout=30, throttle_penalty=5):
+        self.single_flight = SingleFlight()
+        self.concurrency = AIMDConcurrencyLimiter(max_limit=max_concurrency, min_limit=min_concurrency)
+        self.bucket = DatabaseTokenBucket(rate_per_minute=rate_per_minute, burst=burst) if rate_per_minute else None
+        self.slot_timeout = slot_timeout
+        self.throttle_penalty = throttle_penalty
+
+    def _on_throttle(self):
+        if self.bucket is not None:
+            self.bucket.drain(self.throttle_penalty)
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """
+        Créneau d'une requête au LLM (synchrone): jeton global puis place dans la limite
+        de concurrence, attendus au plus `timeout` secondes (slot_timeout par défaut)
+        """
+        deadline = time.monotonic() + (self.slot_timeout if timeout is None else timeout)
+        if self.bucket is not None:
+            while (wait := self.bucket.take()) > 0:
+                if time.monotonic() + wait > deadline:
+                    raise LLMSaturatedError("Service IA saturé, réessayez dans quelques instants")
+                time.sleep(wait)
+        if not self.concurrency.acquire(max(deadline - time.monotonic(), 0)):
+            raise LLMSaturatedError("Service IA saturé, réessayez dans quelques instants")
+
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            if throttled:
+                self._on_throttle()
+            raise
+        finally:
+            self.concurrency.release(throttled)
+
+    @asynccontextmanager
+    async def aslot(self, timeout=None):
+        """Variante asynchrone de slot(), sans bloquer la boucle d'événements"""
+        deadline = time.monotonic() + (self.slot_timeout if timeout is None else timeout)
+        if self.bucket is not None:
+            while (wait := await sync_to_async(self.bucket.take)()) > 0:
+                if time.monotonic() + wait > deadline:
+                    raise LLMSaturatedError("Service IA saturé, réessayez dans quelques instants")
+                await asyncio.sleep(wait)
+        if not await self.concurrency.aacquire(max(deadline - time.monotonic(), 0)):
+            raise LLMSaturatedError("Service IA saturé, réessayez dans quelques instants")
+
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            if throttled:
+                await sync_to_async(self._on_throttle)()
+            raise
+        finally:
+            self.concurrency.release(throttled)
+
+    def call(self, key, fn):
+        """
+        Exécute fn() une seule fois par clé en vol. Les créneaux sont pris par le
+        backend, à chaque requête (tentatives et requêtes de couverture comprises)
+        """
+        return self.single_flight.do(key, fn)
+
+    async def acall(self, key, coro_fn):
+        """Variante asynchrone de call() (coro_fn retourne une coroutine)"""
+        return await self.single_flight.ado(key, coro_fn)
+
+    def stats(self):
+        return {
+            'concurrency_limit': int(self.concurrency.limit),
+            'max_concurrency': self.concurrency.max_limit,
+            'in_flight': self.concurrency.in_flight,
+            'throttled': self.concurrency.throttled,
+            'coalesced': self.single_flight.coalesced,
+        }
+
+
+class LimitedBackend(LLMBackend):
+    """
+    Backend dont chaque requête prend un créneau du limiteur. Utilisé quand la
+    résilience est désactivée; sinon ResilientBackend prend lui-même un créneau
+    par tentative et par requête de couverture
+    """
+
+    def __init__(self, backend, limiter=None):
+        self.backend = backend
+        self.limiter = limiter or llm_limiter
+        self.name = backend.name
+        self.model_name = backend.model_name
+
+    def generate(self, prompt, system_instruction=None, response_schema=None):
+        with self.limiter.slot():
+            return self.backend.generate(prompt, system_instruction, response_schema)
+
+    async def agenerate(self, prompt, system_instruction=None, response_schema=None):
+        async with self.limiter.aslot():
+            return await self.backend.agenerate(prompt, system_instruction, response_schema)
+
+    async def astream(self, prompt, system_instruction=None, response_schema=None):
+        async with self.limiter.aslot():
+            async for chunk in self.backend.astream(prompt, system_instruction, response_schema):
+                yield chunk
+
+
+llm_limiter = LLMCallLimiter(
+    max_concurrency=getattr(settings, 'LLM_MAX_CONCURRENCY', 8),
+    min_concurrency=getattr(settings, 'LLM_MIN_CONCURRENCY', 1),
+    rate_per_minute=getattr(settings, 'LLM_RATE_LIMIT_PER_MINUTE', 0),
+    burst=getattr(settings, 'LLM_RATE_LIMIT_BURST', 10),
+    slot_timeout=getattr(settings, 'LLM_SLOT_TIMEOUT', 30),
+)
@@ -0,0 +1,469 @@
+"""
+Résilience des appels au LLM: délais, retries, requêtes de couverture (hedging)
+et disjoncteur.
+
+- chaque tentative a un délai maximal (LLM_CALL_TIMEOUT), l'appel complet un délai
+  global (LLM_TOTAL_DEADLINE)
+- les erreurs transitoires (timeout, 429, 5xx) sont retentées avec un backoff
+  exponentiel à jitter complet; les autres (4xx) remontent telles quelles, sans
+  compter pour le disjoncteur
+- si la première tentative dépasse le p95 des latences récentes, une requête de
+  couverture identique est lancée et la première réponse arrivée est retenue
+- avec un limiteur (llm_limiter), chaque tentative attend son créneau avant que
+  son délai ne démarre; une requête de couverture n'est lancée que si un créneau
+  est libre immédiatement
+- après LLM_BREAKER_FAILURES échecs consécutifs le disjoncteur s'ouvre: les appels
+  échouent immédiatement avec LLMUnavailableError pendant LLM_BREAKER_RECOVERY
+  secondes, puis un appel d'essai décide de la fermeture
+
+Les compteurs (état du disjoncteur, retries, hedges...) sont exposés par
+get_resilience_stats() pour le suivi.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+from django.conf import settings
+
+from .llm_backends import LLMBackend, LLMBackendError, LLMServerError, LLMThrottledError
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    TRANSIENT_EXCEPTIONS = (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.ServerError,  # toutes les réponses 5xx
+    )
+except ImportError:  # pragma: no cover
+    TRANSIENT_EXCEPTIONS = ()
+
+
+class LLMUnavailableError(LLMBackendError):
+    """Service IA indisponible (disjoncteur ouvert ou délai global dépassé)"""
+
+
+class LLMTimeoutError(LLMBackendError):
+    """Une tentative d'appel au LLM a dépassé son délai"""
+
+
+# Erreurs présentées au médecin comme « service IA indisponible » (la consultation
+# est alors enregistrée sans recommandations)
+AI_UNAVAILABLE_ERRORS = (LLMBackendError, TimeoutError) + TRANSIENT_EXCEPTIONS
+
+
+def is_transient_error(exc):
+    """
+    Erreurs qui valent une nouvelle tentative et comptent pour le disjoncteur:
+    timeout, quota (429), erreur serveur (5xx) ou réseau. Une requête refusée
+    (400, argument invalide, 403, 404...) échouerait à l'identique: ni retry ni disjoncteur
+    """
+    return isinstance(
+        exc,
+        (LLMTimeoutError, LLMThrottledError, LLMServerError, TimeoutError, ConnectionError) + TRANSIENT_EXCEPTIONS,
+    )
+
+
+class CircuitBreaker:
+    """Disjoncteur fermé / ouvert / semi-ouvert (un seul appel d'essai à la fois)"""
+
+    CLOSED = 'ferme'
+    OPEN = 'ouvert'
+    HALF_OPEN = 'semi_ouvert'
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, timer=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._timer = timer
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial = None
+
+    def allow(self):
+        """
+        Lève LLMUnavailableError si le disjoncteur est ouvert. Retourne le jeton de
+        l'appel d'essai en semi-ouvert (None sinon), à rendre par release_trial()
+        """
+        with self._lock:
+            if self.state == self.OPEN and self._timer() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._trial = None
+            if self.state == self.HALF_OPEN and self._trial is None:
+                self._trial = object()
+                return self._trial
+            if self.state != self.CLOSED:
+                self.rejected += 1
+                raise LLMUnavailableError("Service IA momentanément indisponible")
+            return None
+
+    def release_trial(self, trial):
+        """
+        Fin de l'appel d'essai sans verdict (annulation, client déconnecté, flux
+        fermé): un autre appel pourra servir d'essai
+        """
+        if trial is None:
+            return
+        with self._lock:
+            if self._trial is trial:
+                self._trial = None
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial = None
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = self._timer()
+
+    def reset(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.times_opened = 0
+            self.rejected = 0
+            self._trial = None
+
+
+class LatencyTracker:
+    """Latences récentes (fenêtre glissante) des appels réussis, pour le seuil de hedging"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def __len__(self):
+        return len(self._samples)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class ResiliencePolicy:
+    """Paramètres et compteurs partagés par tous les appels du processus"""
+
+    def __init__(self, call_timeout=20, total_deadline=45, max_retries=2, backoff_base=0.5,
+                 backoff_max=8, hedge_enabled=True, hedge_min_samples=20,
+                 breaker_failures=5, breaker_recovery=30):
+        self.call_timeout = call_timeout
+        self.total_deadline = total_deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(breaker_failures, breaker_recovery)
+        self.latencies = LatencyTracker()
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(('calls', 'retries', 'timeouts', 'hedges', 'hedge_wins', 'failures'), 0)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def backoff(self, attempt):
+        """Backoff exponentiel à jitter complet: uniforme entre 0 et base x 2^attempt"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def hedge_delay(self):
+        """Délai avant la requête de couverture: p95 des latences récentes (None: pas de hedging)"""
+        if not self.hedge_enabled or len(self.latencies) < self.hedge_min_samples:
+            return None
+        return self.latencies.percentile(95)
+
+    def reset(self):
+        self.breaker.reset()
+        self.latencies.clear()
+        with self._lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        p50 = self.latencies.percentile(50)
+        p95 = self.latencies.percentile(95)
+        return {
+            **counters,
+            'breaker_state': self.breaker.state,
+            'breaker_consecutive_failures': self.breaker.consecutive_failures,
+            'breaker_times_opened': self.breaker.times_opened,
+            'breaker_rejected': self.breaker.rejected,
+            'latency_p50_ms': round(p50 * 1000) if p50 is not None else None,
+            'latency_p95_ms': round(p95 * 1000) if p95 is not None else None,
+            'hedge_delay_ms': round(self.hedge_delay() * 1000) if self.hedge_delay() is not None else None,
+        }
+
+
+resilience_policy = ResiliencePolicy(
+    call_timeout=getattr(settings, 'LLM_CALL_TIMEOUT', 20),
+    total_deadline=getattr(settings, 'LLM_TOTAL_DEADLINE', 45),
+    max_retries=getattr(settings, 'LLM_MAX_RETRIES', 2),
+    hedge_enabled=getattr(settings, 'LLM_HEDGE_ENABLED', True),
+    hedge_min_samples=getattr(settings, 'LLM_HEDGE_MIN_SAMPLES', 20),
+    breaker_failures=getattr(settings, 'LLM_BREAKER_FAILURES', 5),
+    breaker_recovery=getattr(settings, 'LLM_BREAKER_RECOVERY', 30),
+)
+
+# Threads des appels synchrones (délai et hedging sans bloquer indéfiniment l'appelant).
+# Une tentative abandonnée n'est pas annulable: c'est le délai de la requête HTTP
+# du backend (GeminiBackend.request_options) qui termine son thread
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'LLM_MAX_CONCURRENCY', 8) * 2,
+    thread_name_prefix='llm-call',
+)
+
+
+class ResilientBackend(LLMBackend):
+    """
+    Enveloppe un backend LLM avec délais, retries, hedging et disjoncteur.
+    limiter: LLMCallLimiter dont chaque requête envoyée (tentative, couverture)
+    prend un créneau; None: pas de limitation
+    """
+
+    def __init__(self, backend, policy=None, limiter=None):
+        self.backend = backend
+        self.policy = policy or resilience_policy
+        self.limiter = limiter
+        self.name = backend.name
+        self.model_name = backend.model_name
+
+    def _slot_wait(self, deadline):
+        # Tentative: créneau attendu au plus jusqu'au délai global. Couverture (deadline=None):
+        # seulement si un créneau est libre tout de suite, sinon LLMSaturatedError et pas de couverture
+        if deadline is None:
+            return 0
+        return min(self.limiter.slot_timeout, max(deadline - time.monotonic(), 0))
+
+    def _slot(self, deadline=None):
+        if self.limiter is None:
+            return nullcontext()
+        return self.limiter.slot(self._slot_wait(deadline))
+
+    def _aslot(self, deadline=None):
+        if self.limiter is None:
+            return nullcontext()
+        return self.limiter.aslot(self._slot_wait(deadline))
+
+    def _hedge(self, args):
+        with self._slot():
+            self.policy.count('hedges')
+            return self.backend.generate(*args)
+
+    async def _ahedge(self, args):
+        async with self._aslot():
+            self.policy.count('hedges')
+            return await self.backend.agenerate(*args)
+
+    def _attempt_timeout(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMUnavailableError("Service IA indisponible: délai de réponse dépassé")
+        return min(self.policy.call_timeout, remaining)
+
+    def _failed(self, exc, attempt, deadline):
+        """Échec d'une tentative: retourne le délai avant la suivante, ou relève l'erreur"""
+        policy = self.policy
+        if isinstance(exc, LLMTimeoutError):
+            policy.count('timeouts')
+        if not is_transient_error(exc):
+            # Erreur de la requête (4xx), saturation locale...: le service n'est pas en cause
+            policy.count('failures')
+            raise exc
+        if attempt >= policy.max_retries:
+            policy.count('failures')
+            policy.breaker.record_failure()
+            raise exc
+        delay = policy.backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            policy.count('failures')
+            policy.breaker.record_failure()
+            raise exc
+        policy.count('retries')
+        return delay
+
+    def _succeeded(self, started):
+        self.policy.latencies.record(time.monotonic() - started)
+        self.policy.breaker.record_success()
+
+    # Appels synchrones ---------------------------------------------------------------
+
+    def _sync_attempt(self, args, deadline, hedge):
+        with self._slot(deadline):
+            return self._sync_requests(args, self._attempt_timeout(deadline), hedge)
+
+    def _sync_requests(self, args, timeout, hedge):
+        started = time.monotonic()
+        futures = [_executor.submit(self.backend.generate, *args)]
+        hedge_delay = self.policy.hedge_delay() if hedge else None
+
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                futures.append(_executor.submit(self._hedge, args))
+
+        pending = set(futures)
+        while pending:
+            remaining = timeout - (time.monotonic() - started)
+            done, pending = wait(pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self.policy.count('hedge_wins')
+                    return future.result(), started
+            if not pending:
+                # Toutes les requêtes ont échoué: relever la première erreur
+                raise futures[0].exception() or futures[-1].exception()
+        raise LLMTimeoutError(f"Pas de réponse du service IA en {timeout:.0f} s")
+
+    def generate(self, prompt, system_instruction=None, response_schema=None):
+        policy = self.policy
+        trial = policy.breaker.allow()
+        policy.count('calls')
+        deadline = time.monotonic() + policy.total_deadline
+        args = (prompt, system_instruction, response_schema)
+
+        attempt = 0
+        try:
+            while True:
+                try:
+                    text, started = self._sync_attempt(args, deadline, hedge=attempt == 0)
+                    self._succeeded(started)
+                    return text
+                except Exception as e:
+                    time.sleep(self._failed(e, attempt, deadline))
+                    attempt += 1
+        finally:
+            policy.breaker.release_trial(trial)
+
+    # Appels asynchrones --------------------------------------------------------------
+
+    async def _async_attempt(self, args, deadline, hedge):
+        async with self._aslot(deadline):
+            return await self._async_requests(args, self._attempt_timeout(deadline), hedge)
+
+    async def _async_requests(self, args, timeout, hedge):
+        started = time.monotonic()
+        tasks = [asyncio.ensure_future(self.backend.agenerate(*args))]
+        hedge_delay = self.policy.hedge_delay() if hedge else None
+
+        try:
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    tasks.append(asyncio.ensure_future(self._ahedge(args)))
+
+            pending = set(tasks)
+            while pending:
+                remaining = timeout - (time.monotonic() - started)
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.policy.count('hedge_wins')
+                        return task.result(), started
+                if not pending:
+                    raise tasks[0].exception() or tasks[-1].exception()
+            raise LLMTimeoutError(f"Pas de réponse du service IA en {timeout:.0f} s")
+        finally:
+            # Requête perdante (ou expirée) annulée
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def agenerate(self, prompt, system_instruction=None, response_schema=None):
+        policy = self.policy
+        trial = policy.breaker.allow()
+        policy.count('calls')
+        deadline = time.monotonic() + policy.total_deadline
+        args = (prompt, system_instruction, response_schema)
+
+        attempt = 0
+        try:
+            while True:
+                try:
+                    text, started = await self._async_attempt(args, deadline, hedge=attempt == 0)
+                    self._succeeded(started)
+                    return text
+                except Exception as e:
+                    await asyncio.sleep(self._failed(e, attempt, deadline))
+                    attempt += 1
+        finally:
+            # Annulation (CancelledError) comprise: l'essai ne reste pas pris
+            policy.breaker.release_trial(trial)
+
+    async def astream(self, prompt, system_instruction=None, response_schema=None):
+        """
+        Flux protégé par le disjoncteur et un délai par morceau. Pas de retry ni de
+        hedging: des sections ont déjà pu être envoyées au navigateur.
+        """
+        policy = self.policy
+        trial = policy.breaker.allow()
+        policy.count('calls')
+        deadline = time.monotonic() + policy.total_deadline
+
+        try:
+            # Un créneau du limiteur pour toute la durée du flux
+            async with self._aslot(deadline):
+                started = time.monotonic()
+                chunks = self.backend.astream(prompt, system_instruction, response_schema).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=policy.call_timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        policy.count('timeouts')
+                        policy.count('failures')
+                        policy.breaker.record_failure()
+                        raise LLMTimeoutError(f"Pas de réponse du service IA en {policy.call_timeout:.0f} s")
+                    except Exception as e:
+                        policy.count('failures')
+                        if is_transient_error(e):
+                            policy.breaker.record_failure()
+                        raise
+                    yield chunk
+
+            self._succeeded(started)
+        finally:
+            # Flux fermé par le consommateur (GeneratorExit) ou annulé
+            policy.breaker.release_trial(trial)
+
+
+def get_resilience_stats():
+    """État du disjoncteur et compteurs de retries/hedging (processus courant)"""
+    return resilience_policy.stats()
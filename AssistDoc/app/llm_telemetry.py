@@ -0,0 +1,272 @@
+"""
+Télémétrie des appels LLM (modèle LLMCallLog).
+
+Chaque appel des vues est mesuré (latence, tokens estimés, coût, issue, version
+du prompt) puis placé dans un tampon mémoire: un thread d'arrière-plan l'écrit
+en base par lots (bulk_create), jamais pendant la requête du médecin.
+"""
+import atexit
+import json
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Aggregate, Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Floor
+from django.utils import timezone
+
+from .gemini_models import fingerprint
+from .llm_resilience import AI_UNAVAILABLE_ERRORS
+from .prompt_builder import estimate_tokens
+
+
+def cout_estime(prompt_tokens, response_tokens):
+    """Coût estimé (USD) d'un appel selon les tarifs LLM_PRICE_*_PER_MILLION"""
+    prix_entree = Decimal(str(getattr(settings, 'LLM_PRICE_INPUT_PER_MILLION', 0)))
+    prix_sortie = Decimal(str(getattr(settings, 'LLM_PRICE_OUTPUT_PER_MILLION', 0)))
+    cout = (prompt_tokens * prix_entree + response_tokens * prix_sortie) / Decimal(1_000_000)
+    return cout.quantize(Decimal('0.000001'))
+
+
+def prompt_version(system_instruction):
+    """Version courte de l'instruction système (change avec les patterns de feedback)"""
+    return fingerprint(system_instruction)[:12]
+
+
+class TelemetryBuffer:
+    """
+    Tampon des lignes à enregistrer (modèle `model_label`): écrit par lots de
+    `batch_size` ou toutes les `flush_interval` secondes par un thread démon, et
+    vidé à l'arrêt du processus.
+    background=False: pas de thread, flush() appelé explicitement (tests)
+    """
+
+    def __init__(self, batch_size=50, flush_interval=5.0, background=True, model_label='app.LLMCallLog'):
+        self.model_label = model_label
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.background = background
+        self.written = 0
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, entry):
+        with self._lock:
+            self._pending.append(entry)
+            full = len(self._pending) >= self.batch_size
+        if not self.background:
+            if full:
+                self.flush()
+            return
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def clear(self):
+        with self._lock:
+            self._pending = []
+
+    def flush(self):
+        """Écrit les lignes en attente (un bulk_create par lot); retourne le nombre écrit"""
+        model = apps.get_model(self.model_label)
+
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            model.objects.bulk_create([model(**entry) for entry in batch], batch_size=self.batch_size)
+        except Exception as e:
+            # La télémétrie ne doit jamais casser le service: le lot est perdu
+            print(f"Erreur lors de l'écriture de la télémétrie ({self.model_label}, {len(batch)} ligne(s)): {e}")
+            self.dropped += len(batch)
+            return 0
+        self.written += len(batch)
+        return len(batch)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=f'telemetry-{self.model_label}', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+
+telemetry_buffer = TelemetryBuffer(
+    batch_size=getattr(settings, 'LLM_TELEMETRY_BATCH_SIZE', 50),
+    flush_interval=getattr(settings, 'LLM_TELEMETRY_FLUSH_INTERVAL', 5.0),
+)
+atexit.register(telemetry_buffer.flush)
+
+
+def record_llm_call(telemetry, backend, system_instruction, prompt, started, response=None, error=None,
+                    served_without_call=False):
+    """
+    Enregistre un appel (dans le tampon) pour la télémétrie.
+
+    Args:
+        telemetry (dict): Contexte de l'appelant {'endpoint', 'doctor_id', 'hospital_id'};
+            None = appel non enregistré (commandes de masse)
+        backend: Backend LLM utilisé (nom et modèle)
+        system_instruction (str): Instruction système envoyée (version du prompt)
+        prompt (str): Prompt envoyé
+        started (float): time.monotonic() au début de l'appel
+        response: Texte ou objet JSON retourné
+        error (Exception): Erreur levée par l'appel
+        served_without_call (bool): Réponse servie sans appel au backend (cache, requête regroupée)
+    """
+    if telemetry is None or not getattr(settings, 'LLM_TELEMETRY_ENABLED', True):
+        return
+
+    if error is not None:
+        outcome = 'indisponible' if isinstance(error, AI_UNAVAILABLE_ERRORS) else 'erreur'
+    else:
+        outcome = 'cache' if served_without_call else 'succes'
+
+    if served_without_call:
+        prompt_tokens = response_tokens = 0
+    else:
+        prompt_tokens = estimate_tokens(system_instruction) + estimate_tokens(prompt)
+        if response is not None and not isinstance(response, str):
+            response = json.dumps(response, ensure_ascii=False, separators=(',', ':'))
+        response_tokens = estimate_tokens(response)
+
+    telemetry_buffer.add({
+        'created_at': timezone.now(),
+        'endpoint': telemetry.get('endpoint', ''),
+        'backend': getattr(backend, 'name', ''),
+        'model_name': getattr(backend, 'model_name', ''),
+        'prompt_version': prompt_version(system_instruction),
+        'doctor_id': telemetry.get('doctor_id'),
+        'hospital_id': telemetry.get('hospital_id'),
+        'prompt_tokens': prompt_tokens,
+        'response_tokens': response_tokens,
+        'cost': cout_estime(prompt_tokens, response_tokens),
+        'latency_ms': int((time.monotonic() - started) * 1000),
+        'outcome': outcome,
+        'error_type': type(error).__name__ if error is not None else '',
+    })
+
+
+def percentile(sorted_values, p):
+    """Percentile (interpolation linéaire, arrondi à l'unité) d'une liste déjà triée"""
+    if not sorted_values:
+        return None
+    rang = (len(sorted_values) - 1) * p / 100
+    bas = int(rang)
+    haut = min(bas + 1, len(sorted_values) - 1)
+    return round(sorted_values[bas] + (sorted_values[haut] - sorted_values[bas]) * (rang - bas))
+
+
+PERCENTILES = (50, 95, 99)
+
+# Tranches de latence de l'histogramme (hors PostgreSQL), par leur borne inférieure:
+# 10 ms sous 1 s, 50 ms sous 10 s, 250 ms au-delà, soit au plus quelques centaines
+# de tranches par groupe
+TRANCHE_LATENCE = Case(
+    When(latency_ms__lt=1000, then=Floor(F('latency_ms') / 10) * 10),
+    When(latency_ms__lt=10000, then=Floor(F('latency_ms') / 50) * 50),
+    default=Floor(F('latency_ms') / 250) * 250,
+)
+
+
+class PercentileCont(Aggregate):
+    """percentile_cont(fraction) WITHIN GROUP (ORDER BY expression), PostgreSQL"""
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, fraction, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def percentile_histogramme(tranches, p):
+    """Percentile (même interpolation que percentile()) d'un histogramme trié [(valeur, nombre)]"""
+    total = sum(nombre for _, nombre in tranches)
+    if not total:
+        return None
+    rang = (total - 1) * p / 100
+
+    def valeur(indice):
+        cumul = 0
+        for tranche, nombre in tranches:
+            cumul += nombre
+            if indice < cumul:
+                return tranche
+        return tranches[-1][0]
+
+    bas = int(rang)
+    return round(valeur(bas) + (valeur(min(bas + 1, total - 1)) - valeur(bas)) * (rang - bas))
+
+
+def telemetry_summary(queryset, cle=None):
+    """
+    Agrège en base les appels par `cle` (expression; None: total): nombre, erreurs,
+    latences p50/p95/p99 (appels effectifs), tokens et coût. Percentiles exacts sous
+    PostgreSQL (percentile_cont), sinon lus sur un histogramme des latences par
+    tranches: jamais une ligne par appel ramenée en Python
+    """
+    queryset = queryset.order_by().annotate(cle=cle if cle is not None else Value('total'))
+    effectifs = ~Q(outcome='cache')
+    agregats = {
+        'calls': Count('pk'),
+        'errors': Count('pk', filter=Q(outcome__in=('erreur', 'indisponible'))),
+        'cached': Count('pk', filter=Q(outcome='cache')),
+        'prompt_tokens': Sum('prompt_tokens', default=0),
+        'response_tokens': Sum('response_tokens', default=0),
+        'cost': Sum('cost', default=Decimal(0)),
+    }
+    postgres = connections[queryset.db].vendor == 'postgresql'
+    if postgres:
+        for p in PERCENTILES:
+            agregats[f'p{p}'] = PercentileCont('latency_ms', p / 100, filter=effectifs)
+    lignes = list(queryset.values('cle').annotate(**agregats))
+
+    if postgres:
+        for ligne in lignes:
+            for p in PERCENTILES:
+                if ligne[f'p{p}'] is not None:
+                    ligne[f'p{p}'] = round(ligne[f'p{p}'])
+    else:
+        histogrammes = defaultdict(list)
+        tranches = (
+            queryset.filter(effectifs)
+            .values('cle', tranche=TRANCHE_LATENCE)
+            .annotate(nombre=Count('pk'))
+            .order_by('cle', 'tranche')
+        )
+        for tranche in tranches:
+            histogrammes[tranche['cle']].append((int(tranche['tranche']), tranche['nombre']))
+        for ligne in lignes:
+            for p in PERCENTILES:
+                ligne[f'p{p}'] = percentile_histogramme(histogrammes[ligne['cle']], p)
+
+    return [{'key': ligne.pop('cle'), **ligne} for ligne in lignes]
+
+
+def get_telemetry_stats():
+    return {
+        'pending': telemetry_buffer.pending(),
+        'written': telemetry_buffer.written,
+        'dropped': telemetry_buffer.dropped,
+    }
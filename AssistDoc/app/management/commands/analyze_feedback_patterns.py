@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.db.models import Count, Q
 from datetime import timedelta
+from app.db_router import lectures_replica
 from app.models import PrescriptionFeedback, FeedbackPattern
 import re
 from collections import Counter
@@ -18,6 +19,7 @@ class Command(BaseCommand):
             help='Nombre de jours à analyser (défaut: 7)',
         )
 
+    @lectures_replica()
     def handle(self, *args, **options):
         days = options['days']
         start_date = timezone.now() - timedelta(days=days)
@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+import random
+import statistics
+import time
+from app.models import Patient, normaliser_nom
+from app.patient_queries import rechercher_patients
+
+
+NOMS = [
+    'Kouassi', 'Koné', 'Traoré', 'Diabaté', 'Yao', 'Konan', 'Ouattara', 'Bamba', 'Coulibaly', 'Touré',
+    'Diallo', 'N\'Guessan', 'Kouamé', 'Aka', 'Brou', 'Dembélé', 'Sangaré', 'Cissé', 'Gnagne', 'Zadi',
+    'Martin', 'Bernard', 'Lefèvre', 'Mercier', 'Fontaine', 'Chevalier', 'Gauthier', 'Bérénger',
+]
+PRENOMS = [
+    'Awa', 'Aminata', 'Fatou', 'Mariam', 'Adjoua', 'Affoué', 'Ama', 'Éloïse', 'Hélène', 'Chloé',
+    'Koffi', 'Kouadio', 'Ibrahim', 'Moussa', 'Seydou', 'Yacouba', 'Jérôme', 'François', 'Noël', 'Rémi',
+]
+
+# (libellé, saisie, équivalent naïf: last_name__icontains)
+RECHERCHES = [
+    ('N° sécu (préfixe)', '18500000001', None),
+    ('Nom (préfixe)', 'kouas', 'kouas'),
+    ('Nom accentué', 'Lefevre', 'Lefevre'),
+    ('Prénom Nom', 'helene merc', 'merc'),
+    ('Faute de frappe', 'Kouasi', 'Kouasi'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Mesure le temps de la recherche de patients (saisie semi-automatique) sur une grande table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--patients',
+            type=int,
+            default=1000000,
+            help='Nombre de patients générés pour la mesure (défaut: 1000000)',
+        )
+        parser.add_argument(
+            '--repetitions',
+            type=int,
+            default=5,
+            help='Nombre de mesures par recherche (défaut: 5)',
+        )
+
+    def handle(self, *args, **options):
+        nombre = options['patients']
+        repetitions = options['repetitions']
+
+        # Tout est annulé à la fin: la base n'est pas modifiée
+        with transaction.atomic():
+            self.stdout.write(f"📦 Génération de {nombre} patients...")
+            debut = time.perf_counter()
+            self._generer(nombre)
+            self.stdout.write(f"   {time.perf_counter() - debut:.0f} s")
+
+            self.stdout.write("\n🔎 Recherche (médiane sur {} mesures, ms):".format(repetitions))
+            self.stdout.write(f"{'Recherche':<22}{'Saisie':<14}{'Résultats':>10}{'Indexée':>10}{'icontains':>12}")
+            for libelle, saisie, naive in RECHERCHES:
+                resultats = len(rechercher_patients(saisie, limit=10))
+                indexee = self._mesurer(lambda: rechercher_patients(saisie, limit=10), repetitions)
+                if naive:
+                    sequentielle = self._mesurer(
+                        lambda: list(Patient.objects.filter(last_name__icontains=naive).order_by('last_name')[:10]),
+                        repetitions,
+                    )
+                    sequentielle = f"{sequentielle:.1f}"
+                else:
+                    sequentielle = '-'
+                self.stdout.write(f"{libelle:<22}{saisie:<14}{resultats:>10}{indexee:>10.1f}{sequentielle:>12}")
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("✅ Mesure terminée (patients générés supprimés)"))
+
+    def _generer(self, nombre):
+        aleatoire = random.Random(42)
+        lot = []
+        for i in range(nombre):
+            nom = aleatoire.choice(NOMS)
+            prenom = aleatoire.choice(PRENOMS)
+            # bulk_create ne passe pas par Patient.save(): noms normalisés calculés ici
+            lot.append(Patient(
+                social_security_number=f"{aleatoire.randint(1, 2)}{aleatoire.randint(40, 99)}{i:012d}",
+                last_name=nom,
+                first_name=prenom,
+                gender=aleatoire.choice(['M', 'F']),
+                nom_recherche=normaliser_nom(f"{nom} {prenom}"),
+                prenom_nom_recherche=normaliser_nom(f"{prenom} {nom}"),
+            ))
+            if len(lot) == 5000:
+                Patient.objects.bulk_create(lot)
+                lot = []
+        Patient.objects.bulk_create(lot)
+
+    def _mesurer(self, fn, repetitions):
+        durees = []
+        for _ in range(repetitions):
+            debut = time.perf_counter()
+            fn()
+            durees.append((time.perf_counter() - debut) * 1000)
+        return statistics.median(durees)
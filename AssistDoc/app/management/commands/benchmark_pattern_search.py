@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+import random
+import statistics
+import time
+from app.models import FeedbackPattern
+from app.pattern_matcher import PatternMatcher
+from app.pattern_search import search_patterns
+from app.prompt_enhancement import PatternEntry
+
+
+MOTS = [
+    'toux', 'fièvre', 'céphalées', 'douleur', 'thoracique', 'abdominale', 'nausées', 'vomissements',
+    'diarrhée', 'éruption', 'cutanée', 'dyspnée', 'asthénie', 'vertiges', 'amoxicilline', 'paracétamol',
+    'ibuprofène', 'posologie', 'enfant', 'adulte', 'grossesse', 'insuffisance', 'rénale', 'hépatique',
+    'allergie', 'pénicilline', 'hypertension', 'diabète', 'infection', 'urinaire', 'otite', 'angine',
+]
+
+RECHERCHES = ['pédiatrique', 'gériatrique', 'amoxicilline', 'toux fièvre', 'insuffisance rénale']
+
+
+class Command(BaseCommand):
+    help = 'Mesure le temps de recherche dans les descriptions de patterns (index trigramme / FTS5)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--patterns',
+            type=int,
+            default=100000,
+            help='Nombre de patterns générés pour la mesure (défaut: 100000)',
+        )
+        parser.add_argument(
+            '--repetitions',
+            type=int,
+            default=5,
+            help='Nombre de mesures par recherche (défaut: 5)',
+        )
+
+    def handle(self, *args, **options):
+        nombre = options['patterns']
+        repetitions = options['repetitions']
+
+        # Tout est annulé à la fin: la base n'est pas modifiée
+        with transaction.atomic():
+            self.stdout.write(f"📦 Génération de {nombre} patterns...")
+            self._generer(nombre)
+
+            self.stdout.write("\n🔎 Recherche (médiane sur {} mesures, ms):".format(repetitions))
+            self.stdout.write(f"{'Recherche':<22}{'Résultats':>10}{'Index':>10}{'icontains':>12}")
+            for recherche in RECHERCHES:
+                resultats = search_patterns(recherche).count()
+                indexee = self._mesurer(lambda: list(search_patterns(recherche, limit=10)), repetitions)
+                sequentielle = self._mesurer(lambda: list(self._icontains(recherche)[:10]), repetitions)
+                self.stdout.write(f"{recherche:<22}{resultats:>10}{indexee:>10.1f}{sequentielle:>12.1f}")
+
+            # Recherche des symptômes dans l'index des mots-clés de l'instantané des patterns (sans requête)
+            debut = time.perf_counter()
+            entries = [
+                PatternEntry(p.pk, p.pattern_type, p.description, p.description.lower(), p.frequency,
+                             float(p.confidence_score), p.reliability_level)
+                for p in FeedbackPattern.objects.filter(is_active=True)
+            ]
+            matcher = PatternMatcher(entries)
+            construction = (time.perf_counter() - debut) * 1000
+            symptomes = 'Toux grasse et fièvre depuis trois jours, douleur thoracique, antécédent d\'allergie'
+            parcours = self._mesurer(lambda: matcher.match(symptomes), repetitions)
+            self.stdout.write(
+                f"\n🧠 Index des mots-clés: construction {construction:.0f} ms, recherche des symptômes {parcours:.2f} ms"
+            )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("✅ Mesure terminée (patterns générés supprimés)"))
+
+    def _generer(self, nombre):
+        aleatoire = random.Random(42)
+        types = [choix for choix, _ in FeedbackPattern.PATTERN_TYPE_CHOICES]
+        lot = []
+        for i in range(nombre):
+            mots = aleatoire.sample(MOTS, 5)
+            if i % 50 == 0:
+                mots.append(aleatoire.choice(['pédiatrique', 'gériatrique']))
+            lot.append(FeedbackPattern(
+                pattern_type=types[i % len(types)],
+                description=f"{' '.join(mots)} (benchmark {i})",
+                frequency=aleatoire.randint(1, 20),
+                confidence_score=round(aleatoire.random(), 2),
+            ))
+            if len(lot) == 5000:
+                FeedbackPattern.objects.bulk_create(lot)
+                lot = []
+        FeedbackPattern.objects.bulk_create(lot)
+
+    def _icontains(self, recherche):
+        filtre = Q(is_active=True)
+        for mot in recherche.split():
+            filtre &= Q(description__icontains=mot)
+        return FeedbackPattern.objects.filter(filtre)
+
+    def _mesurer(self, fn, repetitions):
+        durees = []
+        for _ in range(repetitions):
+            debut = time.perf_counter()
+            fn()
+            durees.append((time.perf_counter() - debut) * 1000)
+        return statistics.median(durees)
@@ -0,0 +1,290 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+import json
+import statistics
+import time
+from app.consultation_analysis import donnees_consultation_enregistree, prompt_consultation
+from app.gemini_models import (
+    CONSULTATION_SCHEMA, CONSULTATION_SYSTEM_INSTRUCTION,
+    ORDONNANCE_SCHEMA, ORDONNANCE_SYSTEM_INSTRUCTION, fingerprint
+)
+from app.llm_backends import FakeLLMBackend, RecordedLLMBackend, get_llm_backend
+from app.llm_telemetry import percentile
+from app.models import Consultation
+from app.pattern_matcher import normaliser
+from app.prompt_builder import estimate_tokens
+from app.prompt_enhancement import get_contextual_enhancements, get_enhanced_system_instruction
+
+
+SCHEMAS = {
+    'ordonnance': (ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA),
+    'consultation': (CONSULTATION_SYSTEM_INSTRUCTION, CONSULTATION_SCHEMA),
+}
+
+# Variantes mesurées sans --variants: le prompt actuel et deux alternatives simples
+VARIANTES_PAR_DEFAUT = [
+    {'nom': 'actuelle', 'patterns': True},
+    {'nom': 'sans_patterns', 'patterns': False},
+    {'nom': 'budget_reduit', 'patterns': True, 'token_budget': 800},
+]
+
+
+def medicaments(recommendations):
+    """Noms de médicaments normalisés (premier mot significatif) d'une réponse ou prescription"""
+    if not isinstance(recommendations, dict):
+        return set()
+    noms = [p.get('nom_medicament') for p in recommendations.get('prescriptions_recommandees') or []]
+    ordonnance = recommendations.get('ordonnance_medicale') or {}
+    for medicament in ordonnance.get('medicaments') or []:
+        noms += [medicament.get('nom_generique'), medicament.get('nom_commercial')]
+    resultat = set()
+    for nom in noms:
+        tokens = normaliser(nom or '')
+        if tokens:
+            resultat.add(tokens[0])
+    return resultat
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class Command(BaseCommand):
+    help = 'Compare des variantes de prompt sur des consultations enregistrées (tokens, latence, accord avec le médecin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--variants',
+            type=str,
+            help='Fichier JSON des variantes: [{"nom": "...", "instruction": "ordonnance" | "consultation" | '
+                 'texte, "patterns": true, "token_budget": 1200}, ...] (défaut: actuelle, sans_patterns, budget_reduit)',
+        )
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=50,
+            help='Nombre de consultations rejouées, les plus récentes avec une décision du médecin (défaut: 50)',
+        )
+        parser.add_argument(
+            '--schema',
+            type=str,
+            choices=list(SCHEMAS),
+            default='ordonnance',
+            help='Schéma de réponse commun aux variantes et instruction par défaut (défaut: ordonnance)',
+        )
+        parser.add_argument(
+            '--backend',
+            type=str,
+            choices=['fake', 'recorded', 'configure'],
+            default='fake',
+            help='fake (réponses simulées), recorded (réponses IA enregistrées des consultations) ou '
+                 'configure (backend de LLM_BACKEND, appels réels) (défaut: fake)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Nombre d\'appels en parallèle (défaut: 4)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='prompt_benchmark.json',
+            help='Rapport JSON (défaut: prompt_benchmark.json)',
+        )
+        parser.add_argument(
+            '--html',
+            type=str,
+            help='Rapport HTML optionnel',
+        )
+
+    def handle(self, *args, **options):
+        base_instruction, response_schema = SCHEMAS[options['schema']]
+        variantes = self.load_variants(options['variants'])
+        echantillons = self.load_samples(options['sample'])
+        if not echantillons:
+            raise CommandError('Aucune consultation avec une décision du médecin à rejouer.')
+
+        # Prompts préparés ici (requêtes en base), les threads ne font que les appels
+        taches = []
+        for variante in variantes:
+            instruction = self.system_instruction(variante, base_instruction)
+            variante['instruction_systeme'] = instruction
+            for echantillon in echantillons:
+                consignes = ''
+                if variante.get('patterns', True):
+                    consignes = get_contextual_enhancements(
+                        symptoms=echantillon['symptomes'], patient_age=echantillon['age']
+                    )
+                taches.append((variante, echantillon, prompt_consultation(echantillon['donnees'], consignes)))
+
+        backend = self.build_backend(options['backend'], taches)
+        self.stdout.write(
+            f'🧪 {len(variantes)} variante(s) x {len(echantillons)} consultation(s) '
+            f'(backend {backend.name}, {options["workers"]} workers)...'
+        )
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers']), thread_name_prefix='benchmark') as executor:
+            resultats = list(executor.map(
+                lambda tache: self.run_one(backend, response_schema, *tache), taches
+            ))
+
+        rapport = {
+            'genere_le': timezone.now().isoformat(),
+            'backend': backend.name,
+            'modele': backend.model_name,
+            'schema': options['schema'],
+            'consultations': len(echantillons),
+            'variantes': [
+                self.summarize(variante, [r for r in resultats if r['variante'] == variante['nom']])
+                for variante in variantes
+            ],
+        }
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(rapport, f, ensure_ascii=False, indent=2)
+        if options['html']:
+            with open(options['html'], 'w', encoding='utf-8') as f:
+                f.write(render_to_string('prompt_benchmark_report.html', {'rapport': rapport}))
+
+        self.print_summary(rapport)
+        self.stdout.write(self.style.SUCCESS(f'✅ Rapport écrit dans {options["output"]}'))
+
+    def load_variants(self, path):
+        if not path:
+            return [dict(variante) for variante in VARIANTES_PAR_DEFAUT]
+        try:
+            with open(path, encoding='utf-8') as f:
+                variantes = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Fichier de variantes illisible: {e}')
+        noms = [variante.get('nom') for variante in variantes]
+        if not variantes or None in noms or len(set(noms)) != len(noms):
+            raise CommandError('Chaque variante doit avoir un "nom" unique.')
+        return variantes
+
+    def load_samples(self, limit):
+        """
+        Consultations récentes avec la décision du médecin: prescription finale des
+        données d'apprentissage, ou recommandations IA validées directement
+        """
+        consultations = (
+            Consultation.objects
+            .filter(feedback__isnull=False)
+            .select_related('patient', 'feedback')
+            .prefetch_related('feedback__learning_data')
+            .order_by('-consultation_date')
+        )
+        echantillons = []
+        for consultation in consultations.iterator(chunk_size=100):
+            learning_data = list(consultation.feedback.learning_data.all())
+            if learning_data:
+                reference = learning_data[0].prescription_finale_medecin
+                diagnostic = learning_data[0].diagnostic_final_medecin
+            elif consultation.feedback.feedback_type == 'validee_directement' and consultation.gemini_recommendations:
+                reference = consultation.gemini_recommendations
+                diagnostic = consultation.gemini_recommendations.get('diagnostic_principal', '')
+            else:
+                continue
+            patient = consultation.patient
+            echantillons.append({
+                'consultation_id': consultation.id,
+                'donnees': donnees_consultation_enregistree(consultation),
+                'symptomes': consultation.consultation_reason,
+                'age': timezone.now().year - patient.birth_date.year if patient.birth_date else None,
+                'enregistree': consultation.gemini_recommendations,
+                'medicaments': medicaments(reference),
+                'diagnostic': set(normaliser(diagnostic)),
+            })
+            if len(echantillons) >= limit:
+                break
+        return echantillons
+
+    def system_instruction(self, variante, base_instruction):
+        instruction = variante.get('instruction')
+        if instruction in SCHEMAS:
+            instruction = SCHEMAS[instruction][0]
+        instruction = instruction or base_instruction
+        if variante.get('patterns', True):
+            instruction = get_enhanced_system_instruction(instruction, token_budget=variante.get('token_budget'))
+        return instruction
+
+    def build_backend(self, name, taches):
+        if name == 'fake':
+            return FakeLLMBackend(latency='constant', latency_ms=0)
+        if name == 'recorded':
+            backend = RecordedLLMBackend()
+            for _, echantillon, prompt in taches:
+                if echantillon['enregistree']:
+                    backend.record(prompt, echantillon['enregistree'])
+            return backend
+        return get_llm_backend()
+
+    def run_one(self, backend, response_schema, variante, echantillon, prompt):
+        """Un appel (thread du pool): tokens, latence et accord avec la décision du médecin"""
+        instruction = variante['instruction_systeme']
+        resultat = {
+            'variante': variante['nom'],
+            'consultation_id': echantillon['consultation_id'],
+            'tokens_entree': estimate_tokens(instruction) + estimate_tokens(prompt),
+        }
+        debut = time.monotonic()
+        try:
+            text = backend.generate(prompt, instruction, response_schema)
+            recommendations = json.loads(text)
+        except Exception as e:
+            resultat.update(erreur=f'{type(e).__name__}: {e}', latence_ms=int((time.monotonic() - debut) * 1000))
+            return resultat
+        resultat.update(
+            erreur=None,
+            latence_ms=int((time.monotonic() - debut) * 1000),
+            tokens_sortie=estimate_tokens(text),
+            accord_prescription=jaccard(medicaments(recommendations), echantillon['medicaments']),
+            accord_diagnostic=jaccard(
+                set(normaliser(recommendations.get('diagnostic_principal', ''))), echantillon['diagnostic']
+            ),
+        )
+        return resultat
+
+    def summarize(self, variante, resultats):
+        reussis = [r for r in resultats if r['erreur'] is None]
+        latences = sorted(r['latence_ms'] for r in reussis)
+
+        def moyenne(cle):
+            valeurs = [r[cle] for r in reussis]
+            return round(statistics.mean(valeurs), 3) if valeurs else None
+
+        return {
+            'nom': variante['nom'],
+            'empreinte_instruction': fingerprint(variante['instruction_systeme'])[:12],
+            'tokens_instruction': estimate_tokens(variante['instruction_systeme']),
+            'appels': len(resultats),
+            'erreurs': len(resultats) - len(reussis),
+            'tokens_entree_moyen': moyenne('tokens_entree'),
+            'tokens_sortie_moyen': moyenne('tokens_sortie'),
+            'latence_ms': {
+                'p50': percentile(latences, 50),
+                'p95': percentile(latences, 95),
+                'p99': percentile(latences, 99),
+                'moyenne': moyenne('latence_ms'),
+            },
+            'accord_prescription': moyenne('accord_prescription'),
+            'accord_diagnostic': moyenne('accord_diagnostic'),
+            'resultats': resultats,
+        }
+
+    def print_summary(self, rapport):
+        self.stdout.write(
+            f"\n{'Variante':<20}{'Erreurs':>8}{'Entrée':>9}{'Sortie':>9}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'Accord Rx':>11}{'Accord Dx':>11}"
+        )
+        for v in rapport['variantes']:
+            self.stdout.write(
+                f"{v['nom']:<20}{v['erreurs']:>8}{v['tokens_entree_moyen'] or 0:>9.0f}{v['tokens_sortie_moyen'] or 0:>9.0f}"
+                f"{v['latence_ms']['p50'] or 0:>9}{v['latence_ms']['p95'] or 0:>9}"
+                f"{v['accord_prescription'] or 0:>11.2f}{v['accord_diagnostic'] or 0:>11.2f}"
+            )
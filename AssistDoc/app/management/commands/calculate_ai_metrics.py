@@ -1,8 +1,16 @@
 from django.core.management.base import BaseCommand
 from django.db.models import Count, Avg, Q
-from datetime import datetime, timedelta
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+from app.db_router import lectures_replica
 from app.models import PrescriptionFeedback, IAPerformanceMetrics, AILearningData
 
+
+def debut_du_jour(jour):
+    """Minuit (fuseau courant) du jour donné, borne des filtres par jour sur date_creation"""
+    return timezone.make_aware(datetime.combine(jour, time.min))
+
+
 class Command(BaseCommand):
     help = 'Calcule et met à jour les métriques de performance de l\'IA'
 
@@ -13,6 +21,7 @@ class Command(BaseCommand):
             help='Date pour laquelle calculer les métriques (format YYYY-MM-DD). Par défaut: aujourd\'hui'
         )
 
+    @lectures_replica()
     def handle(self, *args, **options):
         # Déterminer la date
         if options['date']:
@@ -26,9 +35,9 @@ class Command(BaseCommand):
 
         self.stdout.write(f'Calcul des métriques pour le {date_calcul}...')
 
-        # Récupérer les feedbacks jusqu'à cette date
+        # Récupérer les feedbacks jusqu'à cette date (intervalle sur date_creation: index utilisable, contrairement à __date)
         feedbacks = PrescriptionFeedback.objects.filter(
-            date_creation__date__lte=date_calcul
+            date_creation__lt=debut_du_jour(date_calcul + timedelta(days=1))
         )
 
         if not feedbacks.exists():
@@ -124,7 +133,8 @@ class Command(BaseCommand):
         
         # Récupérer les feedbacks avec suivi complet qui n'ont pas encore de données d'apprentissage
         feedbacks_completés = PrescriptionFeedback.objects.filter(
-            date_creation__date=date_calcul,
+            date_creation__gte=debut_du_jour(date_calcul),
+            date_creation__lt=debut_du_jour(date_calcul + timedelta(days=1)),
             suivi_complete=True
         ).exclude(
             id__in=AILearningData.objects.values_list('feedback_source_id', flat=True)
@@ -30,6 +30,9 @@ class Command(BaseCommand):
             self.stdout.write(
                 f'  - Patterns désactivés: {result["deactivated_patterns"]}'
             )
+            self.stdout.write(
+                f'  - Scores de confiance modifiés: {result["updated_patterns"]}'
+            )
             
             # 4. Résumé final
             self.stdout.write(
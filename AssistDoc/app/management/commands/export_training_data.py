@@ -3,6 +3,7 @@ from django.utils import timezone
 from datetime import timedelta
 import json
 import os
+from app.db_router import lectures_replica
 from app.models import AILearningData, PrescriptionFeedback
 
 
@@ -37,6 +38,7 @@ class Command(BaseCommand):
             help='Score minimum de pertinence pour inclure les données (défaut: 7)',
         )
 
+    @lectures_replica()
     def handle(self, *args, **options):
         export_format = options['format']
         period = options['period']
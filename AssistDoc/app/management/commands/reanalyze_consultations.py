@@ -0,0 +1,221 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import time
+import traceback
+from app.consultation_analysis import analyser_consultation, donnees_consultation_enregistree
+from app.gemini_models import (
+    CONSULTATION_SCHEMA, CONSULTATION_SYSTEM_INSTRUCTION,
+    ORDONNANCE_SCHEMA, ORDONNANCE_SYSTEM_INSTRUCTION, fingerprint
+)
+from app.llm_limiter import DatabaseTokenBucket
+from app.models import Consultation, ConsultationReanalysis, ReanalysisRun
+from app.prompt_enhancement import get_enhanced_system_instruction
+
+
+SCHEMAS = {
+    'ordonnance': (ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA),
+    'consultation': (CONSULTATION_SYSTEM_INSTRUCTION, CONSULTATION_SCHEMA),
+}
+
+
+class Command(BaseCommand):
+    help = 'Ré-analyse par l\'IA des consultations historiques (résultats stockés à côté des originaux)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--run',
+            type=str,
+            help='Nom de la campagne. Une campagne existante est reprise là où elle s\'est arrêtée '
+                 '(avec ses filtres d\'origine)',
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Consultations à partir de cette date (AAAA-MM-JJ)',
+        )
+        parser.add_argument(
+            '--until',
+            type=str,
+            help='Consultations jusqu\'à cette date incluse (AAAA-MM-JJ)',
+        )
+        parser.add_argument(
+            '--hospital',
+            type=int,
+            help='ID de l\'hôpital',
+        )
+        parser.add_argument(
+            '--validation',
+            type=str,
+            choices=['validees', 'non_validees', 'toutes'],
+            default='toutes',
+            help='Statut de validation des consultations (défaut: toutes)',
+        )
+        parser.add_argument(
+            '--schema',
+            type=str,
+            choices=list(SCHEMAS),
+            default='ordonnance',
+            help='Instruction et schéma de réponse utilisés (défaut: ordonnance, comme symptome)',
+        )
+        parser.add_argument(
+            '--no-patterns',
+            action='store_true',
+            help='Ne pas enrichir l\'instruction avec les patterns de feedback actuels',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Nombre d\'appels IA en parallèle (défaut: 4)',
+        )
+        parser.add_argument(
+            '--rate',
+            type=int,
+            default=30,
+            help='Appels IA maximum par minute pour la campagne (défaut: 30)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Nombre maximum de consultations à traiter lors de cette exécution',
+        )
+
+    def handle(self, *args, **options):
+        run = self.get_or_create_run(options)
+        filters = run.filters
+        queryset = self.pending_consultations(run)
+
+        system_instruction, response_schema = SCHEMAS[filters['schema']]
+        if filters.get('patterns', True):
+            system_instruction = get_enhanced_system_instruction(system_instruction)
+        instruction_fingerprint = fingerprint(system_instruction)
+        if run.system_instruction_fingerprint and run.system_instruction_fingerprint != instruction_fingerprint:
+            self.stdout.write(self.style.WARNING(
+                'Attention: l\'instruction système a changé depuis le début de la campagne.'
+            ))
+        if not run.system_instruction_fingerprint:
+            run.system_instruction_fingerprint = instruction_fingerprint
+            run.save(update_fields=['system_instruction_fingerprint'])
+
+        pending_ids = list(queryset.order_by('id').values_list('id', flat=True))
+        if options['limit']:
+            pending_ids = pending_ids[:options['limit']]
+        if not pending_ids:
+            self.stdout.write(self.style.WARNING('Aucune consultation à ré-analyser pour cette campagne.'))
+            return
+
+        self.stdout.write(
+            f'🚀 Campagne "{run.name}": {len(pending_ids)} consultation(s) à ré-analyser '
+            f'({run.processed} déjà traitée(s), {options["workers"]} workers, {options["rate"]}/min)...'
+        )
+
+        bucket = DatabaseTokenBucket(
+            name=f'reanalyse:{run.name}'[:50], rate_per_minute=options['rate'], burst=options['workers']
+        )
+        workers = max(1, options['workers'])
+        started = time.monotonic()
+        done_count = 0
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reanalyse') as executor:
+            # Soumission par lots bornés: pas de milliers de futures en mémoire
+            for start in range(0, len(pending_ids), workers * 4):
+                batch = pending_ids[start:start + workers * 4]
+                futures = []
+                for consultation_id in batch:
+                    # Débit limité à la soumission (un seul thread sur la ligne du seau à jetons)
+                    while (delay := bucket.take()) > 0:
+                        time.sleep(delay)
+                    futures.append(executor.submit(
+                        self.reanalyze, run, consultation_id, system_instruction, response_schema
+                    ))
+                wait(futures)
+                done_count += len(batch)
+                for future in futures:
+                    if future.exception() is not None:
+                        # Erreur hors appel IA (base de données...): la consultation sera reprise
+                        self.stdout.write(self.style.ERROR(f'   Erreur: {future.exception()}'))
+
+                # Point de reprise: les résultats sont déjà en base, on met à jour l'avancement
+                self.checkpoint(run)
+                self.stdout.write(
+                    f'   {done_count}/{len(pending_ids)} - {run.processed} traitée(s), {run.failed} échec(s)'
+                )
+
+        if not self.pending_consultations(run).exists():
+            run.completed_at = timezone.now()
+            run.save(update_fields=['completed_at'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Campagne "{run.name}": {run.processed} consultation(s) ré-analysée(s), '
+                f'{run.failed} échec(s) en {elapsed:.0f} s'
+            )
+        )
+
+    def get_or_create_run(self, options):
+        name = options['run'] or f'reanalyse_{timezone.now().strftime("%Y%m%d_%H%M%S")}'
+        run = ReanalysisRun.objects.filter(name=name).first()
+        if run:
+            self.stdout.write(f'♻️  Reprise de la campagne "{name}" (filtres d\'origine conservés)')
+            return run
+
+        for option in ('since', 'until'):
+            if options[option]:
+                try:
+                    datetime.strptime(options[option], '%Y-%m-%d')
+                except ValueError:
+                    raise CommandError(f'Date invalide pour --{option}: {options[option]} (format AAAA-MM-JJ)')
+
+        return ReanalysisRun.objects.create(name=name, filters={
+            'since': options['since'],
+            'until': options['until'],
+            'hospital': options['hospital'],
+            'validation': options['validation'],
+            'schema': options['schema'],
+            'patterns': not options['no_patterns'],
+        })
+
+    def filtered_consultations(self, filters):
+        queryset = Consultation.objects.filter(analysis_status='terminee')
+        if filters.get('since'):
+            queryset = queryset.filter(consultation_date__date__gte=filters['since'])
+        if filters.get('until'):
+            queryset = queryset.filter(consultation_date__date__lte=filters['until'])
+        if filters.get('hospital'):
+            queryset = queryset.filter(hospital_id=filters['hospital'])
+        if filters.get('validation') == 'validees':
+            queryset = queryset.filter(is_validated=True)
+        elif filters.get('validation') == 'non_validees':
+            queryset = queryset.filter(is_validated=False)
+        return queryset
+
+    def pending_consultations(self, run):
+        """Consultations de la campagne sans ré-analyse réussie (les échecs sont retentés à la reprise)"""
+        reussies = ConsultationReanalysis.objects.filter(run=run, status='terminee').values('consultation_id')
+        return self.filtered_consultations(run.filters).exclude(id__in=reussies)
+
+    def checkpoint(self, run):
+        results = ConsultationReanalysis.objects.filter(run=run)
+        run.processed = results.filter(status='terminee').count()
+        run.failed = results.filter(status='echec').count()
+        run.checkpoint_at = timezone.now()
+        run.save(update_fields=['processed', 'failed', 'checkpoint_at'])
+
+    def reanalyze(self, run, consultation_id, system_instruction, response_schema):
+        """Ré-analyse une consultation (thread du pool) et enregistre le résultat"""
+        close_old_connections()
+
+        consultation = Consultation.objects.select_related('patient').get(id=consultation_id)
+        payload = donnees_consultation_enregistree(consultation)
+        try:
+            recommendations = analyser_consultation(payload, system_instruction, response_schema, use_cache=False)
+            result = {'status': 'terminee', 'recommendations': recommendations, 'error': None}
+        except Exception as e:
+            print(f"Erreur lors de la ré-analyse de la consultation {consultation_id}: {e}")
+            result = {'status': 'echec', 'recommendations': None, 'error': traceback.format_exc()}
+
+        ConsultationReanalysis.objects.update_or_create(run=run, consultation_id=consultation_id, defaults=result)
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+import signal
+import threading
+from app.analysis_queue import default_worker_id, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Traite la file des analyses IA de consultation (pool de workers locaux)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Nombre de workers (threads) traitant la file en parallèle (défaut: 4)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Délai en secondes entre deux interrogations d\'une file vide (défaut: 2)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Vider la file puis s\'arrêter (au lieu de tourner en continu)',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        stop_event = threading.Event()
+        processed = []
+
+        def arreter(signum, frame):
+            self.stdout.write(self.style.WARNING('Arrêt demandé, fin des analyses en cours...'))
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, arreter)
+        signal.signal(signal.SIGTERM, arreter)
+
+        self.stdout.write(f'🚀 Démarrage de {workers} worker(s) d\'analyse IA...')
+
+        def boucle(index):
+            worker_id = f'{default_worker_id()}-{index}'
+            processed.append(run_worker(
+                stop_event,
+                worker_id=worker_id,
+                poll_interval=options['poll_interval'],
+                once=options['once'],
+            ))
+
+        threads = [threading.Thread(target=boucle, args=(i,), daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        # join() avec timeout pour rester réactif aux signaux
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ Workers arrêtés: {sum(processed)} analyse(s) traitée(s)')
+        )
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:56
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_feedbackpattern'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consultation',
+            name='analysis_status',
+            field=models.CharField(choices=[('en_attente', "En attente d'analyse"), ('en_cours', 'Analyse en cours'), ('terminee', 'Analyse terminée'), ('echec', 'Analyse échouée')], default='terminee', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ConsultationAnalysisJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField(help_text='Données envoyées à Gemini (data_pour_gemini) au moment de la soumission')),
+                ('status', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('terminee', 'Terminée'), ('echec', 'Échec')], default='en_attente', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text='Pas de traitement avant cette date (backoff)')),
+                ('locked_by', models.CharField(blank=True, max_length=100, null=True)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('consultation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analysis_job', to='app.consultation')),
+            ],
+            options={
+                'verbose_name': 'Analyse IA en file',
+                'verbose_name_plural': 'Analyses IA en file',
+                'ordering': ['run_after', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_consultation_analysis_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMRateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('tokens', models.FloatField(help_text='Jetons disponibles au moment de updated_at')),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Limiteur de débit IA',
+                'verbose_name_plural': 'Limiteurs de débit IA',
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_llm_rate_limit_bucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReanalysisRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('filters', models.JSONField(default=dict, help_text='Filtres de sélection (dates, hôpital, validation, schéma)')),
+                ('system_instruction_fingerprint', models.CharField(blank=True, max_length=64)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('checkpoint_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Campagne de ré-analyse IA',
+                'verbose_name_plural': 'Campagnes de ré-analyse IA',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ConsultationReanalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('terminee', 'Terminée'), ('echec', 'Échec')], max_length=20)),
+                ('recommendations', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('consultation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reanalyses', to='app.consultation')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='app.reanalysisrun')),
+            ],
+            options={
+                'verbose_name': 'Ré-analyse IA de consultation',
+                'verbose_name_plural': 'Ré-analyses IA de consultations',
+                'unique_together': {('run', 'consultation')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_consultation_reanalysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('endpoint', models.CharField(help_text="Origine de l'appel (symptome, traiter_consultation...)", max_length=50)),
+                ('backend', models.CharField(max_length=20)),
+                ('model_name', models.CharField(max_length=100)),
+                ('prompt_version', models.CharField(help_text="Empreinte courte de l'instruction système", max_length=20)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('response_tokens', models.PositiveIntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=6, default=0, max_digits=10)),
+                ('latency_ms', models.PositiveIntegerField()),
+                ('outcome', models.CharField(choices=[('succes', 'Succès'), ('cache', 'Servi depuis le cache'), ('erreur', 'Erreur'), ('indisponible', 'Service IA indisponible')], max_length=20)),
+                ('error_type', models.CharField(blank=True, max_length=100)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to=settings.AUTH_USER_MODEL)),
+                ('hospital', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to='app.hospital')),
+            ],
+            options={
+                'verbose_name': 'Appel IA (télémétrie)',
+                'verbose_name_plural': 'Appels IA (télémétrie)',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Index de recherche sur les descriptions de FeedbackPattern:
+# - PostgreSQL: index GIN pg_trgm (sert les recherches icontains / ILIKE)
+# - SQLite (exécutions locales): table FTS5 externe tenue à jour par triggers
+
+from django.db import migrations
+
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS app_feedbackpattern_description_trgm "
+    "ON app_feedbackpattern USING gin (description gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS app_feedbackpattern_description_trgm",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS app_feedbackpattern_fts USING fts5("
+    "description, content='app_feedbackpattern', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS app_feedbackpattern_fts_ai AFTER INSERT ON app_feedbackpattern BEGIN "
+    "INSERT INTO app_feedbackpattern_fts(rowid, description) VALUES (new.id, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS app_feedbackpattern_fts_ad AFTER DELETE ON app_feedbackpattern BEGIN "
+    "INSERT INTO app_feedbackpattern_fts(app_feedbackpattern_fts, rowid, description) "
+    "VALUES ('delete', old.id, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS app_feedbackpattern_fts_au AFTER UPDATE OF description ON app_feedbackpattern BEGIN "
+    "INSERT INTO app_feedbackpattern_fts(app_feedbackpattern_fts, rowid, description) "
+    "VALUES ('delete', old.id, old.description); "
+    "INSERT INTO app_feedbackpattern_fts(rowid, description) VALUES (new.id, new.description); END",
+    "INSERT INTO app_feedbackpattern_fts(app_feedbackpattern_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS app_feedbackpattern_fts_au",
+    "DROP TRIGGER IF EXISTS app_feedbackpattern_fts_ad",
+    "DROP TRIGGER IF EXISTS app_feedbackpattern_fts_ai",
+    "DROP TABLE IF EXISTS app_feedbackpattern_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        # Autres bases: pas d'index dédié, la recherche reste un icontains
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_llm_call_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_feedbackpattern_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatternUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('endpoint', models.CharField(max_length=50)),
+                ('section', models.CharField(choices=[('erreurs', 'Erreurs fréquentes'), ('bonnes_pratiques', 'Bonnes pratiques'), ('dosages', 'Dosages préférés'), ('age', 'Considérations âge'), ('symptomes', 'Patterns liés aux symptômes')], max_length=20)),
+                ('tokens', models.PositiveIntegerField(default=0, help_text='Tokens estimés de la ligne du pattern dans le prompt')),
+                ('consultation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pattern_usages', to='app.consultation')),
+                ('pattern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usages', to='app.feedbackpattern')),
+            ],
+            options={
+                'verbose_name': 'Utilisation de Pattern',
+                'verbose_name_plural': 'Utilisations de Patterns',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_pattern_usage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['patient', '-consultation_date'], name='consultation_patient_date_idx'),
+        ),
+    ]
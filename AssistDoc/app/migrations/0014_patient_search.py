@@ -0,0 +1,67 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:33
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _normaliser_nom(texte):
+    # Copie de app.models.normaliser_nom au moment de la migration
+    sans_accents = unicodedata.normalize('NFKD', texte or '').encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.findall(r'[a-z0-9]+', sans_accents.lower()))
+
+
+def remplir_noms_recherche(apps, schema_editor):
+    Patient = apps.get_model('app', 'Patient')
+    lot = []
+    for patient in Patient.objects.only('pk', 'last_name', 'first_name').iterator(chunk_size=2000):
+        patient.nom_recherche = _normaliser_nom(f"{patient.last_name} {patient.first_name}")
+        patient.prenom_nom_recherche = _normaliser_nom(f"{patient.first_name} {patient.last_name}")
+        lot.append(patient)
+        if len(lot) >= 2000:
+            Patient.objects.bulk_update(lot, ['nom_recherche', 'prenom_nom_recherche'])
+            lot = []
+    Patient.objects.bulk_update(lot, ['nom_recherche', 'prenom_nom_recherche'])
+
+
+def index_trigramme(apps, schema_editor):
+    # Fautes de frappe: similarité trigramme (opérateur %) servie par un index GIN, PostgreSQL seulement
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS app_patient_nom_recherche_trgm "
+            "ON app_patient USING gin (nom_recherche gin_trgm_ops)"
+        )
+
+
+def supprimer_index_trigramme(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS app_patient_nom_recherche_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_consultation_patient_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='nom_recherche',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=201),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='prenom_nom_recherche',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=201),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='social_security_number',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.RunPython(remplir_noms_recherche, migrations.RunPython.noop),
+        migrations.RunPython(index_trigramme, supprimer_index_trigramme),
+    ]
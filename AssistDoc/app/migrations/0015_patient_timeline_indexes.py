@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_patient_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnostic',
+            index=models.Index(fields=['patient', '-date_diagnostic'], name='diagnostic_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examenlaboratoire',
+            index=models.Index(fields=['patient', '-date_demande'], name='examen_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imageriemedicale',
+            index=models.Index(fields=['patient', '-date_examen'], name='imagerie_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['patient', '-date_prescription'], name='prescription_patient_date_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_patient_timeline_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(condition=models.Q(('is_validated', True)), fields=['doctor', '-consultation_date'], name='consultation_doctor_valid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedbackpattern',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-frequency', '-confidence_score', '-last_occurrence'], name='pattern_active_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedbackpattern',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['last_occurrence'], name='pattern_active_last_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescriptionfeedback',
+            index=models.Index(fields=['-date_creation'], name='feedback_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescriptionfeedback',
+            index=models.Index(fields=['feedback_type', 'date_creation'], name='feedback_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescriptionfeedback',
+            index=models.Index(condition=models.Q(('suivi_complete', True)), fields=['date_creation'], name='feedback_suivi_date_idx'),
+        ),
+    ]
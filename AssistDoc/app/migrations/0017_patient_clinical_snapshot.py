@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientClinicalSnapshot',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='clinical_snapshot', serialize=False, to='app.patient')),
+                ('patient_compact', models.TextField(help_text='Section patient (JSON compact)')),
+                ('historique_compact', models.TextField(default='[]', help_text='Dernières consultations, de la plus récente à la plus ancienne (JSON compact)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Instantané Clinique',
+                'verbose_name_plural': 'Instantanés Cliniques',
+            },
+        ),
+    ]
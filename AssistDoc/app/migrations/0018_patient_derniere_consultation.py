@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:55
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def remplir_derniere_consultation(apps, schema_editor):
+    # Une seule requête UPDATE, servie par l'index consultation (patient, -date)
+    Patient = apps.get_model('app', 'Patient')
+    Consultation = apps.get_model('app', 'Consultation')
+    derniere = Consultation.objects.filter(patient=OuterRef('pk')).order_by('-consultation_date')
+    Patient.objects.update(derniere_consultation=Subquery(derniere.values('consultation_date')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_patient_clinical_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='derniere_consultation',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(remplir_derniere_consultation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['-derniere_consultation', '-id'], name='patient_activite_idx'),
+        ),
+    ]
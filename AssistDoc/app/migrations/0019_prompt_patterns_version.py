@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_patient_derniere_consultation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromptPatternsVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Version des patterns de prompt',
+                'verbose_name_plural': 'Versions des patterns de prompt',
+            },
+        ),
+    ]
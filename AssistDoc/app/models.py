@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+import re
+import unicodedata
 import uuid
 
 class User(AbstractUser):
@@ -54,8 +57,14 @@ class Hospital(models.Model):
         verbose_name = "Hospital"
         verbose_name_plural = "Hospitals"
 
+def normaliser_nom(texte):
+    """Nom sans accents, en minuscules, mots séparés par un espace (recherche de patients)"""
+    sans_accents = unicodedata.normalize('NFKD', texte or '').encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.findall(r'[a-z0-9]+', sans_accents.lower()))
+
+
 class Patient(models.Model):
-    social_security_number = models.CharField(max_length=100)
+    social_security_number = models.CharField(max_length=100, db_index=True)
     last_name = models.CharField(max_length=100)
     first_name = models.CharField(max_length=100)
     birth_date = models.DateField(null=True, blank=True)
@@ -68,12 +77,39 @@ class Patient(models.Model):
     allergies = models.TextField(blank=True, null=True)  # Allergies
     actual_medecines = models.TextField(blank=True, null=True)  # Current medications    
 
+    # Noms normalisés (sans accents, minuscules) pour la recherche par préfixe: "nom prénom" et "prénom nom".
+    # db_index: sous PostgreSQL, Django ajoute l'index varchar_pattern_ops qui sert les LIKE 'abc%'
+    nom_recherche = models.CharField(max_length=201, blank=True, default='', editable=False, db_index=True)
+    prenom_nom_recherche = models.CharField(max_length=201, blank=True, default='', editable=False, db_index=True)
+
+    # Date de la dernière consultation (clé de tri du tableau de bord), maintenue par les
+    # signaux des consultations (app/signals.py)
+    derniere_consultation = models.DateTimeField(null=True, blank=True, editable=False)
+
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.social_security_number})"
 
+    def save(self, *args, **kwargs):
+        self.nom_recherche = normaliser_nom(f"{self.last_name} {self.first_name}")
+        self.prenom_nom_recherche = normaliser_nom(f"{self.first_name} {self.last_name}")
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # Jamais réécrite depuis une instance chargée avant une consultation plus récente
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'derniere_consultation'
+            ]
+        elif update_fields is not None and {'last_name', 'first_name'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'nom_recherche', 'prenom_nom_recherche'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Patient"
         verbose_name_plural = "Patients"
+        indexes = [
+            # Pagination par clé du tableau de bord (dernière activité, puis id)
+            models.Index(fields=['-derniere_consultation', '-id'], name='patient_activite_idx'),
+        ]
 
 
 
@@ -93,6 +129,7 @@ class Consultation(models.Model):
     hospital = models.ForeignKey(Hospital, on_delete=models.CASCADE, related_name='consultations_hospital')
     doctor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='performed_consultations')
     consultation_date = models.DateTimeField(auto_now_add=True)
+    consultation_reason = models.TextField()
     clinical_exam = models.TextField(blank=True, null=True)
     initial_diagnosis = models.TextField(blank=True, null=True)
     tension = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)  # Tension artérielle
@@ -105,6 +142,14 @@ class Consultation(models.Model):
     is_validated = models.BooleanField(default=False)  # Statut de validation de la consultation
     gemini_recommendations = models.JSONField(blank=True, null=True)  # Stockage des recommandations Gemini
 
+    ANALYSIS_STATUS_CHOICES = (
+        ('en_attente', 'En attente d\'analyse'),
+        ('en_cours', 'Analyse en cours'),
+        ('terminee', 'Analyse terminée'),
+        ('echec', 'Analyse échouée'),
+    )
+    analysis_status = models.CharField(max_length=20, choices=ANALYSIS_STATUS_CHOICES, default='terminee')  # Statut de l'analyse IA
+
 
     def __str__(self):
         return f"Consultation for {self.patient.last_name} on {self.consultation_date.strftime('%Y-%m-%d')}"
@@ -113,6 +158,15 @@ class Consultation(models.Model):
         verbose_name = "Consultation"
         verbose_name_plural = "Consultations"
         ordering = ['-consultation_date']
+        indexes = [
+            # Dernière consultation d'un patient (tableau de bord, historique): lecture du premier élément de l'index
+            models.Index(fields=['patient', '-consultation_date'], name='consultation_patient_date_idx'),
+            # Consultations validées d'un médecin, les plus récentes d'abord: index partiel
+            models.Index(
+                fields=['doctor', '-consultation_date'], condition=models.Q(is_validated=True),
+                name='consultation_doctor_valid_idx',
+            ),
+        ]
 
 
 class Diagnostic(models.Model):
@@ -144,6 +198,10 @@ class Diagnostic(models.Model):
         verbose_name = "Diagnostic"
         verbose_name_plural = "Diagnostics"
         ordering = ['-date_diagnostic']
+        indexes = [
+            # Chronologie du patient (patient_timeline): parcours de l'index par date décroissante
+            models.Index(fields=['patient', '-date_diagnostic'], name='diagnostic_patient_date_idx'),
+        ]
 
 
 class PrescriptionFeedback(models.Model):
@@ -198,6 +256,14 @@ class PrescriptionFeedback(models.Model):
         verbose_name = "Feedback Prescription"
         verbose_name_plural = "Feedbacks Prescriptions"
         ordering = ['-date_creation']
+        indexes = [
+            # Fenêtres de dates (métriques, analyse des patterns) et tri par défaut
+            models.Index(fields=['-date_creation'], name='feedback_date_idx'),
+            # Comptes par type de feedback sur une période
+            models.Index(fields=['feedback_type', 'date_creation'], name='feedback_type_date_idx'),
+            # Feedbacks au suivi terminé (génération des données d'apprentissage): index partiel
+            models.Index(fields=['date_creation'], condition=models.Q(suivi_complete=True), name='feedback_suivi_date_idx'),
+        ]
     
     def __str__(self):
         return f"Feedback {self.feedback_type} - {self.consultation.patient.get_full_name()} - {self.date_creation.strftime('%Y-%m-%d')}"
@@ -307,6 +373,9 @@ class Prescription(models.Model):
         verbose_name = "Prescription"
         verbose_name_plural = "Prescriptions"
         ordering = ['-date_prescription']
+        indexes = [
+            models.Index(fields=['patient', '-date_prescription'], name='prescription_patient_date_idx'),
+        ]
 
 
 class ExamenLaboratoire(models.Model):
@@ -330,6 +399,9 @@ class ExamenLaboratoire(models.Model):
         verbose_name = "Examen Laboratoire"
         verbose_name_plural = "Examens Laboratoire"
         ordering = ['-date_resultat', '-date_demande']
+        indexes = [
+            models.Index(fields=['patient', '-date_demande'], name='examen_patient_date_idx'),
+        ]
 
 
 class ImagerieMedicale(models.Model):
@@ -349,6 +421,9 @@ class ImagerieMedicale(models.Model):
         verbose_name = "Imagerie Médicale"
         verbose_name_plural = "Imageries Médicales"
         ordering = ['-date_examen']
+        indexes = [
+            models.Index(fields=['patient', '-date_examen'], name='imagerie_patient_date_idx'),
+        ]
 
 
 class AIRecommendation(models.Model):
@@ -431,6 +506,14 @@ class FeedbackPattern(models.Model):
         verbose_name_plural = "Patterns de Feedback"
         ordering = ['-frequency', '-confidence_score', '-last_occurrence']
         unique_together = ['pattern_type', 'description']
+        indexes = [
+            # Index partiels: seuls les patterns actifs sont lus (instantané des prompts, actualisation)
+            models.Index(
+                fields=['-frequency', '-confidence_score', '-last_occurrence'], condition=models.Q(is_active=True),
+                name='pattern_active_rank_idx',
+            ),
+            models.Index(fields=['last_occurrence'], condition=models.Q(is_active=True), name='pattern_active_last_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_pattern_type_display()}: {self.description[:50]}..."
@@ -445,4 +528,220 @@ class FeedbackPattern(models.Model):
         elif self.frequency >= 2 and self.confidence_score >= 0.3:
             return "Faible"
         else:
-            return "Très faible"
\ No newline at end of file
+            return "Très faible"
+
+
+class ConsultationAnalysisJob(models.Model):
+    """
+    File d'attente des analyses IA de consultation, traitées par la commande
+    run_analysis_worker (réclamation via SELECT ... FOR UPDATE SKIP LOCKED)
+    """
+    STATUS_CHOICES = (
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('terminee', 'Terminée'),
+        ('echec', 'Échec'),
+    )
+
+    consultation = models.OneToOneField(Consultation, on_delete=models.CASCADE, related_name='analysis_job')
+    payload = models.JSONField(help_text="Données envoyées à Gemini (data_pour_gemini) au moment de la soumission")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='en_attente')
+
+    # Tentatives et reprise après redémarrage d'un worker
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Pas de traitement avant cette date (backoff)")
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+
+    # Métadonnées
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Analyse IA en file"
+        verbose_name_plural = "Analyses IA en file"
+        ordering = ['run_after', 'id']
+
+    def __str__(self):
+        return f"Analyse consultation #{self.consultation_id} - {self.get_status_display()} ({self.attempts}/{self.max_attempts})"
+
+
+class LLMRateLimitBucket(models.Model):
+    """
+    Seau à jetons partagé entre processus (vues, workers, commandes) pour limiter
+    le débit global d'appels au LLM. Mis à jour sous SELECT ... FOR UPDATE.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    tokens = models.FloatField(help_text="Jetons disponibles au moment de updated_at")
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Limiteur de débit IA"
+        verbose_name_plural = "Limiteurs de débit IA"
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.1f} jeton(s)"
+
+
+class PromptPatternsVersion(models.Model):
+    """
+    Version des patterns de prompt partagée entre processus (ligne unique):
+    incrémentée à chaque modification de FeedbackPattern, relue périodiquement
+    par chaque processus pour invalider ses instantanés et caches
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Version des patterns de prompt"
+        verbose_name_plural = "Versions des patterns de prompt"
+
+    def __str__(self):
+        return f"Patterns de prompt v{self.version}"
+
+
+class ReanalysisRun(models.Model):
+    """
+    Campagne de ré-analyse IA de consultations historiques (commande
+    reanalyze_consultations). Les filtres sont conservés pour reprendre la campagne.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    filters = models.JSONField(default=dict, help_text="Filtres de sélection (dates, hôpital, validation, schéma)")
+    system_instruction_fingerprint = models.CharField(max_length=64, blank=True)
+
+    # Avancement (point de reprise)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    checkpoint_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Campagne de ré-analyse IA"
+        verbose_name_plural = "Campagnes de ré-analyse IA"
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.processed} traitées, {self.failed} échecs)"
+
+
+class ConsultationReanalysis(models.Model):
+    """
+    Résultat de ré-analyse d'une consultation, stocké à côté des recommandations
+    d'origine (Consultation.gemini_recommendations n'est jamais écrasé)
+    """
+    STATUS_CHOICES = (
+        ('terminee', 'Terminée'),
+        ('echec', 'Échec'),
+    )
+
+    run = models.ForeignKey(ReanalysisRun, on_delete=models.CASCADE, related_name='results')
+    consultation = models.ForeignKey(Consultation, on_delete=models.CASCADE, related_name='reanalyses')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    recommendations = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Ré-analyse IA de consultation"
+        verbose_name_plural = "Ré-analyses IA de consultations"
+        unique_together = ['run', 'consultation']
+
+    def __str__(self):
+        return f"{self.run.name} - consultation #{self.consultation_id} ({self.get_status_display()})"
+
+
+class LLMCallLog(models.Model):
+    """
+    Télémétrie d'un appel d'inférence (vues, worker, commandes): latence, tokens,
+    coût estimé et issue. Écrit par lots (app.llm_telemetry) hors du chemin de la requête.
+    """
+    OUTCOME_CHOICES = (
+        ('succes', 'Succès'),
+        ('cache', 'Servi depuis le cache'),
+        ('erreur', 'Erreur'),
+        ('indisponible', 'Service IA indisponible'),
+    )
+
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    endpoint = models.CharField(max_length=50, help_text="Origine de l'appel (symptome, traiter_consultation...)")
+    backend = models.CharField(max_length=20)
+    model_name = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=20, help_text="Empreinte courte de l'instruction système")
+    doctor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_calls')
+    hospital = models.ForeignKey(Hospital, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_calls')
+
+    # Tokens estimés localement (prompt_builder.estimate_tokens) et coût associé
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    response_tokens = models.PositiveIntegerField(default=0)
+    cost = models.DecimalField(max_digits=10, decimal_places=6, default=0)
+
+    latency_ms = models.PositiveIntegerField()
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    error_type = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        verbose_name = "Appel IA (télémétrie)"
+        verbose_name_plural = "Appels IA (télémétrie)"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.endpoint} - {self.model_name} - {self.latency_ms} ms ({self.get_outcome_display()})"
+
+
+class PatternUsage(models.Model):
+    """
+    Utilisation d'un pattern de feedback dans le prompt d'une consultation (section
+    et coût en tokens). Écrit par lots (app.prompt_enhancement) hors du chemin de la
+    requête; rapproché ensuite du feedback du médecin sur la consultation.
+    """
+    SECTION_CHOICES = (
+        ('erreurs', 'Erreurs fréquentes'),
+        ('bonnes_pratiques', 'Bonnes pratiques'),
+        ('dosages', 'Dosages préférés'),
+        ('age', 'Considérations âge'),
+        ('symptomes', 'Patterns liés aux symptômes'),
+    )
+
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    pattern = models.ForeignKey(FeedbackPattern, on_delete=models.CASCADE, related_name='usages')
+    consultation = models.ForeignKey(
+        Consultation, on_delete=models.SET_NULL, null=True, blank=True, related_name='pattern_usages'
+    )
+    endpoint = models.CharField(max_length=50)
+    section = models.CharField(max_length=20, choices=SECTION_CHOICES)
+    tokens = models.PositiveIntegerField(default=0, help_text="Tokens estimés de la ligne du pattern dans le prompt")
+
+    class Meta:
+        verbose_name = "Utilisation de Pattern"
+        verbose_name_plural = "Utilisations de Patterns"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.pattern_id} - {self.get_section_display()} - {self.created_at:%d/%m/%Y %H:%M}"
+
+
+class PatientClinicalSnapshot(models.Model):
+    """
+    Sections "patient" et "historique" des données envoyées au LLM pour un patient,
+    déjà compactées et sérialisées (JSON compact). Maintenu par signaux à chaque
+    écriture du patient ou de ses consultations (app.clinical_snapshot): le chemin
+    de consultation lit une ligne au lieu de reformater le dossier.
+    """
+    patient = models.OneToOneField(
+        Patient, on_delete=models.CASCADE, primary_key=True, related_name='clinical_snapshot'
+    )
+    patient_compact = models.TextField(help_text="Section patient (JSON compact)")
+    historique_compact = models.TextField(
+        default='[]', help_text="Dernières consultations, de la plus récente à la plus ancienne (JSON compact)"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Instantané Clinique"
+        verbose_name_plural = "Instantanés Cliniques"
+
+    def __str__(self):
+        return f"Instantané clinique - patient {self.patient_id} - {self.updated_at:%d/%m/%Y %H:%M}"
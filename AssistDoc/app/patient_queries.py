@@ -0,0 +1,169 @@
+"""
+Requêtes de listes de patients (tableau de bord, recherche).
+
+Les patients sont paginés par clé (keyset) dans l'ordre de dernière activité:
+(date de dernière consultation décroissante, patients sans consultation en
+dernier, puis id décroissant), sur la colonne indexée Patient.derniere_consultation. Le curseur encode la dernière ligne de la page:
+la page suivante est une simple condition "après cette ligne", sans OFFSET, et
+reste stable quand des consultations sont ajoutées pendant la navigation.
+
+La recherche (saisie semi-automatique) porte sur des colonnes indexées: préfixe
+du numéro de sécurité sociale, préfixe des noms normalisés ("nom prénom" et
+"prénom nom", sans accents) puis, sous PostgreSQL, similarité trigramme pour
+les fautes de frappe.
+"""
+import base64
+from datetime import datetime
+
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, OuterRef, Q, Subquery
+from django.db.models.expressions import RawSQL
+
+from .models import Consultation, Patient, normaliser_nom
+
+PAGE_SIZE = 50
+PAGE_SIZE_MAX = 200
+SEARCH_LIMIT_MAX = 50
+
+
+def patients_par_activite(queryset=None):
+    """
+    Patients annotés avec le diagnostic de leur dernière consultation, triés par
+    dernière activité (Patient.derniere_consultation, indexée). La sous-requête du
+    diagnostic n'est évaluée que pour les lignes retournées
+    """
+    if queryset is None:
+        queryset = Patient.objects.all()
+    derniere = Consultation.objects.filter(patient=OuterRef('pk')).order_by('-consultation_date', '-pk')
+    return queryset.annotate(
+        diagnostic=Subquery(derniere.values('initial_diagnosis')[:1]),
+    ).order_by(F('derniere_consultation').desc(nulls_last=True), '-pk')
+
+
+def noter_consultation(consultation):
+    """Nouvelle consultation: date de dernière activité du patient avancée (sans relecture)"""
+    Patient.objects.filter(
+        Q(derniere_consultation__isnull=True) | Q(derniere_consultation__lt=consultation.consultation_date),
+        pk=consultation.patient_id,
+    ).update(derniere_consultation=consultation.consultation_date)
+
+
+def rafraichir_derniere_consultation(patient_id):
+    """Date de dernière activité relue des consultations (modification, suppression)"""
+    derniere = Consultation.objects.filter(patient=OuterRef('pk')).order_by('-consultation_date')
+    Patient.objects.filter(pk=patient_id).update(
+        derniere_consultation=Subquery(derniere.values('consultation_date')[:1])
+    )
+
+
+def encoder_curseur(patient):
+    """Curseur opaque de la ligne `patient`"""
+    date = patient.derniere_consultation.isoformat() if patient.derniere_consultation else ''
+    return base64.urlsafe_b64encode(f'{date}|{patient.pk}'.encode()).decode().rstrip('=')
+
+
+def decoder_curseur(curseur):
+    """(date de dernière consultation ou None, pk) d'un curseur; ValueError s'il est invalide"""
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4)).decode()
+        date, pk = brut.rsplit('|', 1)
+        return (datetime.fromisoformat(date) if date else None), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Curseur de pagination invalide: {curseur}") from e
+
+
+def page_patients(queryset, curseur=None, taille=PAGE_SIZE):
+    """
+    Page de patients après le curseur (dans l'ordre de patients_par_activite)
+
+    Deux segments lus par l'index (-derniere_consultation, -id): les patients qui
+    ont consulté, puis, si la page n'est pas pleine, ceux qui n'ont jamais consulté
+    (PostgreSQL et SQLite ne rangent pas les NULL du même côté d'un index)
+
+    Returns:
+        tuple: (liste des patients de la page, curseur de la page suivante ou None)
+    """
+    date, pk = decoder_curseur(curseur) if curseur else (None, None)
+    # Une ligne de plus pour savoir s'il existe une page suivante
+    patients = []
+    if not curseur or date is not None:
+        avec_consultation = queryset.filter(derniere_consultation__isnull=False)
+        if curseur:
+            avec_consultation = avec_consultation.filter(
+                Q(derniere_consultation__lt=date) | Q(pk__lt=pk),
+                derniere_consultation__lte=date,
+            )
+        patients = list(avec_consultation.order_by('-derniere_consultation', '-pk')[:taille + 1])
+    if len(patients) <= taille:
+        sans_consultation = queryset.filter(derniere_consultation__isnull=True)
+        if curseur and date is None:
+            sans_consultation = sans_consultation.filter(pk__lt=pk)
+        patients += list(sans_consultation.order_by('-pk')[:taille + 1 - len(patients)])
+
+    if len(patients) > taille:
+        patients = patients[:taille]
+        return patients, encoder_curseur(patients[-1])
+    return patients, None
+
+
+def _numero(recherche):
+    """Numéro de sécurité sociale saisi (chiffres, espaces tolérés), ou None"""
+    chiffres = recherche.replace(' ', '')
+    return chiffres if chiffres.isdigit() else None
+
+
+def _prefixe(champ, valeur):
+    """
+    Q "champ commence par valeur", servi par l'index du champ. SQLite n'utilise
+    pas d'index pour LIKE ... ESCAPE (startswith): intervalle [valeur, valeur
+    suivante[ à la place, exact sur ces colonnes ASCII (comparaison binaire)
+    """
+    if connection.vendor == 'sqlite':
+        suivante = valeur[:-1] + chr(ord(valeur[-1]) + 1)
+        return Q(**{f'{champ}__gte': valeur, f'{champ}__lt': suivante})
+    return Q(**{f'{champ}__startswith': valeur})
+
+
+def filtre_recherche(recherche):
+    """Filtre (Q) des patients par préfixe de numéro de sécurité sociale ou de nom / prénom"""
+    recherche = (recherche or '').strip()
+    if not recherche:
+        return Q()
+    numero = _numero(recherche)
+    if numero:
+        return _prefixe('social_security_number', numero)
+    nom = normaliser_nom(recherche)
+    if not nom:
+        return Q(pk__in=[])
+    return _prefixe('nom_recherche', nom) | _prefixe('prenom_nom_recherche', nom)
+
+
+def rechercher_patients(recherche, limit=10):
+    """
+    Meilleurs patients pour une saisie partielle: correspondances par préfixe
+    (ordre alphabétique), complétées sous PostgreSQL par les noms les plus
+    proches (similarité trigramme, tolère les fautes de frappe)
+    """
+    recherche = (recherche or '').strip()
+    if not recherche:
+        return []
+    limit = min(max(limit, 1), SEARCH_LIMIT_MAX)
+
+    if _numero(recherche):
+        return list(Patient.objects.filter(filtre_recherche(recherche)).order_by('social_security_number')[:limit])
+
+    patients = list(Patient.objects.filter(filtre_recherche(recherche)).order_by('nom_recherche', 'pk')[:limit])
+    nom = normaliser_nom(recherche)
+    if len(patients) < limit and connection.vendor == 'postgresql' and len(nom) >= 3:
+        # Opérateur <% (similarité de mot) servi par l'index GIN pg_trgm (migration 0014)
+        proches = (
+            Patient.objects
+            .filter(RawSQL('%s <%% "app_patient"."nom_recherche"', (nom,), output_field=BooleanField()))
+            .exclude(pk__in=[patient.pk for patient in patients])
+            .annotate(similarite=RawSQL(
+                'word_similarity(%s, "app_patient"."nom_recherche")', (nom,), output_field=FloatField()
+            ))
+            .order_by('-similarite', 'pk')[:limit - len(patients)]
+        )
+        patients += list(proches)
+    return patients
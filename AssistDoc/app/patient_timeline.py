@@ -0,0 +1,113 @@
+"""
+Chronologie d'un patient: consultations validées, diagnostics, prescriptions,
+examens de laboratoire et imageries dans un seul fil, du plus récent au plus
+ancien.
+
+Une page coûte un nombre fixe de requêtes, quelle que soit la taille du
+dossier: un UNION ALL des (type, date, id) des cinq tables, trié et limité en
+base (pagination par clé, sans OFFSET), puis une requête par type présent dans
+la page pour charger les lignes avec leur médecin (select_related).
+"""
+import base64
+from collections import namedtuple
+from datetime import datetime
+
+from django.db import connection
+from django.db.models import CharField, F, Q, Value
+
+from .models import Consultation, Diagnostic, ExamenLaboratoire, ImagerieMedicale, Prescription
+
+PAGE_SIZE = 20
+
+EvenementTimeline = namedtuple('EvenementTimeline', ['type', 'date', 'objet'])
+
+# type -> (modèle, champ date, relations chargées avec la ligne, filtre supplémentaire)
+SOURCES = {
+    'consultation': (Consultation, 'consultation_date', ('doctor',), Q(is_validated=True)),
+    'diagnostic': (Diagnostic, 'date_diagnostic', ('medecin',), Q()),
+    'examen': (ExamenLaboratoire, 'date_demande', ('medecin_prescripteur',), Q()),
+    'imagerie': (ImagerieMedicale, 'date_examen', ('medecin_prescripteur',), Q()),
+    'prescription': (Prescription, 'date_prescription', ('medecin',), Q()),
+}
+
+
+def encoder_curseur(evenement):
+    """Curseur opaque de l'événement (dernière ligne d'une page)"""
+    brut = f'{evenement.date.isoformat()}|{evenement.type}|{evenement.objet.pk}'
+    return base64.urlsafe_b64encode(brut.encode()).decode().rstrip('=')
+
+
+def decoder_curseur(curseur):
+    """(date, type, pk) d'un curseur; ValueError s'il est invalide"""
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4)).decode()
+        date, type_evenement, pk = brut.split('|')
+        if type_evenement not in SOURCES:
+            raise ValueError(type_evenement)
+        return datetime.fromisoformat(date), type_evenement, int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Curseur de chronologie invalide: {curseur}") from e
+
+
+def _apres(type_evenement, champ_date, curseur):
+    """
+    Lignes d'une table placées après le curseur dans l'ordre (date, type, id)
+    décroissant. Le type étant constant par table, la condition se réduit à
+    une comparaison de date (et d'id à date égale pour la table du curseur)
+    """
+    date, type_curseur, pk = curseur
+    if type_evenement < type_curseur:
+        return Q(**{f'{champ_date}__lte': date})
+    if type_evenement == type_curseur:
+        return Q(**{f'{champ_date}__lt': date}) | Q(**{champ_date: date, 'pk__lt': pk})
+    return Q(**{f'{champ_date}__lt': date})
+
+
+def _cles(patient, curseur, limite):
+    """
+    (pk, type, date) de toutes les sources, en une requête UNION ALL non évaluée.
+    Là où la base l'accepte (PostgreSQL), chaque branche est déjà limitée aux
+    `limite` plus récentes: lecture du début de l'index (patient, -date)
+    """
+    limiter = connection.features.supports_slicing_ordering_in_compound
+    requetes = []
+    for type_evenement, (modele, champ_date, _, filtre) in SOURCES.items():
+        requete = modele.objects.filter(filtre, patient=patient)
+        if curseur:
+            requete = requete.filter(_apres(type_evenement, champ_date, curseur))
+        requete = (
+            requete
+            .annotate(type_evenement=Value(type_evenement, output_field=CharField()), date=F(champ_date))
+            .values_list('pk', 'type_evenement', 'date')
+        )
+        requetes.append(requete.order_by('-date', '-pk')[:limite] if limiter else requete.order_by())
+    premiere, *autres = requetes
+    return premiere.union(*autres, all=True)
+
+
+def page_timeline(patient, curseur=None, taille=PAGE_SIZE):
+    """
+    Page de la chronologie du patient après le curseur
+
+    Returns:
+        tuple: (liste d'EvenementTimeline, curseur de la page suivante ou None)
+    """
+    cles = list(
+        _cles(patient, decoder_curseur(curseur) if curseur else None, taille + 1)
+        .order_by('-date', '-type_evenement', '-pk')[:taille + 1]
+    )
+    suivante = len(cles) > taille
+    cles = cles[:taille]
+
+    # Une requête par type présent dans la page, avec le médecin de chaque ligne
+    objets = {}
+    for type_evenement in {type_evenement for _, type_evenement, _ in cles}:
+        modele, _, relations, _ = SOURCES[type_evenement]
+        pks = [pk for pk, t, _ in cles if t == type_evenement]
+        objets[type_evenement] = modele.objects.select_related(*relations).in_bulk(pks)
+
+    evenements = [
+        EvenementTimeline(type_evenement, date, objets[type_evenement][pk])
+        for pk, type_evenement, date in cles
+    ]
+    return evenements, (encoder_curseur(evenements[-1]) if suivante else None)
@@ -0,0 +1,77 @@
+"""
+Recherche des patterns de feedback liés aux symptômes saisis.
+
+Les mots-clés sont les tokens normalisés (minuscules, sans accents, pluriel en -s
+retiré, mots vides ignorés) des descriptions de patterns actifs, indexés en un
+dictionnaire mot-clé -> patterns: chaque token du texte des symptômes y est
+cherché une fois, quel que soit le nombre de patterns. Les patterns trouvés sont
+classés par pertinence (mots-clés rares communs au texte).
+"""
+import heapq
+import math
+import re
+import unicodedata
+
+# Mots fréquents sans valeur clinique (déjà sans accents)
+MOTS_VIDES = frozenset({
+    'alors', 'apres', 'aussi', 'autre', 'avant', 'avec', 'avoir', 'bien', 'cela', 'cette', 'chez', 'comme',
+    'dans', 'deja', 'depuis', 'donc', 'elle', 'elles', 'encore', 'entre', 'etre', 'fait', 'faire', 'jamais',
+    'jour', 'jours', 'leur', 'leurs', 'lors', 'mais', 'medecin', 'moins', 'nous', 'patient', 'patiente',
+    'plus', 'pour', 'quand', 'sans', 'selon', 'sous', 'toujours', 'tout', 'toute', 'toutes', 'tous', 'tres',
+    'vous',
+})
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def normaliser(texte):
+    """Tokens normalisés d'un texte: sans accents, minuscules, >= 4 caractères, hors mots vides"""
+    sans_accents = unicodedata.normalize('NFKD', texte or '').encode('ascii', 'ignore').decode('ascii')
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(sans_accents.lower()):
+        if len(token) <= 3 or token in MOTS_VIDES:
+            continue
+        # Singulier approximatif: "fièvres" et "fièvre" donnent le même token
+        if len(token) > 4 and token.endswith('s'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class PatternMatcher:
+    """Index inversé des patterns par mot-clé, construit une fois par instantané de patterns"""
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self._keywords = []
+        self._patterns_by_keyword = {}
+        for index, pattern in enumerate(self.patterns):
+            keywords = frozenset(normaliser(pattern.description))
+            self._keywords.append(keywords)
+            for keyword in keywords:
+                self._patterns_by_keyword.setdefault(keyword, []).append(index)
+        # Poids d'un mot-clé: plus il est rare parmi les patterns, plus il est discriminant
+        total = len(self.patterns) or 1
+        self._weights = {
+            keyword: math.log(total / len(indexes)) + 1
+            for keyword, indexes in self._patterns_by_keyword.items()
+        }
+
+    def match(self, text, limit=5):
+        """
+        Patterns dont un mot-clé apparaît dans le texte, classés par score (somme
+        des poids des mots-clés trouvés) puis dans l'ordre des patterns
+
+        Returns:
+            list: [(pattern, [mots-clés trouvés]), ...]
+        """
+        found = self._patterns_by_keyword.keys() & set(normaliser(text))
+
+        scores = {}
+        for keyword in found:
+            weight = self._weights[keyword]
+            for index in self._patterns_by_keyword[keyword]:
+                scores[index] = scores.get(index, 0) + weight
+
+        ranked = heapq.nsmallest(limit, scores, key=lambda index: (-scores[index], index))
+        return [(self.patterns[index], sorted(found & self._keywords[index])) for index in ranked]
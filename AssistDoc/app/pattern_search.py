@@ -0,0 +1,57 @@
+"""
+Recherche indexée dans les descriptions de FeedbackPattern.
+
+- PostgreSQL: icontains (ILIKE) servi par l'index GIN pg_trgm
+- SQLite (exécutions locales): table FTS5 app_feedbackpattern_fts, insensible
+  aux accents, mots recherchés comme préfixes
+- autres bases: icontains sans index
+
+Chaque mot de la recherche doit apparaître dans la description (comme la
+recherche de l'admin). Voir la migration 0011_feedbackpattern_search_index.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import FeedbackPattern
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+
+def _fts_query(words):
+    # Chaque mot entre guillemets (aucune syntaxe FTS5 interprétée), en préfixe: "fièvre" trouve "fièvres"
+    return ' AND '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def pattern_search_filter(query):
+    """Filtre (Q) des patterns dont la description contient tous les mots de la recherche"""
+    words = _WORD_PATTERN.findall(query or '')
+    if not words:
+        return Q()
+    if connection.vendor == 'sqlite':
+        return Q(pk__in=RawSQL(
+            'SELECT rowid FROM app_feedbackpattern_fts WHERE app_feedbackpattern_fts MATCH %s',
+            (_fts_query(words),),
+        ))
+    search = Q()
+    for word in words:
+        search &= Q(description__icontains=word)
+    return search
+
+
+def search_patterns(query, active_only=True, limit=None):
+    """
+    Patterns correspondant à la recherche, dans l'ordre du modèle (fréquence,
+    confiance, récence)
+
+    Args:
+        query (str): Mots recherchés (ex: 'pédiatrique', 'toux grasse')
+        active_only (bool): Seulement les patterns actifs
+        limit (int): Nombre maximal de patterns
+    """
+    patterns = FeedbackPattern.objects.filter(pattern_search_filter(query))
+    if active_only:
+        patterns = patterns.filter(is_active=True)
+    return patterns[:limit] if limit else patterns
@@ -0,0 +1,141 @@
+"""
+Construction compacte des prompts envoyés au LLM, sous budget de tokens.
+
+- sérialisation JSON compacte (sans indentation ni espaces)
+- omission des champs vides et des valeurs par défaut ("Aucune allergie connue"...)
+- estimation locale du nombre de tokens, sans appel réseau
+- au-delà du budget: l'historique le plus ancien est retiré en premier, et dans
+  l'instruction système les patterns de feedback les moins fiables
+"""
+import json
+import math
+import re
+
+from django.conf import settings
+
+
+# Valeurs de remplissage produites quand un champ du dossier est vide: elles
+# n'apportent rien au modèle et sont omises comme les champs vides
+VALEURS_PAR_DEFAUT = frozenset({
+    "Non spécifié",
+    "Aucune allergie connue",
+    "Aucune maladie connue",
+    "Aucune chirurgie",
+    "Historique vaccinal non disponible",
+    "Aucun médicament actuel",
+})
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """
+    Estimation locale du nombre de tokens: ~4 caractères par token pour les mots,
+    un token par signe de ponctuation (proche du tokenizer Gemini sur du français/JSON)
+    """
+    if not text:
+        return 0
+    return sum(
+        math.ceil(len(piece) / 4) if piece[0].isalnum() or piece[0] == '_' else 1
+        for piece in _TOKEN_PATTERN.findall(text)
+    )
+
+
+def compacter(value):
+    """Retire récursivement les champs vides (None, '', [], {}) et les valeurs par défaut"""
+    if isinstance(value, dict):
+        compact = {}
+        for key, item in value.items():
+            item = compacter(item)
+            if item not in (None, '', [], {}):
+                compact[key] = item
+        return compact
+    if isinstance(value, (list, tuple)):
+        return [item for item in (compacter(item) for item in value) if item not in (None, '', [], {})]
+    if isinstance(value, str):
+        value = value.strip()
+        return '' if value in VALEURS_PAR_DEFAUT else value
+    return value
+
+
+def serialiser_compact(value):
+    """JSON compact (séparateurs minimaux, accents conservés) des données compactées"""
+    return json.dumps(compacter(value), separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+ENTETE_CONSULTATION = (
+    "Analyse complète du patient et recommandations médicales "
+    "(JSON compact, champs absents = non renseignés, historique du plus récent au plus ancien):"
+)
+CONSIGNE_CONSULTATION = (
+    "Fournis une analyse complète avec diagnostic et prescriptions détaillées basées sur toutes ces données."
+)
+
+
+def construire_prompt_consultation(data_pour_gemini, token_budget=None):
+    """
+    Prompt de consultation sous budget: si le prompt dépasse token_budget,
+    les consultations les plus anciennes de l'historique sont retirées une à une.
+
+    Returns:
+        str: Le prompt compact
+    """
+    if token_budget is None:
+        token_budget = getattr(settings, 'PROMPT_TOKEN_BUDGET', 1500)
+
+    data = compacter(data_pour_gemini)
+    historique = list(data.get('historique_consultations', []))
+
+    while True:
+        if historique:
+            data['historique_consultations'] = historique
+        else:
+            data.pop('historique_consultations', None)
+        prompt = f"{ENTETE_CONSULTATION}\n{json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=str)}\n{CONSIGNE_CONSULTATION}"
+        if not historique or estimate_tokens(prompt) <= token_budget:
+            return prompt
+        # Historique trié du plus récent au plus ancien: retirer le dernier
+        historique.pop()
+
+
+def assembler_instruction(base_instruction, sections, conclusion='', token_budget=None, reserved_tokens=0):
+    """
+    Assemble l'instruction système enrichie sous budget de tokens.
+
+    Args:
+        base_instruction (str): Instruction de base, jamais tronquée
+        sections (list): [(titre, [(confiance, ligne), ...]), ...] dans l'ordre d'affichage
+        conclusion (str): Texte ajouté après les sections s'il en reste au moins une
+        token_budget (int): Budget total de l'instruction (PROMPT_SYSTEM_TOKEN_BUDGET par défaut)
+        reserved_tokens (int): Tokens déjà promis à d'autres enrichissements (contextuels)
+
+    Les lignes de plus faible confiance sont retirées en premier; une section vidée
+    disparaît avec son titre.
+    """
+    if token_budget is None:
+        token_budget = getattr(settings, 'PROMPT_SYSTEM_TOKEN_BUDGET', 1200)
+    budget = token_budget - reserved_tokens
+
+    sections = [(titre, list(lignes)) for titre, lignes in sections if lignes]
+
+    def rendu():
+        presentes = [titre + "".join(ligne for _, ligne in lignes) for titre, lignes in sections if lignes]
+        if not presentes:
+            return base_instruction
+        return base_instruction + "\n\n" + "".join(presentes) + conclusion
+
+    instruction = rendu()
+    while estimate_tokens(instruction) > budget:
+        candidates = [
+            (confiance, index_section, index_ligne)
+            for index_section, (_, lignes) in enumerate(sections)
+            for index_ligne, (confiance, _) in enumerate(lignes)
+        ]
+        if not candidates:
+            break
+        # Confiance la plus faible; à égalité, la ligne affichée le plus bas
+        _, index_section, index_ligne = min(candidates, key=lambda c: (c[0], -c[1], -c[2]))
+        del sections[index_section][1][index_ligne]
+        instruction = rendu()
+
+    return instruction
@@ -2,79 +2,239 @@
 Utilitaires pour l'enrichissement automatique des prompts Gemini
 basé sur l'analyse des feedbacks médecins
 """
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
-from app.models import FeedbackPattern, PrescriptionFeedback
-from django.db.models import Avg, Count
+from decimal import Decimal
+from app.models import FeedbackPattern, PrescriptionFeedback, PromptPatternsVersion
+from app.llm_telemetry import TelemetryBuffer
+from app.pattern_matcher import PatternMatcher
+from app.prompt_builder import assembler_instruction, estimate_tokens
+from django.db import transaction
+from django.db.models import Avg, Count, F, Q
+from collections import namedtuple
+import atexit
+import threading
+import time
 
 
-def get_enhanced_system_instruction(base_instruction):
+# Version des patterns de prompt: incrémentée à chaque modification de FeedbackPattern
+# (signaux, actions admin, refresh_prompt_patterns) pour invalider ce qui en dépend.
+# La version de référence est en base (PromptPatternsVersion), partagée par tous les processus;
+# chacun garde une version locale, changée à chaque incrément local ou dès qu'une relecture
+# (au plus toutes les PROMPT_PATTERNS_VERSION_CHECK_INTERVAL secondes) voit la ligne changer
+_patterns_version = 0
+_shared_version = None
+_shared_version_checked_at = None
+_patterns_version_lock = threading.Lock()
+
+
+def get_patterns_version():
+    """Retourne la version des patterns connue du processus (sans requête)"""
+    return _patterns_version
+
+
+def _note_shared_version(shared_version, checked_at):
+    global _patterns_version, _shared_version, _shared_version_checked_at
+    with _patterns_version_lock:
+        if shared_version != _shared_version:
+            _patterns_version += 1
+            _shared_version = shared_version
+        _shared_version_checked_at = checked_at
+        return _patterns_version
+
+
+def refresh_patterns_version():
+    """
+    Relit la version partagée si la dernière lecture est plus ancienne que
+    PROMPT_PATTERNS_VERSION_CHECK_INTERVAL (1 requête): une modification faite
+    par un autre processus invalide ainsi les données locales en quelques secondes
+    """
+    interval = getattr(settings, 'PROMPT_PATTERNS_VERSION_CHECK_INTERVAL', 5)
+    now = time.monotonic()
+    checked_at = _shared_version_checked_at
+    if checked_at is not None and now - checked_at < interval:
+        return _patterns_version
+    shared_version = PromptPatternsVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+    return _note_shared_version(shared_version, now)
+
+
+def bump_patterns_version():
+    """Signale que les patterns ont changé: les prompts enrichis doivent être recalculés (tous processus)"""
+    global _patterns_version, _shared_version, _shared_version_checked_at
+    versions = PromptPatternsVersion.objects.filter(pk=1)
+    if not versions.update(version=F('version') + 1, updated_at=timezone.now()):
+        PromptPatternsVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+    # Relue après l'incrément: une valeur plus récente (autre processus) est couverte par l'invalidation locale
+    shared_version = versions.values_list('version', flat=True).first()
+    with _patterns_version_lock:
+        _patterns_version += 1
+        _shared_version = shared_version
+        _shared_version_checked_at = time.monotonic()
+        return _patterns_version
+
+
+PatternEntry = namedtuple('PatternEntry', [
+    'pk', 'pattern_type', 'description', 'description_lower', 'frequency', 'confidence_score', 'reliability_level',
+])
+
+# Types de patterns de la section "erreurs fréquentes" du prompt enrichi
+ERROR_PATTERN_TYPES = frozenset({'frequent_modification', 'frequent_rejection', 'diagnostic_error', 'prescription_error'})
+
+
+class PatternSnapshot:
+    """
+    Instantané immuable des patterns actifs et des statistiques récentes, utilisé
+    pour enrichir les prompts sans requête. Reconstruit quand la version des
+    patterns change (signaux, admin, refresh_prompt_patterns) ou au-delà de max_age
+    secondes (statistiques des 7 derniers jours, écritures d'autres processus).
+    """
+
+    def __init__(self, version, patterns, performance_stats, built_at, matcher=None):
+        self.version = version
+        self.patterns = tuple(patterns)  # ordre du modèle: fréquence, confiance, récence
+        self.performance_stats = performance_stats
+        self.built_at = built_at
+        # Patterns assez fiables pour l'instruction système globale
+        self.reliable = tuple(
+            p for p in self.patterns if p.frequency >= 2 and p.confidence_score >= 0.3
+        )
+        self.pediatric = tuple(p for p in self.patterns if 'pédiatrique' in p.description_lower)[:3]
+        self.geriatric = tuple(p for p in self.patterns if 'gériatrique' in p.description_lower)[:3]
+        # Automate des mots-clés: recompilé seulement si les patterns ont changé
+        if matcher is None or matcher.patterns != self.patterns:
+            matcher = PatternMatcher(self.patterns)
+        self.matcher = matcher
+        self._instructions = {}
+
+    def reliable_of_types(self, pattern_types, limit):
+        return [p for p in self.reliable if p.pattern_type in pattern_types][:limit]
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _build_snapshot():
+    # Version lue avant les requêtes: une modification pendant la construction rend l'instantané périmé
+    version = get_patterns_version()
+    patterns = [
+        PatternEntry(
+            pk=pattern.pk,
+            pattern_type=pattern.pattern_type,
+            description=pattern.description,
+            description_lower=pattern.description.lower(),
+            frequency=pattern.frequency,
+            confidence_score=float(pattern.confidence_score),
+            reliability_level=pattern.reliability_level,
+        )
+        for pattern in FeedbackPattern.objects.filter(is_active=True).only(
+            'pattern_type', 'description', 'frequency', 'confidence_score'
+        )
+    ]
+    previous = _snapshot
+    return PatternSnapshot(
+        version, patterns, _compute_performance_stats(), time.monotonic(),
+        matcher=previous.matcher if previous is not None else None,
+    )
+
+
+def get_pattern_snapshot():
+    """
+    Instantané courant des patterns (reconstruit s'il est périmé: 2 requêtes,
+    plus la relecture périodique de la version partagée)
+    """
+    global _snapshot
+    max_age = getattr(settings, 'PROMPT_PATTERNS_SNAPSHOT_MAX_AGE', 300)
+    refresh_patterns_version()
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != get_patterns_version() or time.monotonic() - snapshot.built_at > max_age:
+        with _snapshot_lock:
+            snapshot = _snapshot
+            if (snapshot is None or snapshot.version != get_patterns_version()
+                    or time.monotonic() - snapshot.built_at > max_age):
+                snapshot = _snapshot = _build_snapshot()
+    return snapshot
+
+
+def get_enhanced_system_instruction(base_instruction, token_budget=None, reserved_tokens=0, usage=None):
     """
     Enrichit le prompt système de base avec les patterns de feedback récents
     
     Args:
         base_instruction (str): Instruction système de base pour Gemini
+        token_budget (int): Budget de tokens de l'instruction (PROMPT_SYSTEM_TOKEN_BUDGET par défaut)
+        reserved_tokens (int): Tokens réservés aux enrichissements contextuels ajoutés ensuite
+        usage (list): Si fourni, reçoit les patterns retenus: [(pattern_id, section, tokens), ...]
         
     Returns:
-        str: Instruction système enrichie avec les patterns de feedback
+        str: Instruction système enrichie avec les patterns de feedback, les patterns
+        les moins fiables étant retirés en premier si le budget est dépassé
     """
-    
-    # Récupérer les patterns actifs et fiables
-    active_patterns = FeedbackPattern.objects.filter(
-        is_active=True,
-        frequency__gte=2,  # Au moins 2 occurrences
-        confidence_score__gte=0.3  # Score de confiance minimum
-    ).order_by('-frequency', '-confidence_score')
-    
-    if not active_patterns.exists():
+    # Patterns actifs et fiables (au moins 2 occurrences, confiance >= 0.3), depuis l'instantané
+    snapshot = get_pattern_snapshot()
+    if not snapshot.reliable:
         return base_instruction
     
-    # Construire l'enrichissement
+    # Instruction déjà assemblée pour cet instantané
+    memo_key = (base_instruction, token_budget, reserved_tokens)
+    memo = snapshot._instructions.get(memo_key)
+    if memo is not None:
+        instruction, used = memo
+        if usage is not None:
+            usage.extend(used)
+        return instruction
+    
+    # Construire l'enrichissement: (titre, [(confiance, ligne), ...])
     enhancement_sections = []
+    # Lignes candidates par pattern: (pattern_id, section, ligne)
+    pattern_lines = []
     
     # 1. Erreurs fréquentes à éviter
-    frequent_errors = active_patterns.filter(
-        pattern_type__in=['frequent_modification', 'frequent_rejection', 'diagnostic_error', 'prescription_error']
-    )[:5]
-    
-    if frequent_errors.exists():
-        error_section = "\n🚨 ERREURS FRÉQUENTES À ÉVITER (basé sur feedback médecins):\n"
-        for pattern in frequent_errors:
-            reliability = pattern.reliability_level
-            error_section += f"- {pattern.description} (fiabilité: {reliability})\n"
-        enhancement_sections.append(error_section)
+    frequent_errors = snapshot.reliable_of_types(ERROR_PATTERN_TYPES, 5)
+    error_lines = [
+        (pattern, f"- {pattern.description} (fiabilité: {pattern.reliability_level})\n") for pattern in frequent_errors
+    ]
+    enhancement_sections.append((
+        "\n🚨 ERREURS FRÉQUENTES À ÉVITER (basé sur feedback médecins):\n",
+        [(pattern.confidence_score, line) for pattern, line in error_lines]
+    ))
+    pattern_lines += [(pattern.pk, 'erreurs', line) for pattern, line in error_lines]
     
     # 2. Bonnes pratiques validées
-    good_practices = active_patterns.filter(pattern_type='good_practice')[:3]
-    
-    if good_practices.exists():
-        practice_section = "\n✅ BONNES PRATIQUES VALIDÉES (feedback positifs médecins):\n"
-        for pattern in good_practices:
-            practice_section += f"- {pattern.description}\n"
-        enhancement_sections.append(practice_section)
+    good_practices = snapshot.reliable_of_types({'good_practice'}, 3)
+    enhancement_sections.append((
+        "\n✅ BONNES PRATIQUES VALIDÉES (feedback positifs médecins):\n",
+        [(pattern.confidence_score, f"- {pattern.description}\n") for pattern in good_practices]
+    ))
+    pattern_lines += [(pattern.pk, 'bonnes_pratiques', f"- {pattern.description}\n") for pattern in good_practices]
     
     # 3. Préférences de dosage
-    dosage_preferences = active_patterns.filter(pattern_type='dosage_preference')[:3]
-    
-    if dosage_preferences.exists():
-        dosage_section = "\n💊 DOSAGES PRÉFÉRÉS PAR LES MÉDECINS:\n"
-        for pattern in dosage_preferences:
-            dosage_section += f"- {pattern.description}\n"
-        enhancement_sections.append(dosage_section)
+    dosage_preferences = snapshot.reliable_of_types({'dosage_preference'}, 3)
+    enhancement_sections.append((
+        "\n💊 DOSAGES PRÉFÉRÉS PAR LES MÉDECINS:\n",
+        [(pattern.confidence_score, f"- {pattern.description}\n") for pattern in dosage_preferences]
+    ))
+    pattern_lines += [(pattern.pk, 'dosages', f"- {pattern.description}\n") for pattern in dosage_preferences]
     
-    # 4. Statistiques récentes de performance
-    performance_stats = get_recent_performance_stats()
-    if performance_stats:
-        stats_section = f"\n📊 PERFORMANCE IA RÉCENTE:\n{performance_stats}\n"
-        enhancement_sections.append(stats_section)
+    # 4. Statistiques récentes de performance (retirées avant tout pattern si le budget est dépassé)
+    if snapshot.performance_stats:
+        enhancement_sections.append(("\n📊 PERFORMANCE IA RÉCENTE:\n", [(-1, f"{snapshot.performance_stats}\n")]))
     
-    # Assembler l'instruction enrichie
-    if enhancement_sections:
-        enhanced_instruction = base_instruction + "\n\n" + "".join(enhancement_sections)
-        enhanced_instruction += "\n⚠️ IMPORTANT: Utilise ces informations pour améliorer tes recommandations, mais garde toujours ton jugement médical principal.\n"
-        return enhanced_instruction
-    
-    return base_instruction
+    # Assembler l'instruction enrichie dans le budget de tokens
+    instruction = assembler_instruction(
+        base_instruction,
+        enhancement_sections,
+        conclusion="\n⚠️ IMPORTANT: Utilise ces informations pour améliorer tes recommandations, mais garde toujours ton jugement médical principal.\n",
+        token_budget=token_budget,
+        reserved_tokens=reserved_tokens,
+    )
+    # Patterns dont la ligne a survécu au budget de tokens
+    used = [(pk, section, estimate_tokens(line)) for pk, section, line in pattern_lines if line in instruction]
+    snapshot._instructions[memo_key] = (instruction, used)
+    if usage is not None:
+        usage.extend(used)
+    return instruction
 
 
 def get_recent_performance_stats():
@@ -82,96 +242,115 @@ def get_recent_performance_stats():
     Récupère les statistiques de performance récentes pour informer l'IA
     
     Returns:
-        str: Statistiques formatées pour le prompt
+        str: Statistiques formatées pour le prompt (instantané courant)
     """
-    # Feedbacks des 7 derniers jours
+    return get_pattern_snapshot().performance_stats
+
+
+def _compute_performance_stats():
+    """Statistiques des feedbacks des 7 derniers jours, en une seule agrégation"""
     seven_days_ago = timezone.now() - timedelta(days=7)
-    recent_feedbacks = PrescriptionFeedback.objects.filter(
-        date_creation__gte=seven_days_ago
+    stats = PrescriptionFeedback.objects.filter(date_creation__gte=seven_days_ago).aggregate(
+        total=Count('id'),
+        validated=Count('id', filter=Q(feedback_type='validee_directement')),
+        avg_diagnostic=Avg('pertinence_diagnostic'),
+        avg_prescription=Avg('pertinence_prescription'),
     )
     
-    if not recent_feedbacks.exists():
+    total_count = stats['total']
+    if not total_count:
         return None
     
-    # Calculer les statistiques
-    total_count = recent_feedbacks.count()
-    validation_rate = recent_feedbacks.filter(feedback_type='validee_directement').count() / total_count * 100
-    avg_diagnostic_score = recent_feedbacks.aggregate(avg=Avg('pertinence_diagnostic'))['avg'] or 0
-    avg_prescription_score = recent_feedbacks.aggregate(avg=Avg('pertinence_prescription'))['avg'] or 0
+    validation_rate = stats['validated'] / total_count * 100
+    avg_diagnostic_score = stats['avg_diagnostic'] or 0
+    avg_prescription_score = stats['avg_prescription'] or 0
     
-    stats = f"""- Taux de validation directe cette semaine: {validation_rate:.1f}%
+    return f"""- Taux de validation directe cette semaine: {validation_rate:.1f}%
 - Score moyen diagnostic: {avg_diagnostic_score:.1f}/10
 - Score moyen prescription: {avg_prescription_score:.1f}/10
 - Total feedbacks analysés: {total_count}"""
-    
-    return stats
 
 
-def get_contextual_enhancements(symptoms=None, patient_age=None, patient_gender=None):
+def get_contextual_enhancements(symptoms=None, patient_age=None, patient_gender=None, usage=None):
     """
     Récupère des enrichissements contextuels basés sur les caractéristiques du patient
+    (depuis l'instantané des patterns, sans requête)
     
     Args:
         symptoms (str): Symptômes du patient
         patient_age (int): Âge du patient
         patient_gender (str): Genre du patient
+        usage (list): Si fourni, reçoit les patterns utilisés: [(pattern_id, section, tokens), ...]
         
     Returns:
         str: Enrichissements contextuels
     """
+    snapshot = get_pattern_snapshot()
     enhancements = []
     
     # Patterns spécifiques à l'âge
     if patient_age:
         if patient_age < 18:
-            age_patterns = FeedbackPattern.objects.filter(
-                description__icontains='pédiatrique',
-                is_active=True
-            )
+            age_patterns = snapshot.pediatric
         elif patient_age > 65:
-            age_patterns = FeedbackPattern.objects.filter(
-                description__icontains='gériatrique',
-                is_active=True
-            )
+            age_patterns = snapshot.geriatric
         else:
-            age_patterns = FeedbackPattern.objects.none()
+            age_patterns = ()
         
-        if age_patterns.exists():
+        if age_patterns:
             age_section = f"\n👥 CONSIDÉRATIONS SPÉCIFIQUES ÂGE ({patient_age} ans):\n"
-            for pattern in age_patterns[:3]:
+            for pattern in age_patterns:
                 age_section += f"- {pattern.description}\n"
+                if usage is not None:
+                    usage.append((pattern.pk, 'age', estimate_tokens(f"- {pattern.description}\n")))
             enhancements.append(age_section)
     
-    # Patterns spécifiques aux symptômes
+    # Patterns liés aux symptômes: chaque token du texte est cherché une fois dans l'index des mots-clés
     if symptoms:
-        symptom_keywords = symptoms.lower().split()
-        for keyword in symptom_keywords[:3]:  # Limiter à 3 mots-clés
-            if len(keyword) > 3:  # Ignorer les mots trop courts
-                symptom_patterns = FeedbackPattern.objects.filter(
-                    description__icontains=keyword,
-                    is_active=True
-                )[:2]
-                
-                if symptom_patterns.exists():
-                    symptom_section = f"\n🔍 PATTERNS POUR '{keyword.upper()}':\n"
-                    for pattern in symptom_patterns:
-                        symptom_section += f"- {pattern.description}\n"
-                    enhancements.append(symptom_section)
+        matches = snapshot.matcher.match(symptoms, limit=getattr(settings, 'PROMPT_SYMPTOM_PATTERNS_LIMIT', 5))
+        if matches:
+            keywords = sorted({keyword for _, pattern_keywords in matches for keyword in pattern_keywords})
+            symptom_section = f"\n🔍 PATTERNS POUR '{', '.join(keywords).upper()}':\n"
+            for pattern, _ in matches:
+                symptom_section += f"- {pattern.description}\n"
+                if usage is not None:
+                    usage.append((pattern.pk, 'symptomes', estimate_tokens(f"- {pattern.description}\n")))
+            enhancements.append(symptom_section)
     
     return "".join(enhancements)
 
 
-def log_prompt_enhancement_usage(enhancement_type, patterns_used):
+# Utilisations des patterns (PatternUsage), écrites par lots hors du chemin de la requête
+pattern_usage_buffer = TelemetryBuffer(
+    batch_size=getattr(settings, 'LLM_TELEMETRY_BATCH_SIZE', 50),
+    flush_interval=getattr(settings, 'LLM_TELEMETRY_FLUSH_INTERVAL', 5.0),
+    model_label='app.PatternUsage',
+)
+atexit.register(pattern_usage_buffer.flush)
+
+
+def log_prompt_enhancement_usage(patterns_used, consultation_id=None, endpoint=''):
     """
-    Log l'utilisation des enrichissements de prompt pour analyse
+    Enregistre (dans le tampon) les patterns utilisés par le prompt d'une consultation
     
     Args:
-        enhancement_type (str): Type d'enrichissement utilisé
-        patterns_used (list): Liste des patterns utilisés
+        patterns_used (list): [(pattern_id, section, tokens), ...] rempli par
+            get_enhanced_system_instruction / get_contextual_enhancements (paramètre usage)
+        consultation_id (int): Consultation dont le prompt a utilisé ces patterns
+        endpoint (str): Origine du prompt (traiter_consultation...)
     """
-    # Cette fonction peut être utilisée pour tracker l'efficacité
-    # des différents types d'enrichissements
-    pass
+    if not patterns_used or not getattr(settings, 'LLM_TELEMETRY_ENABLED', True):
+        return
+    created_at = timezone.now()
+    for pattern_id, section, tokens in patterns_used:
+        pattern_usage_buffer.add({
+            'created_at': created_at,
+            'pattern_id': pattern_id,
+            'consultation_id': consultation_id,
+            'endpoint': endpoint,
+            'section': section,
+            'tokens': tokens,
+        })
 
 
 def get_prompt_enhancement_summary():
@@ -201,36 +380,55 @@ def get_prompt_enhancement_summary():
     return summary
 
 
-def refresh_prompt_patterns():
+def refresh_prompt_patterns(batch_size=1000):
     """
     Actualise les patterns de prompt en désactivant les anciens
     et en recalculant les scores de confiance
+
+    Ensembliste: une requête UPDATE pour la désactivation, puis lecture des seules
+    colonnes utiles et bulk_update par lots des scores modifiés, le tout dans une
+    transaction. Les prompts enrichis sont invalidés une seule fois, à la fin.
     """
-    # Désactiver les patterns trop anciens (plus de 30 jours sans occurrence)
-    thirty_days_ago = timezone.now() - timedelta(days=30)
+    now = timezone.now()
+    thirty_days_ago = now - timedelta(days=30)
+    updated_count = 0
     
-    old_patterns = FeedbackPattern.objects.filter(
-        last_occurrence__lt=thirty_days_ago,
-        is_active=True
-    )
-    
-    deactivated_count = old_patterns.update(is_active=False)
-    
-    # Recalculer les scores de confiance basés sur la fréquence récente
-    active_patterns = FeedbackPattern.objects.filter(is_active=True)
-    
-    for pattern in active_patterns:
-        # Calculer le score basé sur la fréquence et la récence
-        days_since_last = (timezone.now() - pattern.last_occurrence).days
-        recency_factor = max(0, 1 - (days_since_last / 30))  # Diminue avec le temps
+    with transaction.atomic():
+        # Désactiver les patterns trop anciens (plus de 30 jours sans occurrence)
+        deactivated_count = FeedbackPattern.objects.filter(
+            last_occurrence__lt=thirty_days_ago,
+            is_active=True
+        ).update(is_active=False)
         
-        # Nouveau score de confiance
-        new_confidence = min(1.0, (pattern.frequency / 10) * recency_factor)
-        pattern.confidence_score = new_confidence
-        pattern.save()
+        # Recalculer les scores de confiance basés sur la fréquence récente
+        active_patterns = FeedbackPattern.objects.filter(is_active=True).order_by('pk')
+        active_count = 0
+        batch = []
+        for pk, frequency, last_occurrence, confidence_score in active_patterns.values_list(
+            'pk', 'frequency', 'last_occurrence', 'confidence_score'
+        ).iterator(chunk_size=batch_size):
+            active_count += 1
+            # Calculer le score basé sur la fréquence et la récence
+            days_since_last = (now - last_occurrence).days
+            recency_factor = max(0, 1 - (days_since_last / 30))  # Diminue avec le temps
+            
+            # Nouveau score de confiance (seuls les scores modifiés sont écrits)
+            new_confidence = Decimal(str(round(min(1.0, (frequency / 10) * recency_factor), 2)))
+            if new_confidence != confidence_score:
+                # bulk_update: last_occurrence (auto_now) n'est pas touché par le recalcul
+                batch.append(FeedbackPattern(pk=pk, confidence_score=new_confidence))
+            if len(batch) >= batch_size:
+                updated_count += FeedbackPattern.objects.bulk_update(batch, ['confidence_score'])
+                batch = []
+        if batch:
+            updated_count += FeedbackPattern.objects.bulk_update(batch, ['confidence_score'])
+    
+    # update()/bulk_update() ne déclenchent pas les signaux: invalider explicitement les prompts enrichis
+    bump_patterns_version()
     
     return {
         'deactivated_patterns': deactivated_count,
-        'active_patterns': active_patterns.count(),
+        'active_patterns': active_count,
+        'updated_patterns': updated_count,
         'refreshed_at': timezone.now()
     }
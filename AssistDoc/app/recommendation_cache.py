@@ -0,0 +1,122 @@
+"""
+Cache des recommandations Gemini adressé par contenu.
+
+Une consultation resoumise (erreur de formulaire, retry du navigateur après un timeout)
+produit les mêmes données patient et la même instruction système: la réponse déjà
+obtenue est réutilisée au lieu de repayer un appel Gemini identique.
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+
+from cachetools import TTLCache
+from django.conf import settings
+
+from .gemini_models import GEMINI_MODEL_NAME, fingerprint, schema_fingerprint
+from .prompt_enhancement import get_patterns_version
+
+
+def canonicalize(value):
+    """
+    Forme canonique des données envoyées à Gemini: espaces de bord retirés,
+    pour que deux soumissions équivalentes du formulaire aient la même clé
+    """
+    if isinstance(value, dict):
+        return {str(key): canonicalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(item) for item in value]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+class RecommendationCache:
+    """
+    Cache borné (LRU) avec expiration (TTL) des recommandations par clé de contenu.
+
+    Le cache est vidé dès que la version des patterns de feedback change, puisque
+    l'instruction enrichie par prompt_enhancement n'est alors plus la même.
+    """
+
+    def __init__(self, maxsize=256, ttl=900, timer=time.monotonic):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self._lock = threading.Lock()
+        self._patterns_version = get_patterns_version()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_key(self, payload, system_instruction, response_schema=None, model_name=GEMINI_MODEL_NAME):
+        """Clé = hash des données canonicalisées + version de l'instruction système"""
+        canonical = json.dumps(
+            canonicalize(payload), sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str
+        )
+        material = '|'.join([
+            model_name,
+            fingerprint(system_instruction),
+            schema_fingerprint(response_schema),
+            canonical,
+        ])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _check_patterns_version(self):
+        version = get_patterns_version()
+        if version != self._patterns_version:
+            self._entries.clear()
+            self._patterns_version = version
+            self.invalidations += 1
+
+    def get(self, key):
+        with self._lock:
+            self._check_patterns_version()
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Copie: la vue peut modifier les recommandations avant sauvegarde
+        return copy.deepcopy(value)
+
+    def __contains__(self, key):
+        """Présence d'une entrée valide, sans compter de hit ni de miss"""
+        with self._lock:
+            self._check_patterns_version()
+            return key in self._entries
+
+    def set(self, key, value):
+        with self._lock:
+            self._check_patterns_version()
+            self._entries[key] = copy.deepcopy(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'max_size': int(self._entries.maxsize),
+                'ttl': self._entries.ttl,
+                'hit_rate': round(self.hits / total * 100, 1) if total else 0.0,
+            }
+
+
+recommendation_cache = RecommendationCache(
+    maxsize=getattr(settings, 'RECOMMENDATION_CACHE_SIZE', 256),
+    ttl=getattr(settings, 'RECOMMENDATION_CACHE_TTL', 900),
+)
+
+
+def get_recommendation_cache_stats():
+    """Statistiques du cache de recommandations (processus courant)"""
+    return recommendation_cache.stats()
@@ -0,0 +1,92 @@
+"""
+Diffusion progressive (Server-Sent Events) des recommandations Gemini.
+
+Gemini renvoie en streaming le texte d'un objet JSON conforme au schéma de réponse.
+Chaque membre de premier niveau (diagnostic_principal, prescriptions_recommandees...)
+est envoyé au navigateur dès qu'il est complet, sans attendre la fin de la réponse.
+"""
+import json
+
+
+class IncrementalJSONObjectParser:
+    """
+    Extrait les membres de premier niveau d'un objet JSON reçu par morceaux.
+
+    feed() retourne la liste des couples (clé, valeur) complétés par le morceau reçu.
+    Le texte hors de l'objet racine (ex: balises ```json) est ignoré: object_text
+    ne contient que l'objet racine, à passer à json.loads() en fin de flux.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self._root_start = None
+        self._root_end = None
+
+    def feed(self, text):
+        self._buffer += text
+        members = []
+
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = self._pos + 1
+                    if self._root_start is None:
+                        self._root_start = self._pos
+            elif char in '}]':
+                if self._depth == 1:
+                    members.extend(self._close_member())
+                    if self._root_end is None:
+                        self._root_end = self._pos + 1
+                self._depth = max(self._depth - 1, 0)
+            elif char == ',' and self._depth == 1:
+                members.extend(self._close_member())
+                self._member_start = self._pos + 1
+
+            self._pos += 1
+
+        return members
+
+    def _close_member(self):
+        segment = self._buffer[self._member_start:self._pos].strip()
+        if not segment:
+            return []
+        try:
+            return list(json.loads('{' + segment + '}').items())
+        except json.JSONDecodeError:
+            # Membre mal formé: il sera visible dans l'objet final, pas en aperçu
+            return []
+
+    @property
+    def text(self):
+        """Texte complet reçu jusqu'ici"""
+        return self._buffer
+
+    @property
+    def object_text(self):
+        """Texte de l'objet racine (jusqu'à la fin du texte reçu s'il n'est pas encore fermé)"""
+        if self._root_start is None:
+            return self._buffer
+        return self._buffer[self._root_start:self._root_end]
+
+
+def sse_event(event, data):
+    """Formate un évènement Server-Sent Events (data JSON sur une seule ligne)"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
@@ -0,0 +1,47 @@
+"""
+Signaux de l'application: invalidation des données dérivées des patterns de feedback,
+maintenance de l'instantané clinique et de la date de dernière consultation des patients
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .clinical_snapshot import (
+    CHAMPS_HISTORIQUE, consultation_ajoutee, patient_modifie, rafraichir_historique
+)
+from .models import Consultation, FeedbackPattern, Patient
+from .patient_queries import noter_consultation, rafraichir_derniere_consultation
+from .prompt_enhancement import bump_patterns_version
+
+
+@receiver(post_save, sender=FeedbackPattern)
+@receiver(post_delete, sender=FeedbackPattern)
+def feedback_pattern_changed(sender, **kwargs):
+    """Toute écriture sur un pattern change le prompt enrichi envoyé à Gemini"""
+    bump_patterns_version()
+    # Et encore au commit: un instantané reconstruit entre l'écriture et le commit
+    # (lecture de l'état précédent par une autre connexion) ne doit pas rester en place
+    transaction.on_commit(bump_patterns_version)
+
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, created, update_fields=None, **kwargs):
+    patient_modifie(instance, created=created, update_fields=update_fields)
+
+
+@receiver(post_save, sender=Consultation)
+def consultation_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        noter_consultation(instance)
+        consultation_ajoutee(instance)
+        return
+    if update_fields is None or 'consultation_date' in update_fields:
+        rafraichir_derniere_consultation(instance.patient_id)
+    if update_fields is None or CHAMPS_HISTORIQUE & set(update_fields):
+        rafraichir_historique(instance.patient_id)
+
+
+@receiver(post_delete, sender=Consultation)
+def consultation_deleted(sender, instance, **kwargs):
+    rafraichir_derniere_consultation(instance.patient_id)
+    rafraichir_historique(instance.patient_id)
@@ -0,0 +1,170 @@
+"""
+Pré-analyse spéculative pendant la saisie du formulaire symptome.
+
+Le navigateur envoie l'état du formulaire quand le médecin fait une pause
+(brouillon). Si les champs requis sont remplis, l'analyse est lancée en
+arrière-plan avec exactement les données qu'enverrait la soumission finale: la
+clé du cache de recommandations (hash des données) sert d'identifiant. À la
+soumission, symptome réutilise le résultat si la clé est identique (cache), ou
+attend la pré-analyse encore en cours; sinon un appel normal est fait.
+
+Les pré-analyses sont plafonnées par médecin (seau à jetons en base, une seule
+en cours à la fois) et suspendues quand le service IA est chargé.
+"""
+import asyncio
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .consultation_analysis import analyser_consultation
+from .llm_backends import get_llm_backend
+from .llm_limiter import DatabaseTokenBucket, llm_limiter
+from .recommendation_cache import recommendation_cache
+
+
+class SpeculativeAnalyzer:
+    """
+    Pré-analyses en cours, par clé de données. Exécutées dans un pool de threads
+    (et non des tâches asyncio) pour survivre à la fin de la requête brouillon,
+    y compris sous un serveur WSGI.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._par_medecin = {}
+        self.launched = 0
+        self.reused = 0
+        self.capped = 0
+        self.failed = 0
+
+    def en_cours(self, cle):
+        with self._lock:
+            return self._futures.get(cle)
+
+    def medecin_occupe(self, doctor_id):
+        with self._lock:
+            return doctor_id in self._par_medecin
+
+    def lancer(self, cle, doctor_id, fn):
+        """Soumet fn() pour cette clé; 'en_cours' si déjà lancée, 'occupe' si le médecin en a une autre"""
+        with self._lock:
+            if cle in self._futures:
+                return 'en_cours'
+            if doctor_id in self._par_medecin:
+                return 'occupe'
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='speculation')
+            future = self._executor.submit(fn)
+            self._futures[cle] = future
+            self._par_medecin[doctor_id] = cle
+            self.launched += 1
+
+        def terminee(future):
+            with self._lock:
+                self._futures.pop(cle, None)
+                self._par_medecin.pop(doctor_id, None)
+                if future.exception() is not None:
+                    self.failed += 1
+
+        future.add_done_callback(terminee)
+        return 'lance'
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._futures),
+                'launched': self.launched,
+                'reused': self.reused,
+                'capped': self.capped,
+                'failed': self.failed,
+            }
+
+
+speculative_analyzer = SpeculativeAnalyzer(
+    max_workers=getattr(settings, 'SPECULATIVE_ANALYSIS_WORKERS', 2),
+)
+
+
+def cle_analyse(data_pour_gemini, system_instruction, response_schema):
+    """Hash des données envoyées au LLM: identique pour le brouillon et la soumission finale"""
+    return recommendation_cache.make_key(
+        data_pour_gemini, system_instruction, response_schema, model_name=get_llm_backend().model_name
+    )
+
+
+def _quota_medecin(doctor_id):
+    return DatabaseTokenBucket(
+        name=f'speculation:{doctor_id}'[:50],
+        rate_per_minute=getattr(settings, 'SPECULATIVE_ANALYSIS_PER_MINUTE', 2),
+        burst=getattr(settings, 'SPECULATIVE_ANALYSIS_BURST', 3),
+    )
+
+
+def _service_charge():
+    """Pas de spéculation quand plus de la moitié des créneaux d'appel sont occupés"""
+    concurrency = llm_limiter.concurrency
+    return concurrency.in_flight * 2 >= int(concurrency.limit)
+
+
+async def lancer_analyse_speculative(data_pour_gemini, system_instruction, response_schema, doctor_id,
+                                     telemetry=None):
+    """
+    Lance la pré-analyse de ces données si nécessaire.
+
+    Returns:
+        str: 'pret' (déjà en cache), 'en_cours', 'lance', 'occupe' (médecin ou
+        service déjà chargé) ou 'plafond' (quota de pré-analyses du médecin atteint)
+    """
+    cle = cle_analyse(data_pour_gemini, system_instruction, response_schema)
+    if cle in recommendation_cache:
+        return 'pret'
+    if speculative_analyzer.en_cours(cle) is not None:
+        return 'en_cours'
+    if speculative_analyzer.medecin_occupe(doctor_id) or _service_charge():
+        return 'occupe'
+    if await sync_to_async(_quota_medecin(doctor_id).take)() > 0:
+        speculative_analyzer.capped += 1
+        return 'plafond'
+
+    def analyse():
+        close_old_connections()
+        try:
+            return analyser_consultation(data_pour_gemini, system_instruction, response_schema, telemetry=telemetry)
+        except Exception as e:
+            print(f"Erreur lors de la pré-analyse spéculative: {e}")
+            raise
+        finally:
+            close_old_connections()
+
+    return speculative_analyzer.lancer(cle, doctor_id, analyse)
+
+
+async def resultat_speculatif(data_pour_gemini, system_instruction, response_schema, timeout=None):
+    """
+    Résultat de la pré-analyse en cours pour ces données (attendue au plus `timeout`
+    secondes), ou None: pas de pré-analyse, données différentes ou échec
+    """
+    future = speculative_analyzer.en_cours(cle_analyse(data_pour_gemini, system_instruction, response_schema))
+    if future is None:
+        return None
+    if timeout is None:
+        timeout = getattr(settings, 'LLM_TOTAL_DEADLINE', 45)
+    try:
+        # shield: un abandon de la requête n'annule pas la pré-analyse partagée
+        recommendations = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+    except Exception:
+        return None
+    speculative_analyzer.reused += 1
+    # Copie: le résultat peut être partagé par plusieurs soumissions
+    return copy.deepcopy(recommendations)
+
+
+def get_speculative_stats():
+    return speculative_analyzer.stats()
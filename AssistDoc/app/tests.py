@@ -1,3 +1,1679 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .analysis_queue import claim_next_job, enqueue_consultation_analysis, process_job
+from .consultation_analysis import analyser_consultation, analyser_consultation_async
+from .clinical_snapshot import construire_snapshot, obtenir_snapshot
+from .context_cache import ContextCacheManager, LocalContextCacheClient
+from .db_router import contexte_requete, lectures_replica
+from .gemini_models import (
+    CONSULTATION_SCHEMA, CONSULTATION_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA, ORDONNANCE_SYSTEM_INSTRUCTION,
+    get_generative_model, model_registry
+)
+from .llm_backends import (
+    FakeLLMBackend, GeminiBackend, LLMBackendError, LLMServerError, LLMThrottledError, get_llm_backend, set_llm_backend
+)
+from .llm_limiter import AIMDConcurrencyLimiter, DatabaseTokenBucket, LLMCallLimiter, SingleFlight, llm_limiter
+from .llm_resilience import (
+    LLMTimeoutError, LLMUnavailableError, ResilientBackend, ResiliencePolicy, resilience_policy
+)
+from .llm_telemetry import TelemetryBuffer, percentile, telemetry_summary
+from .models import (
+    AILearningData, Consultation, ConsultationAnalysisJob, ConsultationReanalysis, Diagnostic, ExamenLaboratoire,
+    FeedbackPattern, Hospital, IAPerformanceMetrics, ImagerieMedicale, LLMCallLog, LLMRateLimitBucket, PatternUsage,
+    Patient, PatientClinicalSnapshot, Prescription, PrescriptionFeedback, PromptPatternsVersion, ReanalysisRun, User
+)
+from .patient_queries import page_patients, patients_par_activite, rafraichir_derniere_consultation
+from .patient_timeline import page_timeline
+from .pattern_matcher import PatternMatcher
+from .pattern_search import search_patterns
+from .prompt_builder import compacter, construire_prompt_consultation, estimate_tokens
+from .prompt_enhancement import (
+    PatternEntry, bump_patterns_version, get_contextual_enhancements, get_enhanced_system_instruction,
+    get_pattern_snapshot, get_patterns_version, log_prompt_enhancement_usage, refresh_prompt_patterns
+)
+from .recommendation_cache import RecommendationCache, recommendation_cache
+from .recommendation_stream import IncrementalJSONObjectParser
+from .speculative_analysis import speculative_analyzer
+
+
+RECOMMANDATIONS_TEST = {
+    'diagnostic_principal': 'Rhinopharyngite',
+    'diagnostic_differentiel': ['Grippe'],
+    'justification_diagnostic': 'Tableau viral sans signe de gravité',
+    'prescriptions_recommandees': [{
+        'nom_medicament': 'Paracétamol',
+        'dosage': '1 g',
+        'frequence': '3 fois par jour',
+        'justification': 'Antalgique / antipyrétique',
+    }],
+    'urgence_niveau': 'Faible',
+    'ordonnance_medicale': {
+        'medicaments': [{
+            'nom_commercial': 'Doliprane',
+            'posologie': '1 comprimé',
+            'frequence': '3 fois par jour',
+            'duree': '5 jours',
+        }],
+        'instructions_generales': 'Repos',
+    },
+}
+
+
+class ConsultationTestMixin:
+    """Données communes aux tests de consultation"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Pas d'écriture de télémétrie en arrière-plan pendant les tests (voir LLMTelemetryTests)
+        telemetry = override_settings(LLM_TELEMETRY_ENABLED=False)
+        telemetry.enable()
+        cls.addClassCleanup(telemetry.disable)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospital = Hospital.objects.create(name='CHU Test', city='Abidjan', country='CI')
+        cls.doctor = User.objects.create_user(username='dr_test', password='secret-pass-123')
+        cls.doctor.hospitals.add(cls.hospital)
+        cls.patient = Patient.objects.create(
+            social_security_number='123456789',
+            last_name='Kouassi',
+            first_name='Awa',
+            gender='F',
+            allergies='Pénicilline',
+        )
+
+    def formulaire_consultation(self, **extra):
+        data = {
+            'consultation_reason': 'Fièvre et toux',
+            'symptoms_text': 'toux sèche depuis trois jours',
+            'temperature': '38.5',
+            'frequence_cardiaque': '90',
+        }
+        data.update(extra)
+        return data
+
+
+def fake_gemini_response(recommendations=RECOMMANDATIONS_TEST):
+    response = mock.Mock()
+    response.text = json.dumps(recommendations, ensure_ascii=False)
+    return response
+
+
+def fake_gemini_stream(recommendations=RECOMMANDATIONS_TEST, chunk_size=20):
+    """Réponse streaming Gemini simulée: le JSON découpé en morceaux de texte"""
+    text = json.dumps(recommendations, ensure_ascii=False, indent=2)
+
+    async def chunks():
+        for start in range(0, len(text), chunk_size):
+            yield mock.Mock(text=text[start:start + chunk_size])
+
+    return chunks()
+
+
+class SymptomeAsyncViewTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        model_registry.clear()
+        recommendation_cache.clear()
+        resilience_policy.reset()
+        self.async_client.force_login(self.doctor)
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    async def test_post_uses_async_gemini_call_and_saves_consultation(self, model_cls):
+        model_cls.return_value.generate_content_async = mock.AsyncMock(return_value=fake_gemini_response())
+
+        response = await self.async_client.post(
+            f'/symptome/{self.patient.social_security_number}/',
+            self.formulaire_consultation(),
+        )
+
+        self.assertEqual(response.status_code, 200)
+        model_cls.return_value.generate_content_async.assert_awaited_once()
+        model_cls.return_value.generate_content.assert_not_called()
+        consultation = await Consultation.objects.aget(patient=self.patient)
+        self.assertEqual(consultation.initial_diagnosis, 'Rhinopharyngite')
+        self.assertEqual(consultation.hospital_id, self.hospital.id)
+
+    async def test_get_renders_form(self):
+        response = await self.async_client.get(f'/symptome/{self.patient.social_security_number}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.patient.first_name)
+
+
+class GenerativeModelRegistryTests(TestCase):
+
+    def setUp(self):
+        model_registry.clear()
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    def test_reuses_model_for_same_instruction_and_schema(self, model_cls):
+        model_cls.side_effect = lambda **kwargs: mock.Mock()
+
+        first = get_generative_model('instruction', ORDONNANCE_SCHEMA)
+        second = get_generative_model('instruction', ORDONNANCE_SCHEMA)
+        other = get_generative_model('instruction', CONSULTATION_SCHEMA)
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEqual(model_cls.call_count, 2)
+        stats = model_registry.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    def test_evicts_least_recently_used_model(self, model_cls):
+        model_cls.side_effect = lambda **kwargs: mock.Mock()
+        model_registry.max_size = 2
+        self.addCleanup(setattr, model_registry, 'max_size', 32)
+
+        first = get_generative_model('a', CONSULTATION_SCHEMA)
+        get_generative_model('b', CONSULTATION_SCHEMA)
+        get_generative_model('c', CONSULTATION_SCHEMA)
+
+        self.assertEqual(model_registry.stats()['size'], 2)
+        self.assertIsNot(get_generative_model('a', CONSULTATION_SCHEMA), first)
+
+
+class RecommendationCacheTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        model_registry.clear()
+        recommendation_cache.clear()
+        resilience_policy.reset()
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    async def test_identical_payload_is_served_from_cache(self, model_cls):
+        from .views import _construire_donnees_gemini, _donnees_formulaire_consultation
+
+        model_cls.return_value.generate_content_async = mock.AsyncMock(return_value=fake_gemini_response())
+        payload = await _construire_donnees_gemini(self.patient, _donnees_formulaire_consultation(self.formulaire_consultation()))
+        retry = await _construire_donnees_gemini(self.patient, _donnees_formulaire_consultation(
+            self.formulaire_consultation(symptoms_text=' toux sèche depuis trois jours ')
+        ))
+
+        first = await analyser_consultation_async(payload, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA)
+        second = await analyser_consultation_async(retry, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA)
+
+        self.assertEqual(first, second)
+        model_cls.return_value.generate_content_async.assert_awaited_once()
+        self.assertEqual(recommendation_cache.stats()['hits'], 1)
+
+    def test_key_ignores_key_order_and_surrounding_whitespace(self):
+        cache = RecommendationCache()
+        key = cache.make_key({'a': ' x ', 'b': [1, 2]}, 'instruction')
+        self.assertEqual(key, cache.make_key({'b': [1, 2], 'a': 'x'}, 'instruction'))
+        self.assertNotEqual(key, cache.make_key({'a': 'x', 'b': [1, 2]}, 'autre instruction'))
+
+    def test_feedback_pattern_change_invalidates_entries(self):
+        cache = RecommendationCache()
+        key = cache.make_key({'a': 1}, 'instruction')
+        cache.set(key, RECOMMANDATIONS_TEST)
+        self.assertEqual(cache.get(key), RECOMMANDATIONS_TEST)
+
+        FeedbackPattern.objects.create(pattern_type='good_practice', description='Paracétamol en première intention')
+
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        now = [1000.0]
+        cache = RecommendationCache(ttl=60, timer=lambda: now[0])
+        key = cache.make_key({'a': 1}, 'instruction')
+        cache.set(key, RECOMMANDATIONS_TEST)
+
+        now[0] += 61
+
+        self.assertIsNone(cache.get(key))
+
+    def test_evicts_least_recently_used_entry(self):
+        cache = RecommendationCache(maxsize=2)
+        cache.set('a', {'n': 1})
+        cache.set('b', {'n': 2})
+        cache.get('a')
+        cache.set('c', {'n': 3})
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'n': 1})
+
+
+class IncrementalJSONObjectParserTests(TestCase):
+
+    def test_emits_members_as_soon_as_they_are_complete(self):
+        parser = IncrementalJSONObjectParser()
+
+        self.assertEqual(parser.feed('```json\n{"diagnostic_principal": "Angine, '), [])
+        self.assertEqual(parser.feed('virale", "prescriptions": [{"nom": "a}b"}'), [
+            ('diagnostic_principal', 'Angine, virale'),
+        ])
+        self.assertEqual(parser.feed('], "echappe": "guillemet \\" fin"}\n```'), [
+            ('prescriptions', [{'nom': 'a}b'}]),
+            ('echappe', 'guillemet " fin'),
+        ])
+        # Objet final sans les balises ```json autour
+        self.assertEqual(json.loads(parser.object_text), {
+            'diagnostic_principal': 'Angine, virale', 'prescriptions': [{'nom': 'a}b'}], 'echappe': 'guillemet " fin',
+        })
+
+    def test_every_chunking_yields_the_whole_object(self):
+        text = json.dumps(RECOMMANDATIONS_TEST, ensure_ascii=False)
+        for size in (1, 7, 64):
+            parser = IncrementalJSONObjectParser()
+            members = []
+            for start in range(0, len(text), size):
+                members.extend(parser.feed(text[start:start + size]))
+            self.assertEqual(dict(members), RECOMMANDATIONS_TEST)
+
+
+class SymptomeStreamViewTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        model_registry.clear()
+        recommendation_cache.clear()
+        resilience_policy.reset()
+        self.async_client.force_login(self.doctor)
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    async def test_streams_sections_then_saves_consultation(self, model_cls):
+        model_cls.return_value.generate_content_async = mock.AsyncMock(return_value=fake_gemini_stream())
+
+        response = await self.async_client.post(
+            f'/symptome/{self.patient.social_security_number}/stream/',
+            self.formulaire_consultation(),
+        )
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(
+            model_cls.return_value.generate_content_async.await_args.kwargs,
+            {'stream': True, 'request_options': {'timeout': settings.LLM_CALL_TIMEOUT}},
+        )
+        self.assertLess(body.index('"key": "diagnostic_principal"'), body.index('"key": "prescriptions_recommandees"'))
+        self.assertIn('event: done', body)
+        consultation = await Consultation.objects.aget(patient=self.patient)
+        self.assertEqual(consultation.gemini_recommendations, RECOMMANDATIONS_TEST)
+        self.assertIn(f'/consultation/{consultation.id}/resultats/', body)
+
+        resultats = await self.async_client.get(f'/consultation/{consultation.id}/resultats/')
+        self.assertContains(resultats, 'Rhinopharyngite')
+
+
+class AnalysisQueueTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        model_registry.clear()
+        recommendation_cache.clear()
+        resilience_policy.reset()
+        self.client.force_login(self.doctor)
+
+    def enqueue(self, max_attempts=3):
+        with self.settings(ANALYSIS_JOB_MAX_ATTEMPTS=max_attempts):
+            return enqueue_consultation_analysis(
+                {'patient': self.patient, 'hospital': self.hospital, 'doctor': self.doctor,
+                 'consultation_reason': 'Fièvre'},
+                {'consultation_actuelle': {'motif': 'Fièvre'}},
+            )
+
+    @override_settings(ANALYSIS_QUEUE_ENABLED=True)
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    def test_symptome_enqueues_and_redirects_without_calling_gemini(self, model_cls):
+        response = self.client.post(
+            f'/symptome/{self.patient.social_security_number}/',
+            self.formulaire_consultation(),
+        )
+
+        consultation = Consultation.objects.get(patient=self.patient)
+        self.assertRedirects(response, f'/consultation/{consultation.id}/resultats/', fetch_redirect_response=False)
+        self.assertEqual(consultation.analysis_status, 'en_attente')
+        self.assertEqual(consultation.analysis_job.status, 'en_attente')
+        model_cls.assert_not_called()
+        self.assertContains(self.client.get(response.url), 'Analyse IA en cours')
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    def test_worker_claims_and_stores_recommendations(self, model_cls):
+        model_cls.return_value.generate_content.return_value = fake_gemini_response()
+        consultation = self.enqueue()
+
+        job = claim_next_job('worker-1')
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('en_cours', 'worker-1', 1))
+        self.assertIsNone(claim_next_job('worker-2'))
+        self.assertTrue(process_job(job))
+
+        consultation.refresh_from_db()
+        self.assertEqual(consultation.analysis_status, 'terminee')
+        self.assertEqual(consultation.gemini_recommendations, RECOMMANDATIONS_TEST)
+        statut = self.client.get(f'/consultation/{consultation.id}/statut/').json()
+        self.assertEqual(statut['status'], 'terminee')
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    def test_failed_job_is_retried_then_marked_as_failed(self, model_cls):
+        model_cls.return_value.generate_content.side_effect = RuntimeError('quota')
+        consultation = self.enqueue(max_attempts=2)
+
+        self.assertFalse(process_job(claim_next_job('worker-1')))
+        job = ConsultationAnalysisJob.objects.get(consultation=consultation)
+        self.assertEqual(job.status, 'en_attente')
+        self.assertIsNone(claim_next_job('worker-1'))  # replanifié plus tard (backoff)
+
+        ConsultationAnalysisJob.objects.filter(id=job.id).update(run_after=job.created_at)
+        self.assertFalse(process_job(claim_next_job('worker-1')))
+
+        consultation.refresh_from_db()
+        self.assertEqual(consultation.analysis_status, 'echec')
+        self.assertIn('quota', consultation.analysis_job.last_error)
+
+    def test_stale_job_is_reclaimed(self):
+        self.enqueue()
+        claim_next_job('worker-1')
+
+        self.assertIsNone(claim_next_job('worker-2', stale_after=300))
+        job = claim_next_job('worker-2', stale_after=0)
+        self.assertEqual((job.locked_by, job.attempts), ('worker-2', 2))
+
+    def test_stale_job_at_max_attempts_is_failed_instead_of_reclaimed(self):
+        consultation = self.enqueue(max_attempts=1)
+        claim_next_job('worker-1')
+
+        self.assertIsNone(claim_next_job('worker-2', stale_after=0))
+        consultation.refresh_from_db()
+        self.assertEqual(consultation.analysis_status, 'echec')
+        self.assertEqual((consultation.analysis_job.status, consultation.analysis_job.attempts), ('echec', 1))
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    def test_late_worker_does_not_overwrite_reclaimed_job(self, model_cls):
+        model_cls.return_value.generate_content.return_value = fake_gemini_response()
+        consultation = self.enqueue()
+        job_perdu = claim_next_job('worker-1')
+        claim_next_job('worker-2', stale_after=0)
+
+        self.assertFalse(process_job(job_perdu))
+
+        consultation.refresh_from_db()
+        self.assertEqual(consultation.analysis_status, 'en_cours')
+        self.assertIsNone(consultation.gemini_recommendations)
+        self.assertEqual(
+            (consultation.analysis_job.status, consultation.analysis_job.locked_by), ('en_cours', 'worker-2')
+        )
+
+        recommendation_cache.clear()
+        model_cls.return_value.generate_content.side_effect = RuntimeError('quota')
+        self.assertFalse(process_job(job_perdu))
+        consultation.analysis_job.refresh_from_db()
+        self.assertEqual((consultation.analysis_job.status, consultation.analysis_job.last_error), ('en_cours', None))
+
+
+class FakeLLMBackendTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        recommendation_cache.clear()
+        resilience_policy.reset()
+        self.addCleanup(set_llm_backend, None)
+
+    def test_response_follows_schema_required_fields(self):
+        backend = FakeLLMBackend(latency='constant', latency_ms=0)
+        recommendations = json.loads(backend.generate('prompt', 'instruction', ORDONNANCE_SCHEMA))
+
+        for field in ORDONNANCE_SCHEMA['required']:
+            self.assertIn(field, recommendations)
+        self.assertIn(recommendations['urgence_niveau'], ['Faible', 'Modéré', 'Élevé', 'Urgent'])
+        medicament = recommendations['ordonnance_medicale']['medicaments'][0]
+        self.assertTrue({'nom_commercial', 'posologie', 'frequence', 'duree'} <= medicament.keys())
+
+    def test_seed_makes_latencies_and_errors_reproducible(self):
+        def tirages():
+            backend = FakeLLMBackend(latency='lognormal', error_rate=0.3, throttle_rate=0.1, seed=42)
+            return [(delay, type(error)) for delay, error in (backend._tirage() for _ in range(20))]
+
+        tirages = [tirages(), tirages()]
+        self.assertEqual(tirages[0], tirages[1])
+
+        with self.assertRaises(LLMBackendError):
+            FakeLLMBackend(latency='constant', latency_ms=0, error_rate=1.0).generate('prompt')
+
+    async def test_symptome_stream_runs_on_fake_backend(self):
+        set_llm_backend(FakeLLMBackend(latency='constant', latency_ms=0, chunk_size=16))
+        await self.async_client.aforce_login(self.doctor)
+
+        response = await self.async_client.post(
+            f'/symptome/{self.patient.social_security_number}/stream/',
+            self.formulaire_consultation(),
+        )
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+
+        self.assertIn('event: done', body)
+        consultation = await Consultation.objects.aget(patient=self.patient)
+        self.assertIn('ordonnance_medicale', consultation.gemini_recommendations)
+
+
+class PromptBuilderTests(TestCase):
+
+    def donnees(self, consultations=5):
+        return {
+            'patient': {
+                'nom_complet': 'Awa Kouassi',
+                'allergies': 'Aucune allergie connue',
+                'antecedents_medicaux': {'maladies': 'Asthme', 'chirurgies': 'Aucune chirurgie'},
+            },
+            'consultation_actuelle': {'motif_consultation': ' Fièvre ', 'examen_clinique': '',
+                                      'signes_vitaux': {'temperature': '38.5', 'poids': ''}},
+            'historique_consultations': [
+                {'date': f'2025-0{9 - index}-01', 'motif': f'Consultation {index} ' + 'toux persistante ' * 20}
+                for index in range(consultations)
+            ],
+        }
+
+    def test_compact_drops_empty_and_default_values(self):
+        data = compacter(self.donnees(consultations=0))
+        self.assertEqual(data, {
+            'patient': {'nom_complet': 'Awa Kouassi', 'antecedents_medicaux': {'maladies': 'Asthme'}},
+            'consultation_actuelle': {'motif_consultation': 'Fièvre', 'signes_vitaux': {'temperature': '38.5'}},
+        })
+
+    def test_budget_trims_oldest_history_first(self):
+        complet = construire_prompt_consultation(self.donnees(), token_budget=10000)
+        budget = estimate_tokens(complet) - 50
+        prompt = construire_prompt_consultation(self.donnees(), token_budget=budget)
+
+        self.assertLessEqual(estimate_tokens(prompt), budget)
+        self.assertIn('Consultation 0 ', prompt)
+        self.assertNotIn('Consultation 4 ', prompt)
+        self.assertLess(len(prompt), len(json.dumps(self.donnees(), indent=2, ensure_ascii=False)))
+
+    def test_system_budget_drops_lowest_confidence_patterns_first(self):
+        for description, confidence in [('fiable', 0.9), ('moyen', 0.6), ('fragile', 0.35)]:
+            FeedbackPattern.objects.create(
+                pattern_type='good_practice', description=f'Pratique {description}',
+                frequency=5, confidence_score=confidence,
+            )
+        complete = get_enhanced_system_instruction('Base.', token_budget=10000)
+        budget = estimate_tokens(complete) - 1
+
+        instruction = get_enhanced_system_instruction('Base.', token_budget=budget)
+
+        self.assertNotIn('Pratique fragile', instruction)
+        self.assertIn('Pratique moyen', instruction)
+        self.assertIn('Pratique fiable', instruction)
+        self.assertEqual(get_enhanced_system_instruction('Base.', token_budget=1), 'Base.')
+
+
+class PatternSnapshotTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        bump_patterns_version()  # pas d'instantané hérité d'un autre test
+        FeedbackPattern.objects.create(
+            pattern_type='dosage_preference', description='Amoxicilline 1g matin et soir', frequency=4,
+            confidence_score=0.6,
+        )
+        FeedbackPattern.objects.create(
+            pattern_type='good_practice', description='Toux pédiatrique: pas de codéine', frequency=3,
+            confidence_score=0.5,
+        )
+        self.consultation = Consultation.objects.create(
+            patient=self.patient, hospital=self.hospital, doctor=self.doctor, consultation_reason='Toux'
+        )
+        PrescriptionFeedback.objects.create(
+            consultation=self.consultation, doctor=self.doctor, feedback_type='validee_directement'
+        )
+
+    def test_prompt_enrichment_runs_no_queries_once_snapshot_is_built(self):
+        get_pattern_snapshot()
+
+        with self.assertNumQueries(0):
+            instruction = get_enhanced_system_instruction('Base.')
+            contextual = get_contextual_enhancements(symptoms='Toux grasse nocturne', patient_age=6)
+
+        self.assertIn('Amoxicilline 1g matin et soir', instruction)
+        self.assertIn('Taux de validation directe cette semaine: 100.0%', instruction)
+        self.assertIn('CONSIDÉRATIONS SPÉCIFIQUES ÂGE (6 ans)', contextual)
+        self.assertIn("PATTERNS POUR 'TOUX'", contextual)
+
+    def test_symptom_patterns_match_whole_text_without_accents(self):
+        FeedbackPattern.objects.create(
+            pattern_type='diagnostic_error', description='Céphalées avec fièvre: penser à la méningite',
+            frequency=2, confidence_score=0.4,
+        )
+        FeedbackPattern.objects.create(
+            pattern_type='good_practice', description='Fièvre isolée: paracétamol en première intention',
+            frequency=5, confidence_score=0.8,
+        )
+
+        contextual = get_contextual_enhancements(symptoms='Depuis trois jours, le patient a des cephalees et de la FIEVRE')
+
+        self.assertIn("PATTERNS POUR 'CEPHALEE, FIEVRE'", contextual)
+        # Deux mots-clés communs: classé avant le pattern plus fréquent qui n'en partage qu'un
+        self.assertLess(contextual.index('méningite'), contextual.index('paracétamol'))
+        self.assertNotIn('Amoxicilline', contextual)
+
+    def test_pattern_change_in_another_process_invalidates_snapshot_and_caches(self):
+        snapshot = get_pattern_snapshot()
+        cache = RecommendationCache()
+        cache.set('cle', RECOMMANDATIONS_TEST)
+        # Écriture d'un autre processus: pas de signal ici, seule la version partagée change
+        FeedbackPattern.objects.filter(description__startswith='Amoxicilline').update(description='Amoxicilline 500mg')
+        PromptPatternsVersion.objects.filter(pk=1).update(version=F('version') + 1)
+
+        with self.assertNumQueries(0):  # relecture limitée à PROMPT_PATTERNS_VERSION_CHECK_INTERVAL
+            self.assertIs(get_pattern_snapshot(), snapshot)
+
+        with override_settings(PROMPT_PATTERNS_VERSION_CHECK_INTERVAL=0):
+            rebuilt = get_pattern_snapshot()
+        self.assertIsNot(rebuilt, snapshot)
+        self.assertIn('Amoxicilline 500mg', [p.description for p in rebuilt.patterns])
+        self.assertIsNone(cache.get('cle'))
+
+    def test_matcher_is_reused_when_patterns_are_unchanged(self):
+        snapshot = get_pattern_snapshot()
+        bump_patterns_version()
+
+        rebuilt = get_pattern_snapshot()
+        self.assertIsNot(rebuilt, snapshot)
+        self.assertIs(rebuilt.matcher, snapshot.matcher)
+
+    def test_matcher_finds_whole_normalized_tokens(self):
+        toux = PatternEntry(1, 'good_practice', 'Toux grasse', 'toux grasse', 1, 0.5, 'faible')
+        touxeur = PatternEntry(2, 'good_practice', 'Touxeur', 'touxeur', 1, 0.5, 'faible')
+        matcher = PatternMatcher([toux, touxeur])
+
+        self.assertEqual(matcher.match('TOUX sèche, crachats gras'), [(toux, ['toux'])])
+        self.assertEqual(matcher.match('Toux grasses'), [(toux, ['grasse', 'toux'])])
+        self.assertEqual(matcher.match('Depuis trois jours'), [])
+
+    @override_settings(LLM_TELEMETRY_ENABLED=True)
+    def test_pattern_usage_is_buffered_then_shown_in_admin(self):
+        buffer = TelemetryBuffer(background=False, model_label='app.PatternUsage')
+        patcher = mock.patch('app.prompt_enhancement.pattern_usage_buffer', buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        toux = FeedbackPattern.objects.get(pattern_type='good_practice')
+        amoxicilline = FeedbackPattern.objects.get(pattern_type='dosage_preference')
+
+        usage = []
+        get_enhanced_system_instruction('Base.', usage=usage)
+        get_enhanced_system_instruction('Base.', usage=usage)  # instruction mémorisée: même utilisation
+        get_contextual_enhancements(symptoms='Toux grasse', patient_age=6, usage=usage)
+        self.assertEqual(
+            [(pattern_id, section) for pattern_id, section, _ in usage],
+            [(toux.pk, 'bonnes_pratiques'), (amoxicilline.pk, 'dosages'),
+             (toux.pk, 'bonnes_pratiques'), (amoxicilline.pk, 'dosages'),
+             (toux.pk, 'age'), (toux.pk, 'symptomes')],
+        )
+        self.assertTrue(all(tokens > 0 for _, _, tokens in usage))
+
+        log_prompt_enhancement_usage(usage[2:], self.consultation.id, endpoint='traiter_consultation')
+        self.assertEqual((buffer.pending(), PatternUsage.objects.count()), (4, 0))
+        buffer.flush()
+
+        admin_user = User.objects.create_superuser(username='admin_test', password='secret-pass-123')
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/app/feedbackpattern/')
+        self.assertEqual(response.status_code, 200)
+        rows = {pattern.pk: pattern for pattern in response.context['cl'].result_list}
+        self.assertEqual((rows[toux.pk].usage_total, rows[toux.pk].usage_validated), (3, 3))
+        self.assertContains(response, '100% (3 feedbacks)')
+
+        # Compteurs réservés à la liste: ni les pages de modification ni les actions ne les calculent
+        self.assertEqual(admin.site._registry[FeedbackPattern].get_queryset(response.wsgi_request).query.annotations, {})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/admin/app/feedbackpattern/', {
+                'action': 'deactivate_patterns', '_selected_action': [toux.pk],
+            })
+        self.assertFalse(any('app_patternusage' in query['sql'] for query in queries.captured_queries))
+        self.assertFalse(FeedbackPattern.objects.get(pk=toux.pk).is_active)
+
+    def test_pattern_change_rebuilds_snapshot(self):
+        snapshot = get_pattern_snapshot()
+        self.assertIs(get_pattern_snapshot(), snapshot)
+
+        FeedbackPattern.objects.filter(pattern_type='dosage_preference').get().delete()
+
+        self.assertIsNot(get_pattern_snapshot(), snapshot)
+        self.assertNotIn('Amoxicilline', get_enhanced_system_instruction('Base.'))
+
+
+class RefreshPromptPatternsTests(TestCase):
+
+    def test_scores_are_recomputed_in_bulk_without_touching_last_occurrence(self):
+        now = timezone.now()
+        for i, (frequency, days) in enumerate([(5, 0), (10, 15), (3, 45), (10, 0)]):
+            pattern = FeedbackPattern.objects.create(
+                pattern_type='good_practice', description=f'Pattern {i}', frequency=frequency,
+                confidence_score=0.5 if i == 0 else 0,
+            )
+            FeedbackPattern.objects.filter(pk=pattern.pk).update(last_occurrence=now - timedelta(days=days))
+        version = get_patterns_version()
+
+        # savepoint, désactivation, lecture, bulk_update, fin du savepoint, puis incrément et relecture de la version partagée
+        with self.assertNumQueries(7):
+            result = refresh_prompt_patterns()
+
+        self.assertEqual(result['deactivated_patterns'], 1)
+        self.assertEqual(result['active_patterns'], 3)
+        self.assertEqual(result['updated_patterns'], 2)  # 'Pattern 0' a déjà le bon score
+        self.assertEqual(get_patterns_version(), version + 1)
+        scores = dict(FeedbackPattern.objects.values_list('description', 'confidence_score'))
+        self.assertEqual(scores, {
+            'Pattern 0': Decimal('0.50'), 'Pattern 1': Decimal('0.50'),
+            'Pattern 2': Decimal('0.00'), 'Pattern 3': Decimal('1.00'),
+        })
+        self.assertFalse(FeedbackPattern.objects.get(description='Pattern 2').is_active)
+        self.assertLess(FeedbackPattern.objects.get(description='Pattern 1').last_occurrence, now - timedelta(days=14))
+
+
+class PatternSearchTests(TestCase):
+
+    def setUp(self):
+        self.pediatrique = FeedbackPattern.objects.create(
+            pattern_type='good_practice', description='Toux pédiatrique: pas de codéine', frequency=3,
+        )
+        FeedbackPattern.objects.create(
+            pattern_type='dosage_preference', description='Amoxicilline 1g matin et soir', frequency=4,
+        )
+
+    def test_search_uses_full_text_index_without_accents(self):
+        self.assertEqual(list(search_patterns('pediatrique')), [self.pediatrique])
+        self.assertEqual(list(search_patterns('toux codéine')), [self.pediatrique])
+        self.assertEqual(list(search_patterns('toux amoxicilline')), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.pediatrique.description = 'Toux gériatrique: pas de codéine'
+        self.pediatrique.save()
+        self.assertEqual(list(search_patterns('pédiatrique')), [])
+        self.assertEqual(list(search_patterns('geriatrique')), [self.pediatrique])
+
+        self.pediatrique.is_active = False
+        self.pediatrique.save()
+        self.assertEqual(list(search_patterns('geriatrique')), [])
+        self.assertEqual(list(search_patterns('geriatrique', active_only=False)), [self.pediatrique])
+
+        self.pediatrique.delete()
+        self.assertEqual(list(search_patterns('geriatrique', active_only=False)), [])
+
+
+class LLMLimiterTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        recommendation_cache.clear()
+        resilience_policy.reset()
+        self.addCleanup(set_llm_backend, None)
+
+    async def test_identical_concurrent_submissions_share_one_call(self):
+        backend = FakeLLMBackend(latency='constant', latency_ms=50)
+        set_llm_backend(backend)
+        coalesced = llm_limiter.single_flight.coalesced
+        payload = {'consultation_actuelle': {'motif_consultation': 'Fièvre'}}
+
+        first, second = await asyncio.gather(
+            analyser_consultation_async(payload, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA),
+            analyser_consultation_async(payload, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA),
+        )
+
+        self.assertEqual(first, second)
+        self.assertEqual(backend.stats()['calls'], 1)
+        self.assertEqual(llm_limiter.single_flight.coalesced, coalesced + 1)
+
+    async def test_cancelled_leader_does_not_cancel_followers(self):
+        flight = SingleFlight()
+        appels = []
+
+        async def appel():
+            appels.append(1)
+            await asyncio.sleep(0.05)
+            return {'motif': 'Fièvre'}
+
+        leader = asyncio.ensure_future(flight.ado('cle', appel))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.ado('cle', appel))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        self.assertEqual(await follower, {'motif': 'Fièvre'})
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        self.assertEqual((len(appels), flight.coalesced), (1, 1))
+
+    def test_concurrency_halves_on_throttling_and_grows_back(self):
+        limiter = AIMDConcurrencyLimiter(max_limit=8)
+        self.assertTrue(limiter.acquire(timeout=0))
+        limiter.release(throttled=True)
+        self.assertEqual(int(limiter.limit), 4)
+
+        # +1/limit par succès: environ +1 après une fenêtre de `limit` succès
+        for _ in range(5):
+            self.assertTrue(limiter.acquire(timeout=0))
+            limiter.release()
+        self.assertEqual(int(limiter.limit), 5)
+
+    def test_throttled_call_drains_the_shared_bucket(self):
+        limiter = LLMCallLimiter(rate_per_minute=60, burst=2)
+
+        with self.assertRaises(LLMThrottledError):
+            with limiter.slot():
+                raise LLMThrottledError('429')
+
+        self.assertGreater(DatabaseTokenBucket(rate_per_minute=60, burst=2).take(), 0)
+        self.assertEqual(limiter.stats()['throttled'], 1)
+
+
+class ScriptedBackend(FakeLLMBackend):
+    """Backend de test: chaque appel suit le scénario suivant (délai en s, erreur éventuelle)"""
+
+    def __init__(self, *scenario):
+        super().__init__(latency='constant', latency_ms=0)
+        self.scenario = list(scenario)
+
+    async def agenerate(self, prompt, system_instruction=None, response_schema=None):
+        delay, error = self.scenario.pop(0) if self.scenario else (0, None)
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return json.dumps(RECOMMANDATIONS_TEST, ensure_ascii=False)
+
+
+class LLMResilienceTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        recommendation_cache.clear()
+        resilience_policy.reset()
+        self.addCleanup(set_llm_backend, None)
+        self.addCleanup(resilience_policy.reset)
+
+    async def test_transient_error_is_retried(self):
+        policy = ResiliencePolicy(backoff_base=0.01)
+        backend = ResilientBackend(ScriptedBackend((0, LLMThrottledError('429')), (0, None)), policy)
+
+        text = await backend.agenerate('prompt')
+
+        self.assertEqual(json.loads(text), RECOMMANDATIONS_TEST)
+        self.assertEqual(policy.stats()['retries'], 1)
+
+    async def test_invalid_request_is_not_retried_and_leaves_breaker_alone(self):
+        from google.api_core.exceptions import InvalidArgument
+
+        policy = ResiliencePolicy(backoff_base=0.01, breaker_failures=1)
+        scripted = ScriptedBackend((0, InvalidArgument('400 schéma invalide')), (0, None))
+        backend = ResilientBackend(scripted, policy)
+
+        with self.assertRaises(InvalidArgument):
+            await backend.agenerate('prompt')
+
+        self.assertEqual(scripted.calls, 1)
+        stats = policy.stats()
+        self.assertEqual((stats['retries'], stats['failures']), (0, 1))
+        self.assertEqual((stats['breaker_state'], stats['breaker_consecutive_failures']), ('ferme', 0))
+
+    async def test_slow_attempt_times_out(self):
+        policy = ResiliencePolicy(call_timeout=0.05, max_retries=0)
+        backend = ResilientBackend(ScriptedBackend((1, None)), policy)
+
+        with self.assertRaises(LLMTimeoutError):
+            await backend.agenerate('prompt')
+        self.assertEqual(policy.stats()['timeouts'], 1)
+
+    async def test_hedged_request_wins_over_slow_first_attempt(self):
+        policy = ResiliencePolicy(hedge_min_samples=1)
+        policy.latencies.record(0.02)  # p95 récent: 20 ms
+        scripted = ScriptedBackend((1, None), (0, None))
+        backend = ResilientBackend(scripted, policy)
+
+        await asyncio.wait_for(backend.agenerate('prompt'), timeout=0.5)
+
+        self.assertEqual(scripted.calls, 2)
+        self.assertEqual((policy.stats()['hedges'], policy.stats()['hedge_wins']), (1, 1))
+
+    async def test_each_retry_takes_a_limiter_slot(self):
+        policy = ResiliencePolicy(backoff_base=0.01)
+        limiter = LLMCallLimiter(max_concurrency=1, rate_per_minute=60, burst=5)
+        backend = ResilientBackend(ScriptedBackend((0, LLMThrottledError('429')), (0, None)), policy, limiter)
+
+        await backend.agenerate('prompt')
+
+        # Deux requêtes envoyées: deux jetons du seau, le 429 vu par la limite de concurrence
+        self.assertEqual(limiter.stats()['throttled'], 1)
+        self.assertEqual((limiter.stats()['in_flight'], int(limiter.concurrency.limit)), (0, 1))
+        self.assertEqual(policy.stats()['retries'], 1)
+        bucket = await LLMRateLimitBucket.objects.aget(name='llm')
+        self.assertLess(bucket.tokens, 5 - 1)
+
+    async def test_hedge_needs_a_free_limiter_slot(self):
+        for max_concurrency, hedges in ((1, 0), (2, 1)):
+            policy = ResiliencePolicy(hedge_min_samples=1)
+            policy.latencies.record(0.02)
+            scripted = ScriptedBackend((0.1, None), (0, None))
+            limiter = LLMCallLimiter(max_concurrency=max_concurrency)
+            backend = ResilientBackend(scripted, policy, limiter)
+
+            await asyncio.wait_for(backend.agenerate('prompt'), timeout=0.5)
+
+            self.assertEqual((scripted.calls, policy.stats()['hedges']), (1 + hedges, hedges))
+            self.assertEqual(limiter.stats()['in_flight'], 0)
+
+    async def test_cancelled_half_open_trial_does_not_keep_breaker_stuck(self):
+        policy = ResiliencePolicy(max_retries=0, breaker_failures=1, breaker_recovery=0)
+        policy.breaker.record_failure()
+        backend = ResilientBackend(ScriptedBackend((1, None), (0, None)), policy)
+
+        trial = asyncio.ensure_future(backend.agenerate('prompt'))
+        await asyncio.sleep(0.01)
+        self.assertEqual(policy.stats()['breaker_state'], 'semi_ouvert')
+        trial.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await trial
+
+        # Un nouvel appel sert d'essai et referme le disjoncteur
+        await backend.agenerate('prompt')
+        self.assertEqual(policy.stats()['breaker_state'], 'ferme')
+
+    async def test_closed_half_open_stream_releases_the_trial(self):
+        policy = ResiliencePolicy(max_retries=0, breaker_failures=1, breaker_recovery=0)
+        policy.breaker.record_failure()
+        backend = ResilientBackend(ScriptedBackend(), policy)
+
+        stream = backend.astream('prompt')
+        await stream.__anext__()
+        await stream.aclose()
+
+        self.assertEqual(policy.stats()['breaker_state'], 'semi_ouvert')
+        await backend.agenerate('prompt')
+        self.assertEqual(policy.stats()['breaker_state'], 'ferme')
+
+    async def test_open_breaker_saves_consultation_without_ai(self):
+        policy = ResiliencePolicy(max_retries=0, breaker_failures=1, breaker_recovery=60)
+        scripted = ScriptedBackend((0, LLMServerError('503')))
+        set_llm_backend(ResilientBackend(scripted, policy))
+        with self.assertRaises(LLMBackendError):
+            await get_llm_backend().agenerate('prompt')
+        self.assertEqual(policy.stats()['breaker_state'], 'ouvert')
+        with self.assertRaises(LLMUnavailableError):
+            await get_llm_backend().agenerate('prompt')
+
+        await self.async_client.aforce_login(self.doctor)
+        response = await self.async_client.post(
+            f'/symptome/{self.patient.social_security_number}/', self.formulaire_consultation(),
+        )
+
+        consultation = await Consultation.objects.aget(patient=self.patient)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(consultation.analysis_status, 'echec')
+        self.assertEqual(scripted.calls, 1)  # échec immédiat, sans appel au backend
+        resultats = await self.async_client.get(response.url)
+        self.assertContains(resultats, 'Service IA indisponible')
+
+
+class LLMTelemetryTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        recommendation_cache.clear()
+        resilience_policy.reset()
+        self.addCleanup(set_llm_backend, None)
+        self.buffer = TelemetryBuffer(batch_size=2, background=False)
+        patcher = mock.patch('app.llm_telemetry.telemetry_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(LLM_TELEMETRY_ENABLED=True)
+    def test_calls_are_buffered_and_written_in_batches(self):
+        set_llm_backend(FakeLLMBackend(latency='constant', latency_ms=10))
+        payload = {'consultation_actuelle': {'motif_consultation': 'Fièvre'}}
+        telemetry = {'endpoint': 'symptome', 'doctor_id': self.doctor.id, 'hospital_id': self.hospital.id}
+
+        analyser_consultation(payload, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA, telemetry=telemetry)
+        self.assertEqual((self.buffer.pending(), LLMCallLog.objects.count()), (1, 0))
+
+        # Deuxième appel servi par le cache: le lot est complet et écrit en une fois
+        analyser_consultation(payload, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA, telemetry=telemetry)
+        self.assertEqual(self.buffer.pending(), 0)
+
+        cache, appel = list(LLMCallLog.objects.order_by('outcome'))
+        self.assertEqual((cache.outcome, appel.outcome), ('cache', 'succes'))
+        self.assertEqual((appel.doctor_id, appel.hospital_id, appel.backend), (self.doctor.id, self.hospital.id, 'fake'))
+        self.assertGreater(appel.prompt_tokens, estimate_tokens(ORDONNANCE_SYSTEM_INSTRUCTION))
+        self.assertGreater(appel.response_tokens, 0)
+        self.assertGreater(appel.cost, 0)
+        self.assertGreaterEqual(appel.latency_ms, 10)
+        self.assertEqual((cache.prompt_tokens, cache.cost), (0, 0))
+
+    # Lectures de la page sur la base principale: un réplica ne voit pas la transaction du test
+    @override_settings(DATABASE_REPLICA_ALIAS='absent')
+    def test_admin_page_shows_latency_percentiles(self):
+        for latency in range(100, 1100, 100):
+            LLMCallLog.objects.create(
+                endpoint='symptome', backend='fake', model_name='fake', prompt_version='abc',
+                doctor=self.doctor, hospital=self.hospital, latency_ms=latency, outcome='succes',
+                prompt_tokens=1000, response_tokens=200,
+            )
+        admin_user = User.objects.create_superuser(username='admin_test', password='secret-pass-123')
+        self.client.force_login(admin_user)
+
+        response = self.client.get('/admin/app/iaperformancemetrics/telemetrie/?jours=1')
+
+        self.assertEqual(response.status_code, 200)
+        total = response.context['total'][0]
+        self.assertEqual((total['calls'], total['p50'], total['p95']), (10, 550, 955))
+        self.assertEqual(response.context['par_medecin'][0]['key'], 'dr_test')
+        self.assertEqual(response.context['par_hopital'][0]['prompt_tokens'], 10000)
+
+
+    def test_summary_is_aggregated_in_database(self):
+        latences = list(range(150, 30000, 97))
+        LLMCallLog.objects.bulk_create([
+            LLMCallLog(endpoint='symptome', backend='fake', model_name='fake', prompt_version='abc',
+                       doctor=self.doctor, latency_ms=latency, outcome='erreur' if latency < 1000 else 'succes')
+            for latency in latences
+        ] + [LLMCallLog(endpoint='symptome', backend='fake', model_name='fake', prompt_version='abc',
+                        latency_ms=0, outcome='cache')])
+
+        with self.assertNumQueries(1 if connection.vendor == 'postgresql' else 2):
+            ligne, = telemetry_summary(LLMCallLog.objects.all())
+
+        self.assertEqual((ligne['calls'], ligne['cached'], ligne['errors']), (len(latences) + 1, 1, 9))
+        # Percentiles exacts sous PostgreSQL, à une tranche d'histogramme près ailleurs (250 ms au-delà de 10 s)
+        for p in (50, 95, 99):
+            self.assertAlmostEqual(ligne[f'p{p}'], percentile(latences, p), delta=250)
+
+
+class ContextCacheTests(TestCase):
+
+    def setUp(self):
+        model_registry.clear()
+        self.now = 0
+        self.client_api = LocalContextCacheClient()
+        self.context_cache = ContextCacheManager(
+            self.client_api, ttl=600, min_tokens=5, refresh_margin=60, clock=lambda: self.now
+        )
+
+    def test_instruction_cached_once_then_recreated_on_expiry_and_pattern_refresh(self):
+        first = self.context_cache.get('gemini-test', CONSULTATION_SYSTEM_INSTRUCTION)
+        self.assertIs(self.context_cache.get('gemini-test', CONSULTATION_SYSTEM_INSTRUCTION), first)
+        self.assertEqual(self.client_api.created, 1)
+
+        self.now = 545  # dans la marge de rafraîchissement avant expiration
+        second = self.context_cache.get('gemini-test', CONSULTATION_SYSTEM_INSTRUCTION)
+        self.assertIsNot(second, first)
+        self.assertNotIn(first.name, self.client_api.contents)
+
+        bump_patterns_version()
+        third = self.context_cache.get('gemini-test', CONSULTATION_SYSTEM_INSTRUCTION)
+        self.assertEqual((self.client_api.created, self.client_api.deleted), (3, 2))
+        self.assertEqual(list(self.client_api.contents), [third.name])
+        stats = self.context_cache.stats()
+        self.assertEqual((stats['reused'], stats['expired'], stats['invalidations']), (1, 1, 1))
+
+    def test_short_instruction_is_sent_without_cache(self):
+        self.assertIsNone(self.context_cache.get('gemini-test', 'Court.'))
+        self.assertIsNone(self.context_cache.get('gemini-test', 'Court.'))
+        self.assertEqual(self.client_api.created, 0)
+
+    def test_failed_creation_is_retried_after_backoff(self):
+        creer = self.client_api.create
+        erreurs = [ConnectionError('503 indisponible')]
+        appels = []
+
+        def create(*args):
+            appels.append(args)
+            if erreurs:
+                raise erreurs.pop()
+            return creer(*args)
+
+        self.client_api.create = create
+        self.assertIsNone(self.context_cache.get('gemini-test', CONSULTATION_SYSTEM_INSTRUCTION))
+        self.assertIsNone(self.context_cache.get('gemini-test', CONSULTATION_SYSTEM_INSTRUCTION))
+        self.assertEqual(len(appels), 1)  # pas de nouvel appel pendant le backoff
+
+        self.now = 30
+        self.assertIsNotNone(self.context_cache.get('gemini-test', CONSULTATION_SYSTEM_INSTRUCTION))
+        self.assertEqual((len(appels), self.context_cache.stats()['failures']), (2, 1))
+
+    def test_creation_is_single_flight_and_does_not_block_other_instructions(self):
+        creer = self.client_api.create
+        en_creation, reponse_api = threading.Event(), threading.Event()
+        appels = []
+
+        def create_lent(model_name, system_instruction, ttl):
+            appels.append(system_instruction)
+            if system_instruction == CONSULTATION_SYSTEM_INSTRUCTION:
+                en_creation.set()
+                reponse_api.wait(5)
+            return creer(model_name, system_instruction, ttl)
+
+        self.client_api.create = create_lent
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            lents = [
+                pool.submit(self.context_cache.get, 'gemini-test', CONSULTATION_SYSTEM_INSTRUCTION)
+                for _ in range(3)
+            ]
+            self.assertTrue(en_creation.wait(5))
+            # Création en cours pour une instruction: les autres restent servies
+            autre = pool.submit(self.context_cache.get, 'gemini-test', ORDONNANCE_SYSTEM_INSTRUCTION)
+            self.assertIsNotNone(autre.result(timeout=2))
+            self.assertEqual(self.context_cache.stats()['entries'], 1)
+            reponse_api.set()
+            handles = {future.result(timeout=5).name for future in lents}
+
+        self.assertEqual(len(handles), 1)
+        self.assertEqual(appels.count(CONSULTATION_SYSTEM_INSTRUCTION), 1)
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    async def test_gemini_backend_references_cached_instruction(self, model_cls):
+        cached_model = model_cls.from_cached_content.return_value
+        cached_model.generate_content_async = mock.AsyncMock(return_value=fake_gemini_response())
+        backend = GeminiBackend(model_name='gemini-test', context_cache=self.context_cache)
+
+        for _ in range(2):
+            text = await backend.agenerate('prompt', CONSULTATION_SYSTEM_INSTRUCTION, CONSULTATION_SCHEMA)
+
+        self.assertEqual(json.loads(text), RECOMMANDATIONS_TEST)
+        model_cls.from_cached_content.assert_called_once()
+        handle = model_cls.from_cached_content.call_args.kwargs['cached_content']
+        self.assertEqual(handle.system_instruction, CONSULTATION_SYSTEM_INSTRUCTION)
+        self.assertEqual(cached_model.generate_content_async.await_count, 2)
+        model_cls.assert_not_called()  # instruction jamais renvoyée en entier
+
+    @mock.patch('app.gemini_models.genai.GenerativeModel')
+    async def test_lost_cached_content_falls_back_to_full_instruction(self, model_cls):
+        from google.api_core.exceptions import NotFound
+
+        model_cls.from_cached_content.return_value.generate_content_async = mock.AsyncMock(
+            side_effect=NotFound('cached content expiré')
+        )
+        model_cls.return_value.generate_content_async = mock.AsyncMock(return_value=fake_gemini_response())
+        backend = GeminiBackend(model_name='gemini-test', context_cache=self.context_cache)
+
+        text = await backend.agenerate('prompt', CONSULTATION_SYSTEM_INSTRUCTION, CONSULTATION_SCHEMA)
+
+        self.assertEqual(json.loads(text), RECOMMANDATIONS_TEST)
+        self.assertEqual(model_cls.call_args.kwargs['system_instruction'], CONSULTATION_SYSTEM_INSTRUCTION)
+        self.assertEqual(self.context_cache.stats()['entries'], 0)
+
+
+class SpeculativeAnalysisTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        recommendation_cache.clear()
+        resilience_policy.reset()
+        self.backend = FakeLLMBackend(latency='constant', latency_ms=200)
+        set_llm_backend(self.backend)
+        self.addCleanup(set_llm_backend, None)
+        self.addCleanup(self.attendre_pre_analyses)
+        self.client.force_login(self.doctor)
+        self.url = f'/symptome/{self.patient.social_security_number}/'
+
+    def brouillon(self, **extra):
+        formulaire = self.formulaire_consultation(symptoms_text='toux sèche et fièvre depuis trois jours', **extra)
+        return self.client.post(self.url + 'brouillon/', formulaire).json()['statut'], formulaire
+
+    def attendre_pre_analyses(self):
+        for future in list(speculative_analyzer._futures.values()):
+            future.exception()
+
+    def test_final_submit_reuses_running_pre_analysis(self):
+        statut, formulaire = self.brouillon()
+        self.assertEqual(statut, 'lance')
+        self.assertEqual(self.brouillon()[0], 'en_cours')
+
+        response = self.client.post(self.url, formulaire)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.backend.stats()['calls'], 1)
+        consultation = Consultation.objects.get(patient=self.patient)
+        self.assertEqual(consultation.initial_diagnosis, 'diagnostic principal (simulé)')
+
+    def test_changed_form_gets_a_fresh_call(self):
+        statut, formulaire = self.brouillon()
+        self.assertEqual(statut, 'lance')
+        self.attendre_pre_analyses()
+
+        formulaire['clinical_exam'] = 'Gorge rouge'
+        self.client.post(self.url, formulaire)
+
+        self.assertEqual(self.backend.stats()['calls'], 2)
+
+    @override_settings(SPECULATIVE_ANALYSIS_BURST=1)
+    def test_pre_analyses_are_capped_per_doctor(self):
+        self.assertEqual(self.brouillon()[0], 'lance')
+        self.assertEqual(self.brouillon(clinical_exam='Gorge rouge')[0], 'occupe')
+        self.attendre_pre_analyses()
+
+        self.assertEqual(self.brouillon()[0], 'pret')
+        self.assertEqual(self.brouillon(clinical_exam='Gorge rouge')[0], 'plafond')
+        self.assertEqual(self.backend.stats()['calls'], 1)
+
+    def test_incomplete_form_is_not_analyzed(self):
+        response = self.client.post(self.url + 'brouillon/', {'consultation_reason': 'Fièvre', 'symptoms_text': 'toux'})
+        self.assertEqual(response.json()['statut'], 'incomplet')
+        self.assertEqual(self.backend.stats()['calls'], 0)
+
+
+class ReanalyzeConsultationsCommandTests(TransactionTestCase):
+
+    def setUp(self):
+        resilience_policy.reset()
+        self.addCleanup(set_llm_backend, None)
+        hospital = Hospital.objects.create(name='CHU Test', city='Abidjan', country='CI')
+        autre_hospital = Hospital.objects.create(name='Clinique', city='Bouaké', country='CI')
+        patient = Patient.objects.create(social_security_number='987654321', last_name='Traoré', first_name='Ali', gender='M')
+        self.originales = [
+            Consultation.objects.create(
+                patient=patient, hospital=hospital, consultation_reason=f'Motif {index}',
+                initial_diagnosis='Diagnostic initial', gemini_recommendations={'diagnostic_principal': 'Initial'},
+                is_validated=index % 2 == 0,
+            )
+            for index in range(4)
+        ]
+        Consultation.objects.create(patient=patient, hospital=autre_hospital, consultation_reason='Autre hôpital')
+        self.hospital = hospital
+
+    def reanalyze(self, **options):
+        call_command('reanalyze_consultations', run='test', hospital=self.hospital.id,
+                     workers=2, rate=6000, stdout=StringIO(), **options)
+
+    def test_results_are_stored_next_to_originals(self):
+        set_llm_backend(FakeLLMBackend(latency='constant', latency_ms=0))
+
+        self.reanalyze(validation='validees')
+
+        run = ReanalysisRun.objects.get(name='test')
+        self.assertEqual((run.processed, run.failed), (2, 0))
+        self.assertIsNotNone(run.completed_at)
+        for consultation in self.originales:
+            consultation.refresh_from_db()
+            self.assertEqual(consultation.gemini_recommendations, {'diagnostic_principal': 'Initial'})
+        self.assertEqual(
+            set(ConsultationReanalysis.objects.values_list('consultation_id', flat=True)),
+            {self.originales[0].id, self.originales[2].id},
+        )
+
+    def test_resume_retries_failures_only(self):
+        set_llm_backend(FakeLLMBackend(latency='constant', latency_ms=0, error_rate=1.0))
+        self.reanalyze(limit=1)
+        self.assertEqual(ReanalysisRun.objects.get(name='test').failed, 1)
+
+        backend = FakeLLMBackend(latency='constant', latency_ms=0)
+        set_llm_backend(backend)
+        resilience_policy.reset()
+        self.reanalyze()
+
+        run = ReanalysisRun.objects.get(name='test')
+        self.assertEqual((run.processed, run.failed), (4, 0))
+        self.assertEqual(backend.stats()['calls'], 4)
+
+        self.reanalyze()
+        self.assertEqual(backend.stats()['calls'], 4)
+
+
+class BenchmarkPromptVariantsCommandTests(ConsultationTestMixin, TestCase):
+
+    def setUp(self):
+        angine = Consultation.objects.create(
+            patient=self.patient, hospital=self.hospital, consultation_reason='Mal de gorge',
+            gemini_recommendations={
+                'diagnostic_principal': 'Angine bactérienne',
+                'prescriptions_recommandees': [{'nom_medicament': 'Amoxicilline 1g'}],
+            },
+        )
+        PrescriptionFeedback.objects.create(consultation=angine, doctor=self.doctor, feedback_type='validee_directement')
+        # Prescription modifiée par le médecin: la référence vient des données d'apprentissage
+        grippe = Consultation.objects.create(
+            patient=self.patient, hospital=self.hospital, consultation_reason='Fièvre',
+            gemini_recommendations={
+                'diagnostic_principal': 'Grippe',
+                'prescriptions_recommandees': [{'nom_medicament': 'Ibuprofène 400mg'}],
+            },
+        )
+        feedback = PrescriptionFeedback.objects.create(consultation=grippe, doctor=self.doctor, feedback_type='modifiee')
+        AILearningData.objects.create(
+            age_patient=30, sexe_patient='F', symptomes_principaux='Fièvre', antecedents_medicaux='',
+            signes_vitaux={}, prescription_ia_originale=grippe.gemini_recommendations, diagnostic_ia_original='Grippe',
+            prescription_finale_medecin={'prescriptions_recommandees': [{'nom_medicament': 'Paracétamol 1g'}]},
+            diagnostic_final_medecin='Grippe', efficacite_traitement='efficace',
+            score_pertinence_diagnostic=8, score_pertinence_prescription=4, feedback_source=feedback,
+        )
+        # Rejetée sans prescription finale connue: pas rejouée
+        rejetee = Consultation.objects.create(patient=self.patient, hospital=self.hospital, consultation_reason='Toux')
+        PrescriptionFeedback.objects.create(consultation=rejetee, doctor=self.doctor, feedback_type='annulee')
+
+    def test_recorded_responses_are_scored_against_doctor_decisions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output, html = os.path.join(tmp, 'rapport.json'), os.path.join(tmp, 'rapport.html')
+            call_command('benchmark_prompt_variants', backend='recorded', output=output, html=html, stdout=StringIO())
+
+            with open(output, encoding='utf-8') as f:
+                rapport = json.load(f)
+            with open(html, encoding='utf-8') as f:
+                self.assertIn('sans_patterns', f.read())
+
+        self.assertEqual(rapport['consultations'], 2)
+        self.assertEqual([v['nom'] for v in rapport['variantes']], ['actuelle', 'sans_patterns', 'budget_reduit'])
+        for variante in rapport['variantes']:
+            self.assertEqual((variante['appels'], variante['erreurs']), (2, 0))
+            # Amoxicilline validée telle quelle, ibuprofène remplacé par le paracétamol
+            self.assertEqual(variante['accord_prescription'], 0.5)
+            self.assertEqual(variante['accord_diagnostic'], 1.0)
+            self.assertGreater(variante['tokens_entree_moyen'], variante['tokens_instruction'])
+
+    def test_fake_backend_reports_errors_and_latency(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            variants = os.path.join(tmp, 'variantes.json')
+            with open(variants, 'w', encoding='utf-8') as f:
+                json.dump([{'nom': 'consultation', 'instruction': 'consultation', 'patterns': False}], f)
+            output = os.path.join(tmp, 'rapport.json')
+            call_command('benchmark_prompt_variants', variants=variants, output=output, stdout=StringIO())
+            with open(output, encoding='utf-8') as f:
+                variante, = json.load(f)['variantes']
+
+        self.assertEqual((variante['appels'], variante['erreurs']), (2, 0))
+        self.assertEqual(variante['latence_ms']['p50'], 0)
+        self.assertEqual(variante['accord_prescription'], 0.0)  # médicaments simulés
+
+
+class DashboardPaginationTests(TestCase):
+
+    def setUp(self):
+        hospital = Hospital.objects.create(name='CHU Test', city='Abidjan', country='CI')
+        self.patients = [
+            Patient.objects.create(
+                social_security_number=f'10{index}', last_name=f'Nom {index}', first_name='P', gender='F'
+            )
+            for index in range(5)
+        ]
+        maintenant = timezone.now()
+        # Patients 3 et 1 ont la même date de dernière consultation; 4 n'a jamais consulté
+        for index, jours, diagnostic in [(0, 10, 'Ancien'), (0, 1, 'Paludisme'), (1, 3, 'Angine'), (3, 3, 'Grippe'),
+                                         (2, 5, 'Otite')]:
+            consultation = Consultation.objects.create(
+                patient=self.patients[index], hospital=hospital, consultation_reason='Motif',
+                initial_diagnosis=diagnostic,
+            )
+            Consultation.objects.filter(pk=consultation.pk).update(consultation_date=maintenant - timedelta(days=jours))
+        # update() ne déclenche pas les signaux qui maintiennent la date de dernière consultation
+        for patient in self.patients:
+            rafraichir_derniere_consultation(patient.pk)
+        self.doctor = User.objects.create_user(username='dr_tableau', password='secret-pass-123')
+        self.client.force_login(self.doctor)
+
+    def test_json_pages_follow_last_activity_without_duplicates(self):
+        lignes, curseur = [], None
+        while True:
+            params = {'taille': 2, **({'apres': curseur} if curseur else {})}
+            page = self.client.get('/dashboard/patients/', params).json()
+            lignes += page['patients']
+            curseur = page['next']
+            if not curseur:
+                break
+
+        p = self.patients
+        self.assertEqual([ligne['id'] for ligne in lignes], [p[0].pk, p[3].pk, p[1].pk, p[2].pk, p[4].pk])
+        self.assertEqual([ligne['diagnostic'] for ligne in lignes], ['Paludisme', 'Grippe', 'Angine', 'Otite', ''])
+        self.assertIsNone(lignes[-1]['derniere_consultation'])
+
+    def test_dashboard_page_reads_each_segment_once(self):
+        # Patients ayant consulté, puis patients sans consultation pour compléter la page
+        with self.assertNumQueries(2):
+            patients, curseur_suivant = page_patients(patients_par_activite())
+        self.assertEqual(len(patients), 5)
+        self.assertIsNone(curseur_suivant)
+
+        response = self.client.get('/dashboard/')
+        self.assertContains(response, 'Paludisme')
+        self.assertNotContains(response, 'Ancien')
+
+    def test_new_consultation_moves_patient_to_the_top(self):
+        Consultation.objects.create(
+            patient=self.patients[4], hospital=Hospital.objects.get(), consultation_reason='Toux',
+        )
+        patients, _ = page_patients(patients_par_activite(), taille=1)
+        self.assertEqual(patients, [self.patients[4]])
+
+        Consultation.objects.get(patient=self.patients[4]).delete()
+        self.patients[4].refresh_from_db()
+        self.assertIsNone(self.patients[4].derniere_consultation)
+
+    def test_json_variant_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/dashboard/patients/').status_code, 302)
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/dashboard/patients/', {'apres': 'pas-un-curseur'}).status_code, 400)
+
+
+class PatientSearchTests(TestCase):
+
+    def setUp(self):
+        self.doctor = User.objects.create_user(username='dr_recherche', password='secret-pass-123')
+        self.helene = Patient.objects.create(
+            social_security_number='185071234567890', last_name='Lefèvre', first_name='Hélène', gender='F'
+        )
+        self.koffi = Patient.objects.create(
+            social_security_number='279021234567890', last_name="N'Guessan", first_name='Koffi', gender='M'
+        )
+        Patient.objects.create(social_security_number='100000000000000', last_name='Martin', first_name='Léa', gender='F')
+
+    def rechercher(self, saisie):
+        return [patient['id'] for patient in self.client.get('/patients/recherche/', {'q': saisie}).json()['patients']]
+
+    def test_normalized_names_follow_name_changes(self):
+        self.assertEqual(self.helene.nom_recherche, 'lefevre helene')
+        self.assertEqual(self.koffi.prenom_nom_recherche, 'koffi n guessan')
+
+        self.helene.last_name = 'Bérénger'
+        self.helene.save(update_fields=['last_name'])
+        self.helene.refresh_from_db()
+        self.assertEqual(self.helene.nom_recherche, 'berenger helene')
+
+    def test_typeahead_matches_prefixes_without_accents(self):
+        self.client.force_login(self.doctor)
+
+        self.assertEqual(self.rechercher('lefev'), [self.helene.pk])
+        self.assertEqual(self.rechercher('HELENE LEF'), [self.helene.pk])
+        self.assertEqual(self.rechercher('n guess'), [self.koffi.pk])
+        self.assertEqual(self.rechercher('1850 71'), [self.helene.pk])
+        self.assertEqual(self.rechercher('evre'), [])
+
+    def test_typeahead_requires_login(self):
+        response = self.client.get('/patients/recherche/', {'q': 'lef'})
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_dashboard_filters_by_name_or_number(self):
+        response = self.client.get('/dashboard/', {'q': 'Lefevre'})
+
+        self.assertEqual([patient.pk for patient in response.context['patients']], [self.helene.pk])
+        self.assertEqual(len(self.client.get('/dashboard/', {'numero': '2790'}).context['patients']), 1)
+
+
+class PatientTimelineTests(TestCase):
+
+    def setUp(self):
+        self.hospital = Hospital.objects.create(name='CHU Test', city='Abidjan', country='CI')
+        self.doctor = User.objects.create_user(username='dr_timeline', password='secret-pass-123')
+        self.patient = Patient.objects.create(social_security_number='300', last_name='Yao', first_name='Ama', gender='F')
+        self.maintenant = timezone.now().replace(microsecond=0)
+
+    def ajouter(self, modele, champ_date, jours, **champs):
+        objet = modele.objects.create(patient=self.patient, **champs)
+        modele.objects.filter(pk=objet.pk).update(**{champ_date: self.maintenant - timedelta(days=jours)})
+        return objet
+
+    def creer_historique(self, repetitions=1):
+        objets = []
+        for _ in range(repetitions):
+            consultation = self.ajouter(
+                Consultation, 'consultation_date', 5, hospital=self.hospital, doctor=self.doctor,
+                consultation_reason='Fièvre', initial_diagnosis='Paludisme', is_validated=True,
+            )
+            objets += [
+                consultation,
+                self.ajouter(Diagnostic, 'date_diagnostic', 5, hopital=self.hospital, medecin=self.doctor,
+                             consultation=consultation, description='Paludisme simple'),
+                self.ajouter(Prescription, 'date_prescription', 4, hopital=self.hospital, medecin=self.doctor,
+                             consultation=consultation, medicament='Artéméther', dosage='80 mg', frequence='2/j',
+                             duree='3 jours'),
+                self.ajouter(ExamenLaboratoire, 'date_demande', 6, hopital=self.hospital,
+                             medecin_prescripteur=self.doctor, type_examen='Goutte épaisse'),
+                self.ajouter(ImagerieMedicale, 'date_examen', 2, hopital=self.hospital, type_imagerie='radio'),
+            ]
+        return objets
+
+    def test_pages_merge_all_records_by_date_without_duplicates(self):
+        self.creer_historique()
+        self.ajouter(Consultation, 'consultation_date', 1, hospital=self.hospital, consultation_reason='Non validée')
+
+        evenements, curseur = [], None
+        while True:
+            page, curseur = page_timeline(self.patient, curseur, taille=2)
+            evenements += page
+            if not curseur:
+                break
+
+        # Consultation et diagnostic à la même date: départagés par type puis id
+        self.assertEqual(
+            [evenement.type for evenement in evenements],
+            ['imagerie', 'prescription', 'diagnostic', 'consultation', 'examen'],
+        )
+        self.assertEqual(evenements[0].date, self.maintenant - timedelta(days=2))
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.creer_historique(repetitions=3)
+        with self.assertNumQueries(7):
+            response = self.client.get(f'/patients/{self.patient.pk}/')
+
+        self.assertEqual(len(response.context['evenements']), 15)
+        self.assertContains(response, 'Artéméther')
+        self.assertContains(response, 'Goutte épaisse')
+
+    def test_invalid_cursor_redirects(self):
+        response = self.client.get(f'/patients/{self.patient.pk}/', {'apres': 'invalide'})
+
+        self.assertRedirects(response, f'/patients/{self.patient.pk}/', fetch_redirect_response=False)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Plans EXPLAIN des requêtes fréquentes: chacune doit passer par son index.
+    Sous PostgreSQL, les parcours séquentiels sont désactivés (tables de test
+    trop petites pour que l'optimiseur choisisse un index de lui-même)
+    """
+
+    def setUp(self):
+        hospital = Hospital.objects.create(name='CHU Test', city='Abidjan', country='CI')
+        self.doctor = User.objects.create_user(username='dr_plans', password='secret-pass-123')
+        self.patient = Patient.objects.create(social_security_number='400', last_name='Koné', first_name='Awa', gender='F')
+        Consultation.objects.create(patient=self.patient, hospital=hospital, doctor=self.doctor, consultation_reason='Toux')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def hot_queries(self):
+        depuis = timezone.now() - timedelta(days=7)
+        return [
+            ('consultation_patient_date_idx',
+             Consultation.objects.filter(patient=self.patient).order_by('-consultation_date')[:5]),
+            ('consultation_doctor_valid_idx', Consultation.objects.filter(doctor=self.doctor, is_validated=True)),
+            ('feedback_date_idx', PrescriptionFeedback.objects.filter(date_creation__gte=depuis)),
+            ('feedback_type_date_idx',
+             PrescriptionFeedback.objects.filter(feedback_type='modifiee', date_creation__gte=depuis)),
+            ('feedback_suivi_date_idx',
+             PrescriptionFeedback.objects.filter(suivi_complete=True, date_creation__gte=depuis)),
+            ('pattern_active_rank_idx', FeedbackPattern.objects.filter(is_active=True)),
+            ('pattern_active_last_idx', FeedbackPattern.objects.filter(is_active=True, last_occurrence__lt=depuis).order_by()),
+            ('patient_activite_idx',
+             Patient.objects.filter(derniere_consultation__isnull=False).order_by('-derniere_consultation', '-pk')[:51]),
+        ]
+
+    def test_hot_queries_use_their_index(self):
+        for index, queryset in self.hot_queries():
+            with self.subTest(index=index):
+                plan = queryset.explain()
+                self.assertIn(index, plan, f'Index {index} absent du plan:\n{plan}')
+
+
+class ClinicalSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.hospital = Hospital.objects.create(name='CHU Test', city='Abidjan', country='CI')
+        self.patient = Patient.objects.create(
+            social_security_number='500', last_name='Bamba', first_name='Fatou', gender='F', allergies='Pénicilline'
+        )
+
+    def consulter(self, motif, **champs):
+        return Consultation.objects.create(
+            patient=self.patient, hospital=self.hospital, consultation_reason=motif, **champs
+        )
+
+    def snapshot(self):
+        return PatientClinicalSnapshot.objects.get(patient=self.patient)
+
+    def test_new_consultations_are_prepended_like_a_full_rebuild(self):
+        for index in range(6):
+            self.consulter(f'Motif {index}', tension=12.8, temperature=38.5, initial_diagnosis=f'Diagnostic {index}')
+
+        incremental = self.snapshot().historique_compact
+        self.assertEqual([entree['motif'] for entree in json.loads(incremental)],
+                         ['Motif 5', 'Motif 4', 'Motif 3', 'Motif 2', 'Motif 1'])
+        self.assertEqual(incremental, construire_snapshot(self.patient).historique_compact)
+
+        consultation = Consultation.objects.get(consultation_reason='Motif 5')
+        consultation.initial_diagnosis = 'Paludisme'
+        consultation.save()
+        self.assertEqual(json.loads(self.snapshot().historique_compact)[0]['diagnostic'], 'Paludisme')
+
+        consultation.delete()
+        self.assertEqual(json.loads(self.snapshot().historique_compact)[0]['motif'], 'Motif 4')
+
+    def test_patient_changes_only_reserialize_the_patient_section(self):
+        self.consulter('Toux')
+        historique = self.snapshot().historique_compact
+
+        self.patient.allergies = 'Aspirine'
+        with self.assertNumQueries(2):
+            self.patient.save(update_fields=['allergies'])
+
+        snapshot = self.snapshot()
+        self.assertEqual(json.loads(snapshot.patient_compact)['allergies'], 'Aspirine')
+        self.assertEqual(snapshot.historique_compact, historique)
+
+    async def test_consultation_data_reads_one_row_and_builds_the_same_prompt(self):
+        from .consultation_analysis import donnees_historique, donnees_patient
+        from .views import _construire_donnees_gemini, _donnees_formulaire_consultation
+
+        await sync_to_async(self.consulter)('Fièvre', temperature=39, heart_rate=100)
+        formulaire = _donnees_formulaire_consultation({'consultation_reason': 'Toux', 'symptoms_text': 'toux sèche'})
+        patient = await Patient.objects.select_related('clinical_snapshot').aget(pk=self.patient.pk)
+
+        donnees = await _construire_donnees_gemini(patient, formulaire)
+
+        # Ancienne construction: patient et historique reformatés depuis les lignes
+        historique = [donnees_historique(c) async for c in Consultation.objects.filter(patient=self.patient)]
+        reference = {**donnees, 'patient': donnees_patient(patient), 'historique_consultations': historique}
+        self.assertEqual(construire_prompt_consultation(donnees), construire_prompt_consultation(reference))
+
+    def test_snapshot_loaded_with_patient_or_built_on_first_read(self):
+        patient = Patient.objects.select_related('clinical_snapshot').get(pk=self.patient.pk)
+        with self.assertNumQueries(0):
+            obtenir_snapshot(patient)
+
+        PatientClinicalSnapshot.objects.all().delete()
+        snapshot = obtenir_snapshot(Patient.objects.get(pk=self.patient.pk))
+
+        self.assertEqual(json.loads(snapshot.patient_compact)['nom_complet'], 'Fatou Bamba')
+
+
+class ReadReplicaRouterTests(TransactionTestCase):
+    """
+    Routage vers le réplica: alias 'replica' local, miroir de la base de test
+    (AssistDoc/settings.py). Données validées (TransactionTestCase): le réplica
+    les lit par sa propre connexion
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        hospital = Hospital.objects.create(name='CHU Test', city='Abidjan', country='CI')
+        self.doctor = User.objects.create_user(username='dr_replica', password='secret-pass-123')
+        patient = Patient.objects.create(social_security_number='500', last_name='Traoré', first_name='Ali', gender='M')
+        for motif in ('Fièvre', 'Toux', 'Angine'):
+            consultation = Consultation.objects.create(
+                patient=patient, hospital=hospital, doctor=self.doctor, consultation_reason=motif,
+                initial_diagnosis=motif, gemini_recommendations=RECOMMANDATIONS_TEST,
+            )
+            PrescriptionFeedback.objects.create(
+                consultation=consultation, doctor=self.doctor, feedback_type='modifiee',
+                raison_modification='posologie pediatrique inadaptee', pertinence_diagnostic=8,
+            )
+
+    def journal(self, fn):
+        """(alias, sql) de toutes les requêtes de fn(), dans l'ordre d'exécution"""
+        requetes = []
+
+        def enregistrer(alias):
+            def wrapper(execute, sql, params, many, context):
+                requetes.append((alias, sql))
+                return execute(sql, params, many, context)
+            return wrapper
+
+        with connections['default'].execute_wrapper(enregistrer('default')), \
+                connections['replica'].execute_wrapper(enregistrer('replica')):
+            fn()
+        return requetes
+
+    def assertLecturesReplicaPuisPrimaire(self, requetes, table):
+        """Lectures de `table` sur le réplica, aucune requête au réplica après la première écriture"""
+        replica = [sql for alias, sql in requetes if alias == 'replica']
+        self.assertTrue(any(table in sql for sql in replica), requetes)
+        self.assertTrue(all(sql.lstrip().upper().startswith('SELECT') for sql in replica), replica)
+        ecritures = [
+            index for index, (alias, sql) in enumerate(requetes)
+            if sql.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+        if ecritures:
+            self.assertFalse([sql for alias, sql in requetes[ecritures[0]:] if alias == 'replica'])
+
+    def test_marked_reads_fall_back_to_primary_without_replica(self):
+        with override_settings(DATABASE_REPLICA_ALIAS='absent'), lectures_replica():
+            self.assertEqual(PrescriptionFeedback.objects.all().db, 'default')
+
+    def test_marked_reads_use_replica_until_a_write_in_the_same_request(self):
+        self.assertEqual(Patient.objects.all().db, 'default')
+
+        with contexte_requete(), lectures_replica():
+            with CaptureQueriesContext(connections['replica']) as replica:
+                self.assertEqual(Patient.objects.count(), 1)
+            self.assertEqual(len(replica), 1)
+
+            Hospital.objects.create(name='CHU Nord', city='Bouaké', country='CI')
+            self.assertEqual(Patient.objects.all().db, 'default')
+
+        # Requête suivante: plus d'épinglage
+        with contexte_requete(), lectures_replica():
+            self.assertEqual(Patient.objects.all().db, 'replica')
+
+    def test_metrics_command_reads_replica_then_pins_primary_after_writing(self):
+        requetes = self.journal(lambda: call_command('calculate_ai_metrics', stdout=StringIO()))
+
+        self.assertLecturesReplicaPuisPrimaire(requetes, 'app_prescriptionfeedback')
+        self.assertTrue(any(alias == 'default' and 'INSERT' in sql for alias, sql in requetes))
+        self.assertEqual(IAPerformanceMetrics.objects.get().total_prescriptions, 3)
+
+    def test_pattern_analysis_reads_replica_then_pins_primary_after_writing(self):
+        requetes = self.journal(lambda: call_command('analyze_feedback_patterns', stdout=StringIO()))
+
+        self.assertLecturesReplicaPuisPrimaire(requetes, 'app_prescriptionfeedback')
+        self.assertTrue(FeedbackPattern.objects.filter(pattern_type='frequent_modification').exists())
+
+    def test_training_export_reads_replica(self):
+        call_command('calculate_ai_metrics', stdout=StringIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'export.jsonl')
+            requetes = self.journal(lambda: call_command(
+                'export_training_data', period='all', min_score=0, output=output, stdout=StringIO()
+            ))
+
+        self.assertLecturesReplicaPuisPrimaire(requetes, 'app_ailearningdata')
+        self.assertFalse([sql for alias, sql in requetes if alias == 'default'])
+
+    def test_admin_analytics_view_reads_replica(self):
+        admin_user = User.objects.create_superuser(username='admin_replica', password='secret-pass-123')
+        self.client.force_login(admin_user)
+
+        requetes = self.journal(lambda: self.assertEqual(
+            self.client.get('/admin/app/iaperformancemetrics/analytics/').status_code, 200
+        ))
+
+        self.assertLecturesReplicaPuisPrimaire(requetes, 'app_prescriptionfeedback')
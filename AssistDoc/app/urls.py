@@ -1,16 +1,22 @@
 from django.urls import path
 from .views import (
-    consultation, patient_detail, dashboard, index, login_page, symptome, 
+    consultation, patient_detail, dashboard, dashboard_patients, index, login_page, symptome, 
     traiter_consultation, supprimer_consultation, valider_consultation, 
-    modifier_prescription, donner_feedback, annuler_prescription
+    modifier_prescription, donner_feedback, annuler_prescription,
+    symptome_stream, symptome_brouillon, consultation_resultats, consultation_statut, recherche_patients
 )
 
 urlpatterns = [
     path('', index, name='index'),
     path('login/', login_page, name='login'),
     path('dashboard/', dashboard, name='dashboard'),
+    path('dashboard/patients/', dashboard_patients, name='dashboard_patients'),
     path('consultation/', consultation, name='consultation'),
     path('symptome/<str:patient_social_security_number>/', symptome, name='symptome'),
+    path('symptome/<str:patient_social_security_number>/stream/', symptome_stream, name='symptome_stream'),
+    path('symptome/<str:patient_social_security_number>/brouillon/', symptome_brouillon, name='symptome_brouillon'),
+    path('consultation/<int:consultation_id>/resultats/', consultation_resultats, name='consultation_resultats'),
+    path('consultation/<int:consultation_id>/statut/', consultation_statut, name='consultation_statut'),
     path('traiter-consultation/', traiter_consultation, name='traiter_consultation'),
     path('valider-consultation/<int:consultation_id>/', valider_consultation, name='valider_consultation'),
     path('modifier-prescription/<int:consultation_id>/', modifier_prescription, name='modifier_prescription'),
@@ -18,4 +24,5 @@ urlpatterns = [
     path('donner-feedback/<int:consultation_id>/', donner_feedback, name='donner_feedback'),
     path('annuler-prescription/<int:consultation_id>/', annuler_prescription, name='annuler_prescription'),
     path("patients/<int:pk>/", patient_detail, name="patient_detail"),
+    path('patients/recherche/', recherche_patients, name='recherche_patients'),
 ]
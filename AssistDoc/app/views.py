@@ -1,18 +1,42 @@
 import json
 import google.generativeai as genai
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import JsonResponse, HttpResponseServerError
+from django.http import JsonResponse, HttpResponseServerError, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render
-from django.shortcuts import get_object_or_404
+from django.shortcuts import get_object_or_404, aget_object_or_404
 from .models import Patient, Consultation, Symptom, Hospital, User
+from .gemini_models import (
+    PRESCRIPTION_SYSTEM_INSTRUCTION, PRESCRIPTION_SCHEMA,
+    CONSULTATION_SYSTEM_INSTRUCTION, CONSULTATION_SCHEMA,
+    ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA
+)
+from .llm_backends import get_llm_backend
+from .llm_limiter import llm_limiter
+from .llm_resilience import AI_UNAVAILABLE_ERRORS
+from .llm_telemetry import record_llm_call
+from .recommendation_cache import recommendation_cache
+from .consultation_analysis import analyser_consultation_async, prompt_consultation
+from .analysis_queue import enqueue_consultation_analysis
+from .clinical_snapshot import donnees_llm, obtenir_snapshot
+from .speculative_analysis import lancer_analyse_speculative, resultat_speculatif
+from .prompt_builder import serialiser_compact
+from .prompt_enhancement import log_prompt_enhancement_usage
+from .patient_queries import (
+    PAGE_SIZE, PAGE_SIZE_MAX, filtre_recherche, page_patients, patients_par_activite, rechercher_patients
+)
+from .patient_timeline import page_timeline
+from .recommendation_stream import IncrementalJSONObjectParser, sse_event
 from django.contrib.auth import authenticate, login
 from django.shortcuts import redirect
+from django.urls import reverse
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_protect
 from django.contrib.auth.decorators import login_required
 from datetime import datetime
+import time
 
 
 
@@ -36,70 +60,53 @@ def generer_prescription(request):
     except json.JSONDecodeError:
         return JsonResponse({"erreur": "JSON invalide dans la requête."}, status=400)
 
-    # 2. Définir la configuration du modèle (traduite depuis votre code TypeScript)
-    # Le 'systemInstruction' et le 'schema' sont identiques à votre app React
-    system_instruction = """Tu es un système expert d'aide à la décision médicale spécialisé dans la prescription de médicaments. 
-    Ton rôle est d'analyser les données cliniques d'un patient et de fournir des recommandations de prescription basées sur les meilleures pratiques médicales.
-    
-    IMPORTANT: Tu ne remplaces pas le jugement clinique d'un médecin. Tes recommandations sont des suggestions pour aider à la prise de décision.
-    
-    Analyse les données fournies et recommande des médicaments appropriés en tenant compte de:
-    - L'âge, le poids et les conditions médicales du patient
-    - Les allergies et contre-indications
-    - Les interactions médicamenteuses potentielles
-    - Les dosages appropriés selon les guidelines
-    - Les effets secondaires possibles
-    
-    Fournis des justifications claires pour chaque recommandation."""
-    
-    # Le schéma de la réponse attendue
-    prescription_schema = {
-        'type': 'OBJECT',
-        'properties': {
-            'recommandations_prescription': {
-                'type': 'ARRAY',
-                'items': {
-                    'type': 'OBJECT',
-                    'properties': {
-                        'nom_medicament': {'type': 'STRING'},
-                        'posologie': {'type': 'STRING'},
-                        'voie_administration': {'type': 'STRING'},
-                        'justification': {'type': 'STRING'},
-                        'effets_secondaires_cles': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
-                        'contre_indications_notables': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
-                        'interactions_medic_potentielles': {'type': 'STRING'},
-                        'notes_supplementaires_ia': {'type': 'STRING'},
-                    },
-                    'required': ["nom_medicament", "posologie", "voie_administration", "justification"]
-                }
-            }
-        },
-        'required': ["recommandations_prescription"]
-    }
-
     try:
-        # Initialisation du modèle avec la configuration
-        model = genai.GenerativeModel(
-            model_name='gemini-1.5-flash',
-            system_instruction=system_instruction,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                response_schema=prescription_schema
-            )
+        # 2. Réutiliser une réponse identique déjà obtenue (même patient, même instruction)
+        backend = get_llm_backend()
+        debut = time.monotonic()
+        telemetry = {
+            'endpoint': 'generer_prescription',
+            'doctor_id': request.user.id if request.user.is_authenticated else None,
+        }
+        cle_cache = recommendation_cache.make_key(
+            patient_data, PRESCRIPTION_SYSTEM_INSTRUCTION, PRESCRIPTION_SCHEMA, model_name=backend.model_name
         )
+        donnees_recommandation = recommendation_cache.get(cle_cache)
+        prompt = None
+
+        if donnees_recommandation is None:
+            # 3. Créer le prompt et appeler le backend LLM (Gemini, ou fake en test de charge)
+            prompt = f"Voici les données du patient (JSON compact). Analyse-les et fournis tes recommandations de prescription.\n{serialiser_compact(patient_data)}"
+            def appel():
+                texte = backend.generate(prompt, PRESCRIPTION_SYSTEM_INSTRUCTION, PRESCRIPTION_SCHEMA)
+                
+                # 4. Le backend retourne un texte qui est une chaîne JSON, on la parse en dictionnaire Python
+                recommandation = json.loads(texte)
+                recommendation_cache.set(cle_cache, recommandation)
+                return recommandation
+            
+            # Requêtes identiques simultanées regroupées, concurrence et débit limités
+            try:
+                donnees_recommandation = llm_limiter.call(cle_cache, appel)
+            except Exception as e:
+                record_llm_call(telemetry, backend, PRESCRIPTION_SYSTEM_INSTRUCTION, prompt, debut, error=e)
+                raise
 
-        # 3. Créer le prompt
-        prompt = f"Voici les données du patient. Analyse-les et fournis tes recommandations de prescription.\n\n{json.dumps(patient_data, indent=2, ensure_ascii=False)}"
-
-        # 4. Appeler l'API Gemini
-        response = model.generate_content(prompt)
-        
-        # L'API retourne un texte qui est une chaîne JSON, on la parse en dictionnaire Python
-        donnees_recommandation = json.loads(response.text)
+        record_llm_call(
+            telemetry, backend, PRESCRIPTION_SYSTEM_INSTRUCTION, prompt, debut,
+            response=donnees_recommandation, served_without_call=prompt is None
+        )
 
         # 5. Renvoyer le résultat au frontend
         return JsonResponse(donnees_recommandation)
 
+    except AI_UNAVAILABLE_ERRORS as e:
+        print(f"Service IA indisponible : {e}")
+        return JsonResponse(
+            {"erreur": "Service IA momentanément indisponible, réessayez dans quelques instants.", "ia_indisponible": True},
+            status=503
+        )
+
     except Exception as e:
         print(f"Erreur lors de l'appel à l'API Gemini : {e}")
         return JsonResponse(
@@ -108,15 +115,59 @@ def generer_prescription(request):
         )
 
 
+def _donnees_formulaire_consultation(post):
+    """
+    Extrait les champs du formulaire de consultation (symptome.html / consultation.html)
+    """
+    return {
+        'consultation_reason': post.get('consultation_reason', ''),
+        'clinical_exam': post.get('clinical_exam', ''),
+        'symptoms_text': post.get('symptoms_text', ''),
+        'tension': post.get('tension_arterielle', ''),
+        'temperature': post.get('temperature', ''),
+        'heart_rate': post.get('frequence_cardiaque', ''),
+        'weight': post.get('poids_kg', ''),
+        'height': post.get('taille_cm', ''),
+        'oxygen_saturation': post.get('saturation_o2', ''),
+        'additional_notes': post.get('additional_notes', ''),
+    }
+
+
+async def _construire_donnees_gemini(patient, consultation_data):
+    """
+    Construit les données complètes envoyées à Gemini: patient et historique des 5
+    dernières consultations lus dans l'instantané clinique (déjà compactés; sans
+    requête si le patient a été chargé avec select_related('clinical_snapshot')),
+    et consultation actuelle.
+    """
+    snapshot = await sync_to_async(obtenir_snapshot)(patient)
+    return donnees_llm(snapshot, {
+        "motif_consultation": consultation_data['consultation_reason'],
+        "examen_clinique": consultation_data['clinical_exam'],
+        "symptomes_decrits": consultation_data['symptoms_text'],
+        "signes_vitaux": {
+            "tension_arterielle": consultation_data['tension'],
+            "temperature": consultation_data['temperature'],
+            "frequence_cardiaque": consultation_data['heart_rate'],
+            "poids": consultation_data['weight'],
+            "taille": consultation_data['height'],
+            "saturation_oxygene": consultation_data['oxygen_saturation']
+        },
+        "notes_supplementaires": consultation_data['additional_notes']
+    })
+
+
 @csrf_protect
 @login_required
 @require_POST
-def traiter_consultation(request):
+async def traiter_consultation(request):
     """
     Traite le formulaire de consultation, récupère les données du patient et historique,
     envoie tout à Gemini pour obtenir diagnostic et prescriptions.
     """
     try:
+        user = await request.auser()
+
         # Récupérer l'ID du patient depuis le formulaire
         patient_id = request.POST.get('patient_id')
         if not patient_id:
@@ -124,177 +175,63 @@ def traiter_consultation(request):
             return redirect('consultation')
         
         # Récupérer le patient
-        patient = get_object_or_404(Patient, id=patient_id)
+        patient = await aget_object_or_404(Patient.objects.select_related('clinical_snapshot'), id=patient_id)
         
         # Récupérer les données du formulaire de consultation
-        consultation_data = {
-            'consultation_reason': request.POST.get('consultation_reason', ''),
-            'clinical_exam': request.POST.get('clinical_exam', ''),
-            'symptoms_text': request.POST.get('symptoms_text', ''),
-            'tension': request.POST.get('tension_arterielle', ''),
-            'temperature': request.POST.get('temperature', ''),
-            'heart_rate': request.POST.get('frequence_cardiaque', ''),
-            'weight': request.POST.get('poids_kg', ''),
-            'height': request.POST.get('taille_cm', ''),
-            'oxygen_saturation': request.POST.get('saturation_o2', ''),
-            'additional_notes': request.POST.get('additional_notes', ''),
-        }
-        
-        # Récupérer l'historique des consultations du patient
-        consultations_precedentes = Consultation.objects.filter(patient=patient).order_by('-consultation_date')[:5]
-        
-        # Construire les données complètes pour Gemini
-        data_pour_gemini = {
-            "patient": {
-                "nom_complet": f"{patient.first_name} {patient.last_name}",
-                "age": patient.birth_date.year if patient.birth_date else "Non spécifié",
-                "sexe": patient.gender,
-                "numero_securite_sociale": patient.social_security_number,
-                "allergies": patient.allergies or "Aucune allergie connue",
-                "antecedents_medicaux": {
-                    "maladies": patient.diseases or "Aucune maladie connue",
-                    "chirurgies": patient.surgeries or "Aucune chirurgie",
-                    "vaccinations": patient.vaccines or "Historique vaccinal non disponible",
-                    "medicaments_actuels": patient.actual_medecines or "Aucun médicament actuel"
-                }
-            },
-            "consultation_actuelle": {
-                "motif_consultation": consultation_data['consultation_reason'],
-                "examen_clinique": consultation_data['clinical_exam'],
-                "symptomes_decrits": consultation_data['symptoms_text'],
-                "signes_vitaux": {
-                    "tension_arterielle": consultation_data['tension'],
-                    "temperature": consultation_data['temperature'],
-                    "frequence_cardiaque": consultation_data['heart_rate'],
-                    "poids": consultation_data['weight'],
-                    "taille": consultation_data['height'],
-                    "saturation_oxygene": consultation_data['oxygen_saturation']
-                },
-                "notes_supplementaires": consultation_data['additional_notes']
-            },
-            "historique_consultations": []
-        }
+        consultation_data = _donnees_formulaire_consultation(request.POST)
         
-        # Ajouter l'historique des consultations
-        for consultation in consultations_precedentes:
-            data_pour_gemini["historique_consultations"].append({
-                "date": consultation.consultation_date.strftime("%Y-%m-%d"),
-                "motif": consultation.consultation_reason,
-                "diagnostic": consultation.initial_diagnosis or "Non spécifié",
-                "signes_vitaux": {
-                    "tension": str(consultation.tension) if consultation.tension else None,
-                    "temperature": str(consultation.temperature) if consultation.temperature else None,
-                    "frequence_cardiaque": consultation.heart_rate if consultation.heart_rate else None
-                }
-            })
+        # Construire les données complètes pour Gemini (patient + historique)
+        data_pour_gemini = await _construire_donnees_gemini(patient, consultation_data)
         
         # Configuration du modèle Gemini pour diagnostic et prescription
-        base_system_instruction = """Tu es un médecin expert spécialisé dans le diagnostic médical et la prescription de médicaments. 
-        Ton rôle est d'analyser les données complètes d'un patient incluant ses antécédents, la consultation actuelle et l'historique médical pour fournir:
-        
-        1. UN DIAGNOSTIC DÉTAILLÉ avec diagnostic différentiel
-        2. DES RECOMMANDATIONS DE PRESCRIPTION spécifiques et justifiées
-        3. DES RECOMMANDATIONS DE SUIVI
-        
-        IMPORTANT: 
-        - Tes recommandations sont des suggestions pour aider le médecin dans sa prise de décision
-        - Considère toujours les allergies, antécédents et interactions médicamenteuses
-        - Fournis des justifications médicales claires
-        - Propose des alternatives si nécessaire
-        
-        Analyse TOUTES les données fournies: patient, consultation actuelle, et historique médical."""
+        base_system_instruction = CONSULTATION_SYSTEM_INSTRUCTION
         
         # 🚀 NOUVEAU: Enrichir le prompt avec les patterns de feedback
+        contextual_enhancements = ''
+        patterns_utilises = []
         try:
             from .prompt_enhancement import get_enhanced_system_instruction, get_contextual_enhancements
             from django.utils import timezone as django_timezone
             
-            # Enrichissement principal basé sur les patterns globaux
-            enhanced_instruction = get_enhanced_system_instruction(base_system_instruction)
-            
             # Enrichissement contextuel basé sur le patient
-            contextual_enhancements = get_contextual_enhancements(
+            contextual_enhancements = await sync_to_async(get_contextual_enhancements)(
                 symptoms=consultation_data['symptoms_text'],
                 patient_age=django_timezone.now().year - patient.birth_date.year if patient.birth_date else None,
-                patient_gender=patient.gender
+                patient_gender=patient.gender,
+                usage=patterns_utilises
             )
             
-            system_instruction = enhanced_instruction + contextual_enhancements
+            # Enrichissement principal basé sur les patterns globaux: identique pour tous les
+            # patients (cache de contexte Gemini), le contextuel est ajouté au prompt
+            system_instruction = await sync_to_async(get_enhanced_system_instruction)(
+                base_system_instruction, usage=patterns_utilises
+            )
             
         except Exception as e:
             # Fallback vers l'instruction de base en cas d'erreur
             print(f"Erreur lors de l'enrichissement du prompt: {e}")
             system_instruction = base_system_instruction
+            contextual_enhancements = ''
+            patterns_utilises = []
         
-        prescription_schema = {
-            'type': 'OBJECT',
-            'properties': {
-                'diagnostic_principal': {'type': 'STRING'},
-                'diagnostic_differentiel': {
-                    'type': 'ARRAY',
-                    'items': {'type': 'STRING'}
-                },
-                'justification_diagnostic': {'type': 'STRING'},
-                'prescriptions_recommandees': {
-                    'type': 'ARRAY',
-                    'items': {
-                        'type': 'OBJECT',
-                        'properties': {
-                            'nom_medicament': {'type': 'STRING'},
-                            'dosage': {'type': 'STRING'},
-                            'frequence': {'type': 'STRING'},
-                            'duree_traitement': {'type': 'STRING'},
-                            'voie_administration': {'type': 'STRING'},
-                            'justification': {'type': 'STRING'},
-                            'precautions': {'type': 'STRING'},
-                            'effets_secondaires_surveiller': {
-                                'type': 'ARRAY',
-                                'items': {'type': 'STRING'}
-                            }
-                        },
-                        'required': ['nom_medicament', 'dosage', 'frequence', 'justification']
-                    }
-                },
-                'examens_complementaires': {
-                    'type': 'ARRAY',
-                    'items': {'type': 'STRING'}
-                },
-                'recommandations_suivi': {'type': 'STRING'},
-                'conseils_patient': {'type': 'STRING'},
-                'urgence_niveau': {
-                    'type': 'STRING',
-                    'enum': ['Faible', 'Modéré', 'Élevé', 'Urgent']
-                }
-            },
-            'required': ['diagnostic_principal', 'justification_diagnostic', 'prescriptions_recommandees']
-        }
-        
-        # Créer le modèle Gemini
-        model = genai.GenerativeModel(
-            model_name='gemini-1.5-flash',
-            system_instruction=system_instruction,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                response_schema=prescription_schema
+        # Appeler Gemini (ou réutiliser une réponse identique en cache)
+        try:
+            recommendations = await analyser_consultation_async(
+                data_pour_gemini, system_instruction, CONSULTATION_SCHEMA,
+                telemetry=await _contexte_telemetrie('traiter_consultation', user),
+                consignes_contextuelles=contextual_enhancements
             )
-        )
-        
-        # Créer le prompt détaillé
-        prompt = f"""Analyse complète du patient et recommandations médicales:
-
-{json.dumps(data_pour_gemini, indent=2, ensure_ascii=False)}
-
-Fournis une analyse complète avec diagnostic et prescriptions détaillées basées sur toutes ces données."""
-        
-        # Appeler Gemini
-        response = model.generate_content(prompt)
-        recommendations = json.loads(response.text)
+        except AI_UNAVAILABLE_ERRORS as e:
+            print(f"Service IA indisponible pour la consultation: {e}")
+            nouvelle_consultation = await _enregistrer_consultation_sans_ia(patient, user, consultation_data)
+            messages.warning(request, 'Service IA indisponible: consultation enregistrée sans recommandations IA.')
+            return redirect('consultation_resultats', consultation_id=nouvelle_consultation.id)
         
         # Sauvegarder la consultation dans la base de données
-        nouvelle_consultation = Consultation.objects.create(
+        nouvelle_consultation = await Consultation.objects.acreate(
             patient=patient,
-            hospital=request.user.hospitals.first() if request.user.hospitals.exists() else None,
-            doctor=request.user,
+            hospital=await user.hospitals.afirst(),
+            doctor=user,
             consultation_reason=consultation_data['consultation_reason'],
             clinical_exam=consultation_data['clinical_exam'],
             initial_diagnosis=recommendations.get('diagnostic_principal', ''),
@@ -306,6 +243,9 @@ Fournis une analyse complète avec diagnostic et prescriptions détaillées bas
             oxygen_saturation=float(consultation_data['oxygen_saturation'].replace('%', '')) if consultation_data['oxygen_saturation'] else None,
         )
         
+        # Patterns utilisés par le prompt, rapprochés plus tard du feedback du médecin (écriture groupée)
+        log_prompt_enhancement_usage(patterns_utilises, nouvelle_consultation.id, endpoint='traiter_consultation')
+        
         # Retourner la page de résultats avec les recommandations
         context = {
             'patient': patient,
@@ -314,7 +254,7 @@ Fournis une analyse complète avec diagnostic et prescriptions détaillées bas
             'consultation_data': consultation_data
         }
         
-        return render(request, 'consultation_results.html', context)
+        return await sync_to_async(render)(request, 'consultation_results.html', context)
         
     except Exception as e:
         print(f"Erreur lors du traitement de la consultation: {e}")
@@ -390,228 +330,185 @@ def login_page(request):
     
     return render(request, 'login.html')
 
-def dashboard(request):
-    numero = request.GET.get('numero', '').strip()
+def _patients_dashboard(request):
+    """Patients du tableau de bord (filtrés par début de nom ou de numéro de sécurité sociale), par dernière activité"""
+    recherche = request.GET.get('q') or request.GET.get('numero', '')
+    return patients_par_activite(Patient.objects.filter(filtre_recherche(recherche)))
+
 
-    if numero.isdigit():
-        patients = Patient.objects.filter(social_security_number=numero)
-    else:
-        patients = Patient.objects.all()
+def dashboard(request):
+    try:
+        patients, curseur_suivant = page_patients(_patients_dashboard(request), request.GET.get('apres'))
+    except ValueError:
+        messages.error(request, 'Lien de pagination invalide.')
+        return redirect('dashboard')
 
+    recherche = request.GET.get('q') or request.GET.get('numero', '')
     context = {
         'patients': patients,
+        'curseur_suivant': curseur_suivant,
+        'recherche': recherche,
+        'recherche_json': json.dumps(recherche),
     }
     return render(request, 'dashboard.html', context)
 
+
+@login_required
+def dashboard_patients(request):
+    """
+    Variante JSON du tableau de bord: page suivante de patients pour le
+    chargement incrémental (?apres=<curseur>&taille=<n>)
+    """
+    try:
+        taille = min(max(int(request.GET.get('taille', PAGE_SIZE)), 1), PAGE_SIZE_MAX)
+        patients, curseur_suivant = page_patients(_patients_dashboard(request), request.GET.get('apres'), taille)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'patients': [
+            {
+                'id': patient.pk,
+                'last_name': patient.last_name,
+                'first_name': patient.first_name,
+                'birth_date': patient.birth_date.isoformat() if patient.birth_date else None,
+                'derniere_consultation': (
+                    patient.derniere_consultation.isoformat() if patient.derniere_consultation else None
+                ),
+                'diagnostic': patient.diagnostic or '',
+                'url': reverse('patient_detail', args=[patient.pk]),
+            }
+            for patient in patients
+        ],
+        'next': curseur_suivant,
+    })
+
+
+@login_required
+def recherche_patients(request):
+    """
+    Saisie semi-automatique: les meilleurs patients pour un début de nom, de
+    prénom ou de numéro de sécurité sociale (?q=<saisie>&n=<nombre>)
+    """
+    try:
+        limit = int(request.GET.get('n', 10))
+    except ValueError:
+        return JsonResponse({'error': 'Paramètre n invalide'}, status=400)
+
+    return JsonResponse({
+        'patients': [
+            {
+                'id': patient.pk,
+                'last_name': patient.last_name,
+                'first_name': patient.first_name,
+                'social_security_number': patient.social_security_number,
+                'birth_date': patient.birth_date.isoformat() if patient.birth_date else None,
+                'url': reverse('patient_detail', args=[patient.pk]),
+            }
+            for patient in rechercher_patients(request.GET.get('q', ''), limit)
+        ],
+    })
+
 def consultation(request):
     return render(request, 'consultation.html')
 
-def symptome(request, patient_social_security_number):
-    patient = get_object_or_404(Patient, social_security_number=patient_social_security_number)
+async def _champs_consultation(patient, user, consultation_data, recommendations=None):
+    """
+    Champs de la consultation issue du formulaire symptome (recommandations Gemini
+    absentes tant que l'analyse est en file d'attente)
+    """
+    recommendations = recommendations or {}
+    return {
+        'patient': patient,
+        'hospital': await user.hospitals.afirst(),
+        'doctor': user,
+        'consultation_reason': consultation_data['consultation_reason'],
+        'clinical_exam': consultation_data['clinical_exam'],
+        'initial_diagnosis': recommendations.get('diagnostic_principal', ''),
+        'tension': float(consultation_data['tension'].replace('/', '.').split('/')[0]) if consultation_data['tension'] else None,
+        'temperature': float(consultation_data['temperature']) if consultation_data['temperature'] else None,
+        'heart_rate': int(consultation_data['heart_rate']) if consultation_data['heart_rate'] else None,
+        'weight': float(consultation_data['weight']) if consultation_data['weight'] else None,
+        'height': float(consultation_data['height']) if consultation_data['height'] else None,
+        'oxygen_saturation': float(consultation_data['oxygen_saturation']) if consultation_data['oxygen_saturation'] else None,
+        'gemini_recommendations': recommendations or None,  # Stocker les recommandations Gemini
+    }
+
+
+async def _contexte_telemetrie(endpoint, user):
+    """Contexte LLMCallLog d'un appel IA: vue d'origine, médecin et hôpital"""
+    return {
+        'endpoint': endpoint,
+        'doctor_id': user.id,
+        'hospital_id': await user.hospitals.values_list('id', flat=True).afirst(),
+    }
+
+
+async def _enregistrer_consultation_sans_ia(patient, user, consultation_data):
+    """
+    Service IA indisponible: la consultation est sauvegardée sans recommandations
+    pour que le médecin puisse poursuivre la prise en charge
+    """
+    champs = await _champs_consultation(patient, user, consultation_data)
+    return await Consultation.objects.acreate(**champs, analysis_status='echec')
+
+
+async def _enregistrer_consultation(patient, user, consultation_data, recommendations):
+    """
+    Sauvegarde la consultation issue du formulaire symptome avec les recommandations Gemini
+    """
+    champs = await _champs_consultation(patient, user, consultation_data, recommendations)
+    return await Consultation.objects.acreate(**champs)
+
+
+async def symptome(request, patient_social_security_number):
+    patient = await aget_object_or_404(
+        Patient.objects.select_related('clinical_snapshot'), social_security_number=patient_social_security_number
+    )
     
     # Vérifier si on veut éditer une consultation existante
     edit_consultation_id = request.GET.get('edit')
     edit_consultation = None
     if edit_consultation_id:
         try:
-            edit_consultation = Consultation.objects.get(id=edit_consultation_id, patient=patient)
+            edit_consultation = await Consultation.objects.aget(id=edit_consultation_id, patient=patient)
         except Consultation.DoesNotExist:
             messages.error(request, 'Consultation non trouvée.')
     
     if request.method == 'POST':
         # Appeler directement la logique de traitement de consultation
         try:
+            user = await request.auser()
+
             # Récupérer les données du formulaire de consultation
-            consultation_data = {
-                'consultation_reason': request.POST.get('consultation_reason', ''),
-                'clinical_exam': request.POST.get('clinical_exam', ''),
-                'symptoms_text': request.POST.get('symptoms_text', ''),
-                'tension': request.POST.get('tension_arterielle', ''),
-                'temperature': request.POST.get('temperature', ''),
-                'heart_rate': request.POST.get('frequence_cardiaque', ''),
-                'weight': request.POST.get('poids_kg', ''),
-                'height': request.POST.get('taille_cm', ''),
-                'oxygen_saturation': request.POST.get('saturation_o2', ''),
-                'additional_notes': request.POST.get('additional_notes', ''),
-            }
-            
-            # Récupérer l'historique des consultations du patient
-            consultations_precedentes = Consultation.objects.filter(patient=patient).order_by('-consultation_date')[:5]
-            
-            # Construire les données complètes pour Gemini
-            data_pour_gemini = {
-                "patient": {
-                    "nom_complet": f"{patient.first_name} {patient.last_name}",
-                    "age": patient.birth_date.year if patient.birth_date else "Non spécifié",
-                    "sexe": patient.gender,
-                    "numero_securite_sociale": patient.social_security_number,
-                    "allergies": patient.allergies or "Aucune allergie connue",
-                    "antecedents_medicaux": {
-                        "maladies": patient.diseases or "Aucune maladie connue",
-                        "chirurgies": patient.surgeries or "Aucune chirurgie",
-                        "vaccinations": patient.vaccines or "Historique vaccinal non disponible",
-                        "medicaments_actuels": patient.actual_medecines or "Aucun médicament actuel"
-                    }
-                },
-                "consultation_actuelle": {
-                    "motif_consultation": consultation_data['consultation_reason'],
-                    "examen_clinique": consultation_data['clinical_exam'],
-                    "symptomes_decrits": consultation_data['symptoms_text'],
-                    "signes_vitaux": {
-                        "tension_arterielle": consultation_data['tension'],
-                        "temperature": consultation_data['temperature'],
-                        "frequence_cardiaque": consultation_data['heart_rate'],
-                        "poids": consultation_data['weight'],
-                        "taille": consultation_data['height'],
-                        "saturation_oxygene": consultation_data['oxygen_saturation']
-                    },
-                    "notes_supplementaires": consultation_data['additional_notes']
-                },
-                "historique_consultations": []
-            }
-            
-            # Ajouter l'historique des consultations
-            for consultation in consultations_precedentes:
-                data_pour_gemini["historique_consultations"].append({
-                    "date": consultation.consultation_date.strftime("%Y-%m-%d"),
-                    "motif": consultation.consultation_reason,
-                    "diagnostic": consultation.initial_diagnosis or "Non spécifié",
-                    "signes_vitaux": {
-                        "tension": str(consultation.tension) if consultation.tension else None,
-                        "temperature": str(consultation.temperature) if consultation.temperature else None,
-                        "frequence_cardiaque": consultation.heart_rate if consultation.heart_rate else None
-                    }
-                })
-            
-            # Configuration du modèle Gemini pour diagnostic et prescription
-            system_instruction = """Tu es un médecin expert spécialisé dans le diagnostic médical et la prescription de médicaments. 
-            Ton rôle est d'analyser les données complètes d'un patient incluant ses antécédents, la consultation actuelle et l'historique médical pour fournir:
-            
-            1. UN DIAGNOSTIC DÉTAILLÉ avec diagnostic différentiel
-            2. DES RECOMMANDATIONS DE PRESCRIPTION spécifiques et justifiées
-            3. UNE ORDONNANCE MÉDICALE FORMELLE avec médicaments détaillés
-            4. DES RECOMMANDATIONS DE SUIVI
-            
-            IMPORTANT: 
-            - Tes recommandations sont des suggestions pour aider le médecin dans sa prise de décision
-            - Considère toujours les allergies, antécédents et interactions médicamenteuses
-            - Fournis des justifications médicales claires
-            - Pour l'ordonnance, propose des médicaments avec posologie précise, fréquence et durée
-            - Inclus des instructions claires pour le patient
-            - Propose des alternatives si nécessaire
+            consultation_data = _donnees_formulaire_consultation(request.POST)
             
-            Analyse TOUTES les données fournies: patient, consultation actuelle, et historique médical.
+            # Construire les données complètes pour Gemini (patient + historique)
+            data_pour_gemini = await _construire_donnees_gemini(patient, consultation_data)
             
-            L'ordonnance doit être complète et prête à être utilisée par le médecin."""
+            # File d'analyse: sauvegarder tout de suite, un worker appellera Gemini
+            if settings.ANALYSIS_QUEUE_ENABLED:
+                champs = await _champs_consultation(patient, user, consultation_data)
+                nouvelle_consultation = await sync_to_async(enqueue_consultation_analysis)(champs, data_pour_gemini)
+                return redirect('consultation_resultats', consultation_id=nouvelle_consultation.id)
             
-            prescription_schema = {
-                'type': 'OBJECT',
-                'properties': {
-                    'diagnostic_principal': {'type': 'STRING'},
-                    'diagnostic_differentiel': {
-                        'type': 'ARRAY',
-                        'items': {'type': 'STRING'}
-                    },
-                    'justification_diagnostic': {'type': 'STRING'},
-                    'prescriptions_recommandees': {
-                        'type': 'ARRAY',
-                        'items': {
-                            'type': 'OBJECT',
-                            'properties': {
-                                'nom_medicament': {'type': 'STRING'},
-                                'dosage': {'type': 'STRING'},
-                                'frequence': {'type': 'STRING'},
-                                'duree_traitement': {'type': 'STRING'},
-                                'voie_administration': {'type': 'STRING'},
-                                'justification': {'type': 'STRING'},
-                                'precautions': {'type': 'STRING'},
-                                'effets_secondaires_surveiller': {
-                                    'type': 'ARRAY',
-                                    'items': {'type': 'STRING'}
-                                }
-                            },
-                            'required': ['nom_medicament', 'dosage', 'frequence', 'justification']
-                        }
-                    },
-                    'examens_complementaires': {
-                        'type': 'ARRAY',
-                        'items': {'type': 'STRING'}
-                    },
-                    'recommandations_suivi': {'type': 'STRING'},
-                    'conseils_patient': {'type': 'STRING'},
-                    'urgence_niveau': {
-                        'type': 'STRING',
-                        'enum': ['Faible', 'Modéré', 'Élevé', 'Urgent']
-                    },
-                    'ordonnance_medicale': {
-                        'type': 'OBJECT',
-                        'properties': {
-                            'medicaments': {
-                                'type': 'ARRAY',
-                                'items': {
-                                    'type': 'OBJECT',
-                                    'properties': {
-                                        'nom_commercial': {'type': 'STRING'},
-                                        'nom_generique': {'type': 'STRING'},
-                                        'forme': {'type': 'STRING'},  # comprimé, gélule, sirop, etc.
-                                        'dosage_unitaire': {'type': 'STRING'},  # ex: 500mg
-                                        'posologie': {'type': 'STRING'},  # ex: 1 comprimé
-                                        'frequence': {'type': 'STRING'},  # ex: 3 fois par jour
-                                        'duree': {'type': 'STRING'},  # ex: 7 jours
-                                        'moment_prise': {'type': 'STRING'},  # ex: avant les repas
-                                        'instructions_speciales': {'type': 'STRING'}
-                                    },
-                                    'required': ['nom_commercial', 'posologie', 'frequence', 'duree']
-                                }
-                            },
-                            'instructions_generales': {'type': 'STRING'},
-                            'contre_indications': {'type': 'STRING'},
-                            'renouvellement': {'type': 'STRING'},  # ex: "Non renouvelable" ou "Renouvelable 2 fois"
-                            'duree_validite': {'type': 'STRING'}  # ex: "3 mois"
-                        },
-                        'required': ['medicaments', 'instructions_generales']
-                    }
-                },
-                'required': ['diagnostic_principal', 'justification_diagnostic', 'prescriptions_recommandees', 'ordonnance_medicale']
-            }
-            
-            # Créer le modèle Gemini
-            model = genai.GenerativeModel(
-                model_name='gemini-1.5-flash',
-                system_instruction=system_instruction,
-                generation_config=genai.types.GenerationConfig(
-                    response_mime_type="application/json",
-                    response_schema=prescription_schema
-                )
-            )
-            
-            # Créer le prompt détaillé
-            prompt = f"""Analyse complète du patient et recommandations médicales:
-
-{json.dumps(data_pour_gemini, indent=2, ensure_ascii=False)}
-
-Fournis une analyse complète avec diagnostic et prescriptions détaillées basées sur toutes ces données."""
-            
-            # Appeler Gemini
-            response = model.generate_content(prompt)
-            recommendations = json.loads(response.text)
+            # Diagnostic, prescription et ordonnance par Gemini (ou réponse identique en cache,
+            # ou pré-analyse lancée pendant la saisie avec exactement ces données)
+            try:
+                recommendations = await resultat_speculatif(data_pour_gemini, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA)
+                if recommendations is None:
+                    recommendations = await analyser_consultation_async(
+                        data_pour_gemini, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA,
+                        telemetry=await _contexte_telemetrie('symptome', user)
+                    )
+            except AI_UNAVAILABLE_ERRORS as e:
+                print(f"Service IA indisponible pour la consultation: {e}")
+                nouvelle_consultation = await _enregistrer_consultation_sans_ia(patient, user, consultation_data)
+                messages.warning(request, 'Service IA indisponible: consultation enregistrée sans recommandations IA.')
+                return redirect('consultation_resultats', consultation_id=nouvelle_consultation.id)
             
             # Sauvegarder la consultation dans la base de données
-            nouvelle_consultation = Consultation.objects.create(
-                patient=patient,
-                hospital=request.user.hospitals.first() if request.user.hospitals.exists() else None,
-                doctor=request.user,
-                consultation_reason=consultation_data['consultation_reason'],
-                clinical_exam=consultation_data['clinical_exam'],
-                initial_diagnosis=recommendations.get('diagnostic_principal', ''),
-                tension=float(consultation_data['tension'].replace('/', '.').split('/')[0]) if consultation_data['tension'] else None,
-                temperature=float(consultation_data['temperature']) if consultation_data['temperature'] else None,
-                heart_rate=int(consultation_data['heart_rate']) if consultation_data['heart_rate'] else None,
-                weight=float(consultation_data['weight']) if consultation_data['weight'] else None,
-                height=float(consultation_data['height']) if consultation_data['height'] else None,
-                oxygen_saturation=float(consultation_data['oxygen_saturation']) if consultation_data['oxygen_saturation'] else None,
-                gemini_recommendations=recommendations,  # Stocker les recommandations Gemini
-            )
+            nouvelle_consultation = await _enregistrer_consultation(patient, user, consultation_data, recommendations)
             
             # Retourner la page de résultats avec les recommandations
             context = {
@@ -621,19 +518,173 @@ Fournis une analyse complète avec diagnostic et prescriptions détaillées bas
                 'consultation_data': consultation_data
             }
             
-            return render(request, 'consultation_results.html', context)
+            return await sync_to_async(render)(request, 'consultation_results.html', context)
             
         except Exception as e:
             print(f"Erreur lors du traitement de la consultation: {e}")
             messages.error(request, f'Une erreur est survenue: {str(e)}')
-            return render(request, 'symptome.html', {'patient': patient})
+            return await sync_to_async(render)(request, 'symptome.html', {
+                'patient': patient,
+                'analyse_streaming': not settings.ANALYSIS_QUEUE_ENABLED,
+                'pre_analyse': settings.SPECULATIVE_ANALYSIS_ENABLED and not settings.ANALYSIS_QUEUE_ENABLED,
+                'pre_analyse_delai_ms': settings.SPECULATIVE_ANALYSIS_DEBOUNCE_MS,
+            })
     
     # Préparer le contexte avec les données d'édition si nécessaire
     context = {
         'patient': patient,
-        'edit_consultation': edit_consultation
+        'edit_consultation': edit_consultation,
+        # Sans file d'analyse, le formulaire affiche les recommandations en streaming
+        'analyse_streaming': not settings.ANALYSIS_QUEUE_ENABLED,
+        # Pré-analyse pendant la saisie (brouillon envoyé après une pause de frappe)
+        'pre_analyse': settings.SPECULATIVE_ANALYSIS_ENABLED and not settings.ANALYSIS_QUEUE_ENABLED,
+        'pre_analyse_delai_ms': settings.SPECULATIVE_ANALYSIS_DEBOUNCE_MS,
+    }
+    return await sync_to_async(render)(request, 'symptome.html', context)
+
+
+@csrf_protect
+@login_required
+@require_POST
+async def symptome_stream(request, patient_social_security_number):
+    """
+    Variante streaming de symptome: les sections des recommandations sont poussées
+    au navigateur (Server-Sent Events) au fil de la génération Gemini, puis la
+    consultation est sauvegardée avec l'objet complet.
+    """
+    patient = await aget_object_or_404(
+        Patient.objects.select_related('clinical_snapshot'), social_security_number=patient_social_security_number
+    )
+    user = await request.auser()
+    consultation_data = _donnees_formulaire_consultation(request.POST)
+
+    async def evenements():
+        try:
+            data_pour_gemini = await _construire_donnees_gemini(patient, consultation_data)
+            backend = get_llm_backend()
+            telemetry = await _contexte_telemetrie('symptome_stream', user)
+            debut = time.monotonic()
+            cle_cache = recommendation_cache.make_key(
+                data_pour_gemini, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA, model_name=backend.model_name
+            )
+            recommendations = recommendation_cache.get(cle_cache)
+            if recommendations is None:
+                # Pré-analyse encore en cours pour ces données: on l'attend plutôt que de relancer
+                recommendations = await resultat_speculatif(data_pour_gemini, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA)
+
+            if recommendations is not None:
+                record_llm_call(telemetry, backend, ORDONNANCE_SYSTEM_INSTRUCTION, None, debut, served_without_call=True)
+                for key, value in recommendations.items():
+                    yield sse_event('section', {'key': key, 'value': value})
+            else:
+                parser = IncrementalJSONObjectParser()
+                prompt = prompt_consultation(data_pour_gemini)
+                try:
+                    # Pas de regroupement single-flight pour un flux; le backend prend son créneau du limiteur
+                    morceaux = backend.astream(prompt, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA)
+                    async for morceau in morceaux:
+                        for key, value in parser.feed(morceau):
+                            yield sse_event('section', {'key': key, 'value': value})
+
+                    recommendations = json.loads(parser.object_text)
+                except Exception as e:
+                    record_llm_call(telemetry, backend, ORDONNANCE_SYSTEM_INSTRUCTION, prompt, debut, error=e)
+                    raise
+                record_llm_call(telemetry, backend, ORDONNANCE_SYSTEM_INSTRUCTION, prompt, debut, response=parser.text)
+                recommendation_cache.set(cle_cache, recommendations)
+
+            nouvelle_consultation = await _enregistrer_consultation(patient, user, consultation_data, recommendations)
+            yield sse_event('done', {
+                'consultation_id': nouvelle_consultation.id,
+                'resultats_url': reverse('consultation_resultats', args=[nouvelle_consultation.id]),
+            })
+
+        except AI_UNAVAILABLE_ERRORS as e:
+            # Échec rapide: consultation enregistrée sans IA, le médecin continue
+            print(f"Service IA indisponible pendant le streaming: {e}")
+            nouvelle_consultation = await _enregistrer_consultation_sans_ia(patient, user, consultation_data)
+            yield sse_event('done', {
+                'consultation_id': nouvelle_consultation.id,
+                'resultats_url': reverse('consultation_resultats', args=[nouvelle_consultation.id]),
+                'ia_indisponible': True,
+            })
+
+        except Exception as e:
+            print(f"Erreur lors du streaming de la consultation: {e}")
+            yield sse_event('error', {'message': f'Une erreur est survenue: {str(e)}'})
+
+    response = StreamingHttpResponse(evenements(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Pas de mise en tampon par le proxy (nginx)
+    return response
+
+
+@csrf_protect
+@login_required
+@require_POST
+async def symptome_brouillon(request, patient_social_security_number):
+    """
+    Brouillon du formulaire symptome, envoyé quand le médecin fait une pause dans la saisie:
+    lance la pré-analyse spéculative si les champs requis sont remplis (plafonnée par médecin)
+    """
+    if not settings.SPECULATIVE_ANALYSIS_ENABLED or settings.ANALYSIS_QUEUE_ENABLED:
+        return JsonResponse({'statut': 'desactive'})
+
+    patient = await aget_object_or_404(
+        Patient.objects.select_related('clinical_snapshot'), social_security_number=patient_social_security_number
+    )
+    user = await request.auser()
+    consultation_data = _donnees_formulaire_consultation(request.POST)
+
+    # Champs requis encore en cours de saisie: rien à analyser
+    longueur_min = settings.SPECULATIVE_ANALYSIS_MIN_CHARS
+    if (not consultation_data['consultation_reason'].strip()
+            or len(consultation_data['symptoms_text'].strip()) < longueur_min):
+        return JsonResponse({'statut': 'incomplet'})
+
+    try:
+        data_pour_gemini = await _construire_donnees_gemini(patient, consultation_data)
+        statut = await lancer_analyse_speculative(
+            data_pour_gemini, ORDONNANCE_SYSTEM_INSTRUCTION, ORDONNANCE_SCHEMA, user.id,
+            telemetry=await _contexte_telemetrie('symptome_brouillon', user)
+        )
+    except Exception as e:
+        print(f"Erreur lors de la pré-analyse du brouillon: {e}")
+        statut = 'erreur'
+    return JsonResponse({'statut': statut})
+
+
+@login_required
+def consultation_resultats(request, consultation_id):
+    """
+    Affiche les résultats d'une consultation déjà analysée (fin du streaming)
+    """
+    consultation = get_object_or_404(Consultation, id=consultation_id, doctor=request.user)
+    context = {
+        'patient': consultation.patient,
+        'consultation': consultation,
+        'recommendations': consultation.gemini_recommendations or {},
     }
-    return render(request, 'symptome.html', context)
+    if consultation.analysis_status != 'terminee':
+        # Analyse en file d'attente: la page interroge consultation_statut jusqu'au résultat
+        return render(request, 'consultation_en_attente.html', context)
+    return render(request, 'consultation_results.html', context)
+
+
+@login_required
+def consultation_statut(request, consultation_id):
+    """
+    Statut de l'analyse IA d'une consultation (JSON léger interrogé par la page d'attente)
+    """
+    consultation = get_object_or_404(
+        Consultation.objects.only('id', 'analysis_status', 'doctor_id'),
+        id=consultation_id, doctor=request.user
+    )
+    return JsonResponse({
+        'consultation_id': consultation.id,
+        'status': consultation.analysis_status,
+        'resultats_url': reverse('consultation_resultats', args=[consultation.id]),
+    })
 
 @csrf_protect
 @login_required
@@ -829,16 +880,19 @@ def supprimer_consultation(request, consultation_id):
 
 def patient_detail(request, pk):
     patient = get_object_or_404(Patient, pk=pk)
-    
-    # Récupérer toutes les consultations validées de ce patient, triées par date décroissante
-    consultations_validees = Consultation.objects.filter(
-        patient=patient, 
-        is_validated=True
-    ).order_by('-consultation_date')
-    
+
+    # Chronologie (consultations validées, diagnostics, prescriptions, examens, imageries), paginée par curseur
+    try:
+        evenements, curseur_suivant = page_timeline(patient, request.GET.get('apres'))
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect('patient_detail', pk=pk)
+
     context = {
         'patient': patient,
-        'consultations_validees': consultations_validees,
+        'evenements': evenements,
+        'curseur_suivant': curseur_suivant,
+        'premiere_page': not request.GET.get('apres'),
     }
     return render(request, 'patient_detail.html', context)
 